@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 from flask import Flask
 import hippo.util as c
+from hippo.config_mirror import start_config_mirror
 import logging
 import werkzeug.serving
 
@@ -31,6 +32,9 @@ def run(config):
 
     environment = config.get(c.HIPPO_ENVIRONMENT)
 
+    # - Keep a local copy of the hippo-sites repo, so configs are read off the disk instead of from GitHub
+    start_config_mirror(config)
+
     for i in range(REQUEST_THREAD_MAX):
         request_thread = Request(config)
         request_thread.setDaemon(True)
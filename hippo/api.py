@@ -1,19 +1,28 @@
 import datetime
 import copy
 import flask
+import hashlib
+import hmac
 import json
 import logging
+import mimetypes
 import os
 import time
 import uuid
 
 from flask_cors import CORS, cross_origin
 from hippo.action_field_configuration import actions
-from hippo.schemas.validate_schemas import validate_hippo_request, RequestValidationError
-from hippo.util import GITHUB_DIRECTORY, get_config_list, get_configuration_from_github, remove_basic_auth, get_all_github_branches, URL, RECIPIENTS, GITHUB_REPO, \
+from hippo import config_mirror
+from hippo.bundle import get_bundle_index, read_bundle_file
+from hippo.cache import get_cache_stats
+from hippo.github_config import get_config_list, get_configuration_from_github, get_pushed_files, refresh_configs
+from hippo.pdf_creator import get_build_pdf, get_build_record, BUILD_PDF_CREATING, get_build_image_list, BuildNotFoundException
+from hippo.schemas.validate_schemas import validate_hippo_request, get_validation_stats, RequestValidationError
+from hippo.util import GITHUB_DIRECTORY, remove_basic_auth, get_all_github_branches, URL, RECIPIENTS, GITHUB_REPO, \
     GITHUB_TOKEN, HIPPO_ENVIRONMENT,GITHUB_BRANCH, START_DATE, START_TIME, HIPPO_PORT, RHINO_HOST, PROJECT, BRANCH, \
-    WATERING_HOLE_CLIENT,HIPPO_SITES_PATH
+    WATERING_HOLE_CLIENT,HIPPO_SITES_PATH, HIPPO_CONFIG_CACHE_TTL, DEFAULT_CONFIG_CACHE_TTL, HIPPO_WEBHOOK_SECRET
 from hippo.request_thread import request_queue
+from hippo.storage import create_storage
 
 logger = logging.getLogger("Hippo API")
 
@@ -32,10 +41,21 @@ def status():
         "started": f"{start_date}",
         "run_time": f"{datetime.timedelta(seconds=time.time() - start_time)}",
         "queue_size": f"{request_queue.qsize()}",
+        "config_mirror": config_mirror.config_mirror.get_status() if config_mirror.config_mirror else None,
         "version": "2.0.1"
     }
     return flask.json.dumps(data), 200
 
+@cross_origin()
+def metrics():
+    """Returns 200, {"validation": <time spent validating each schema>, "caches": <size and hit rate of each cache>}"""
+    data = {
+        "validation": get_validation_stats(),
+        "caches": get_cache_stats(),
+        "queue_size": request_queue.qsize()
+    }
+    return flask.json.dumps(data), 200
+
 @cross_origin()
 def start_capture():
 
@@ -94,7 +114,8 @@ def get_configs():
             github_branch = "develop" if flask.current_app.config[HIPPO_ENVIRONMENT] not in ["prod"] else "production"
 
         headers = {"Authorization": f"token {flask.current_app.config[GITHUB_TOKEN]}"}
-        config_files = get_config_list(flask.current_app.config[GITHUB_REPO], github_branch, "sites", headers, flask.current_app.config.get(GITHUB_DIRECTORY))
+        config_files = get_config_list(flask.current_app.config[GITHUB_REPO], github_branch, "sites", headers, flask.current_app.config.get(GITHUB_DIRECTORY),
+                                       int(flask.current_app.config.get(HIPPO_CONFIG_CACHE_TTL, DEFAULT_CONFIG_CACHE_TTL)))
 
         logger.info(f"Config files {config_files}")
         # - Iterate through the returned files and format them into a {'project': <project>, 'branch': <branch>} format
@@ -134,7 +155,9 @@ def get_single_config(project, branch):
         token = flask.current_app.config[GITHUB_TOKEN]
         git_repo = flask.current_app.config[GITHUB_REPO]
 
-        config = get_configuration_from_github(project, branch, env, token, git_repo)
+        cache_ttl = int(flask.current_app.config.get(HIPPO_CONFIG_CACHE_TTL, DEFAULT_CONFIG_CACHE_TTL))
+
+        config = get_configuration_from_github(project, branch, env, token, git_repo, cache_ttl)
 
         return json.dumps(config), 200
 
@@ -150,6 +173,121 @@ def get_actions():
         message = f"Unexpected Error occurred while cathering the Action Configuration data | {e}"
         return flask.json.dumps({"message": message, "error": str(e)}), 500
 
+@cross_origin()
+def get_build_pdf_url(build_id):
+    """
+    Returns 200, {"status": "ready", "pdf_url": <link to the PDF>} once the PDF of a finished build exists. Otherwise the
+    PDF starts being created from the build's image list in the background, and 202, {"status": "creating"} is
+    returned until it is done
+    """
+    try:
+        s3_client = create_storage(flask.current_app.config)
+        status, pdf_url = get_build_pdf(s3_client, build_id)
+        if status == BUILD_PDF_CREATING:
+            return flask.json.dumps({"build_id": build_id, "status": status,
+                                     "message": "The PDF is being created, check back on this url for it"}), 202
+        return flask.json.dumps({"build_id": build_id, "status": status, "pdf_url": pdf_url}), 200
+
+    except BuildNotFoundException as e:
+        return flask.json.dumps({"message": f"No finished build found for {build_id!r}", "error": str(e)}), 404
+
+    except Exception as e:
+        message = f"Unexpected Error occurred while getting the PDF for build {build_id}: {e}"
+        logger.error(message)
+        return flask.json.dumps({"message": message, "error": str(e)}), 500
+
+@cross_origin()
+def get_build_image_list_json(build_id, pdf=False):
+    """
+    Returns the image list of a finished build, or of its PDF, in the json shape falcon reads. The list is built from the
+    build's manifest when it is asked for
+    """
+    try:
+        s3_client = create_storage(flask.current_app.config)
+        image_list = get_build_image_list(s3_client, get_build_record(s3_client, build_id), pdf)
+        return flask.json.dumps(image_list), 200
+
+    except BuildNotFoundException as e:
+        return flask.json.dumps({"message": f"No finished build found for {build_id!r}", "error": str(e)}), 404
+
+    except Exception as e:
+        message = f"Unexpected Error occurred while getting the image list for build {build_id}: {e}"
+        logger.error(message)
+        return flask.json.dumps({"message": message, "error": str(e)}), 500
+
+@cross_origin()
+def get_build_image(build_id, filename):
+    """
+    Serves a single image out of a build's bundle archive. Range requests are passed through to S3, so only the
+    requested bytes of the archive are read
+    """
+    try:
+        s3_client = create_storage(flask.current_app.config)
+        build_record = get_build_record(s3_client, build_id)
+        if not build_record.get("bundle"):
+            return flask.json.dumps({"message": f"Build {build_id!r} was not stored as a bundle"}), 404
+
+        file_entry = get_bundle_index(s3_client, build_record["s3_path"], build_record["bundle"]).get(filename)
+        if not file_entry:
+            return flask.json.dumps({"message": f"No image named {filename!r} in build {build_id!r}"}), 404
+
+        # - Only read the requested part of the image, when a range was asked for
+        start, end, status = 0, file_entry["size"] - 1, 200
+        requested_range = flask.request.range.range_for_length(file_entry["size"]) if flask.request.range else None
+        if requested_range:
+            start, end, status = requested_range[0], requested_range[1] - 1, 206
+
+        data = read_bundle_file(s3_client, build_record["s3_path"], build_record["bundle"], file_entry, start, end)
+        response = flask.Response(data, status=status,
+                                  mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream")
+        response.headers["Accept-Ranges"] = "bytes"
+        if status == 206:
+            response.headers["Content-Range"] = f"bytes {start}-{end}/{file_entry['size']}"
+        return response
+
+    except BuildNotFoundException as e:
+        return flask.json.dumps({"message": f"No finished build found for {build_id!r}", "error": str(e)}), 404
+
+    except Exception as e:
+        message = f"Unexpected Error occurred while getting {filename} from build {build_id}: {e}"
+        logger.error(message)
+        return flask.json.dumps({"message": message, "error": str(e)}), 500
+
+@cross_origin()
+def config_hook():
+    """
+    Drops the cached configs and action libraries that changed, so the next build uses the new ones. Takes a GitHub
+    push webhook, or a POST of {"branch", "projects", "libraries"} to refresh those by hand. Every request must be
+    signed with HIPPO_WEBHOOK_SECRET, the same way GitHub signs its webhooks, and the hook is turned off without it
+    """
+    try:
+        secret = flask.current_app.config.get(HIPPO_WEBHOOK_SECRET)
+        if not secret:
+            message = f"The config hook is turned off until {HIPPO_WEBHOOK_SECRET} is set"
+            return flask.json.dumps({"message": message}), 403
+
+        signature = "sha256=" + hmac.new(secret.encode(), flask.request.get_data(), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(signature, flask.request.headers.get("X-Hub-Signature-256", "")):
+            return flask.json.dumps({"message": "The webhook signature does not match"}), 401
+
+        if flask.request.headers.get("X-GitHub-Event") == "ping":
+            return flask.json.dumps({"message": "pong"}), 200
+
+        data = flask.request.get_json(silent=True) or {}
+        if data.get("ref"):
+            if not data["ref"].startswith("refs/heads/"):
+                return flask.json.dumps({"message": f"Ignoring the push to {data['ref']!r}"}), 200
+            result = refresh_configs(data["ref"][len("refs/heads/"):], changed_files=get_pushed_files(data))
+        else:
+            result = refresh_configs(data.get(BRANCH) or flask.current_app.config[GITHUB_BRANCH],
+                                     data.get("projects"), data.get("libraries"))
+        return flask.json.dumps(result), 200
+
+    except Exception as e:
+        message = f"Unexpected Error occurred while refreshing the configs: {e}"
+        logger.error(message)
+        return flask.json.dumps({"message": message, "error": str(e)}), 500
+
 
 def register(app):
     """Add endpoints"""
@@ -160,6 +298,8 @@ def register(app):
     CORS(app, resources={r"*": {"origins": "*"}})
     app.add_url_rule("/status", "status_no_slash", status, methods=["GET"])
     app.add_url_rule("/status/", "status", status, methods=["GET"])
+    app.add_url_rule("/metrics", "metrics_no_slash", metrics, methods=["GET"])
+    app.add_url_rule("/metrics/", "metrics", metrics, methods=["GET"])
     app.add_url_rule("/capture", "start_capture_no_slash", start_capture, methods=["POST"])
     app.add_url_rule("/capture/", "start_capture", start_capture, methods=["POST"])
     app.add_url_rule("/configs", "get_configs_no_slash", get_configs, methods=["GET"])
@@ -168,4 +308,13 @@ def register(app):
     app.add_url_rule("/config<project>/<branch>/", "get_a_single_config", get_single_config, methods=["GET"])
     app.add_url_rule("/tactics","get_branches",get_branches, methods=["GET"])
     app.add_url_rule("/actions", "get_actions_no_slash", get_actions, methods=["GET"])
-    app.add_url_rule("/actions/", "get_actions", get_actions, methods=["GET"])
\ No newline at end of file
+    app.add_url_rule("/actions/", "get_actions", get_actions, methods=["GET"])
+    app.add_url_rule("/build/<build_id>/pdf", "get_build_pdf_no_slash", get_build_pdf_url, methods=["GET"])
+    app.add_url_rule("/build/<build_id>/pdf/", "get_build_pdf", get_build_pdf_url, methods=["GET"])
+    app.add_url_rule("/build/<build_id>/image/<filename>", "get_build_image", get_build_image, methods=["GET"])
+    app.add_url_rule("/build/<build_id>/image_list", "get_build_image_list", get_build_image_list_json,
+                     methods=["GET"])
+    app.add_url_rule("/build/<build_id>/image_list/pdf", "get_build_pdf_image_list", get_build_image_list_json,
+                     methods=["GET"], defaults={"pdf": True})
+    app.add_url_rule("/hooks/config", "config_hook_no_slash", config_hook, methods=["POST"])
+    app.add_url_rule("/hooks/config/", "config_hook", config_hook, methods=["POST"])
\ No newline at end of file
@@ -0,0 +1,187 @@
+import collections
+import io
+import json
+import tarfile
+import threading
+
+from hippo.util import create_logger, BUILD_BUNDLE_FILENAME, BUILD_BUNDLE_INDEX_FILENAME
+from src.the_ark.s3_client import S3ClientException
+
+log = create_logger("Build Bundle")
+
+TAR_BLOCK_SIZE = tarfile.BLOCKSIZE
+# The number of parts of the archive sent up to S3 at the same time
+BUNDLE_UPLOAD_WORKERS = 4
+BUNDLE_INDEX_CACHE_SIZE = 32
+
+# Bundle indexes never change once they are written, so the most recently used ones are kept in memory
+bundle_index_cache = collections.OrderedDict()
+bundle_index_lock = threading.Lock()
+
+
+class BuildBundle:
+    """
+    Streams every image of a build into a single tar archive that is sent up to S3 as a multipart upload while the
+    build is running. The offset of each file in the archive is recorded in an index, which is stored next to the
+    archive so that single files can be read back out of it with range requests.
+
+    Only the tar framing is done while holding the lock. The finished parts of the archive are handed to the upload's
+    worker threads afterwards, so the screenshot threads do not wait behind each other's network requests.
+    """
+    def __init__(self, s3_client, s3_path, build_id, public_url=""):
+        """
+        :param
+            - s3_client:    S3Client - The client used to send the archive up to S3
+            - s3_path:      string - The S3 path to the folder the archive and its index are stored in
+            - build_id:     string - The build_id of the build the archive is for
+            - public_url:   string - The base url of this Hippo service, used to link to the images in the archive
+        """
+        self.s3_client = s3_client
+        self.s3_path = s3_path
+        self.build_id = build_id
+        self.public_url = public_url.rstrip("/")
+        self.files = {}
+        self.lock = threading.Lock()
+        self.closed = False
+
+        try:
+            self.upload = s3_client.open_multipart_upload(s3_path, BUILD_BUNDLE_FILENAME, "application/x-tar",
+                                                          max_workers=BUNDLE_UPLOAD_WORKERS)
+            self.tar = tarfile.open(fileobj=self.upload, mode="w|", format=tarfile.PAX_FORMAT)
+        except (S3ClientException, tarfile.TarError) as e:
+            raise BuildBundleException(f"Unable to start the bundle for build {build_id}: {e}")
+
+    def add_file(self, filename, file_data):
+        """
+        Adds a file to the end of the archive. Safe to call from any of the screenshot threads
+        :param
+            - filename:     string - The name of the file in the archive
+            - file_data:    BytesIO or bytes - The content of the file
+        :return
+            - string:   The url the file can be read from through the /build/<build_id>/image/<filename> endpoint
+        """
+        if isinstance(file_data, (bytes, bytearray)):
+            file_data = io.BytesIO(file_data)
+        file_data.seek(0, 2)
+        size = file_data.tell()
+        file_data.seek(0)
+
+        tar_info = tarfile.TarInfo(filename)
+        tar_info.size = size
+        with self.lock:
+            if self.closed:
+                raise BuildBundleException(f"Unable to add {filename} to the bundle after it has been closed")
+            self.tar.addfile(tar_info, file_data)
+            # The file's data ends the archive, padded out to a full tar block
+            self.files[filename] = {"offset": self.tar.offset - _padded_size(size), "size": size}
+
+        try:
+            self.upload.flush()
+        except S3ClientException as e:
+            raise BuildBundleException(f"Unable to send {filename} up to S3 in the bundle: {e}")
+        return self.get_file_url(filename)
+
+    def get_file_url(self, filename):
+        return f"{self.get_image_url()}/{filename}"
+
+    def get_image_url(self):
+        """
+        :return
+            - string:   The url the images in the archive are served under
+        """
+        return f"{self.public_url}/build/{self.build_id}/image"
+
+    def close(self):
+        """
+        Completes the upload and stores the index of the archive on S3. The image lists are stored next to the archive,
+        not in it
+        :return
+            - dict: The bundle record that is added to the build record
+        """
+        with self.lock:
+            self.closed = True
+            try:
+                self.tar.close()
+                self.upload.close()
+                index = {"bundle": BUILD_BUNDLE_FILENAME, "files": self.files}
+                self.s3_client.store_file(self.s3_path, io.BytesIO(json.dumps(index).encode("utf-8")),
+                                          BUILD_BUNDLE_INDEX_FILENAME, mime_type="application/json")
+            except (S3ClientException, tarfile.TarError) as e:
+                self.upload.abort()
+                raise BuildBundleException(f"Unable to finish the bundle for build {self.build_id}: {e}")
+
+        log.info(f"Sent the bundle for build {self.build_id} with {len(self.files)} files up to S3")
+        return {"name": BUILD_BUNDLE_FILENAME, "index": BUILD_BUNDLE_INDEX_FILENAME}
+
+    def abort(self):
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                try:
+                    self.upload.abort()
+                except Exception as e:
+                    log.warning(f"Unable to cancel the bundle upload for build {self.build_id}: {e}")
+
+
+def get_bundle_index(s3_client, s3_path, bundle_record):
+    """
+    :return
+        - dict: The {"offset", "size"} of every file in the bundle archive, keyed by filename
+    """
+    cache_key = (s3_client.bucket_name, s3_path, bundle_record["index"])
+    with bundle_index_lock:
+        if cache_key in bundle_index_cache:
+            bundle_index_cache.move_to_end(cache_key)
+            return bundle_index_cache[cache_key]
+
+    try:
+        files = json.load(s3_client.get_file(s3_path, bundle_record["index"]))["files"]
+    except (S3ClientException, ValueError, KeyError) as e:
+        raise BuildBundleException(f"Unable to read the bundle index in {s3_path}: {e}")
+
+    with bundle_index_lock:
+        bundle_index_cache[cache_key] = files
+        while len(bundle_index_cache) > BUNDLE_INDEX_CACHE_SIZE:
+            bundle_index_cache.popitem(last=False)
+    return files
+
+
+def read_bundle_file(s3_client, s3_path, bundle_record, file_entry, start=0, end=None):
+    """
+    Reads a file, or a range of bytes of it, out of the bundle archive on S3 with a single range request
+    :param
+        - file_entry:   dict - The file's {"offset", "size"} from the bundle index
+        - start:        int - The first byte of the file to read
+        - end:          int - The last byte of the file to read (inclusive). Defaults to the end of the file
+    :return
+        - bytes:    The requested bytes of the file
+    """
+    end = file_entry["size"] - 1 if end is None else min(end, file_entry["size"] - 1)
+    if file_entry["size"] == 0 or start > end:
+        return b""
+    return s3_client.get_file_range(s3_path, bundle_record["name"], file_entry["offset"] + start,
+                                    file_entry["offset"] + end)
+
+
+def download_bundle_file(s3_client, s3_path, bundle_record, file_entry, local_path):
+    """
+    Saves a file from the bundle archive on S3 to disk
+    :return
+        - string:   The path the file was saved to
+    """
+    with open(local_path, "wb") as local_file:
+        local_file.write(read_bundle_file(s3_client, s3_path, bundle_record, file_entry))
+    return local_path
+
+
+def _padded_size(size):
+    return -(-size // TAR_BLOCK_SIZE) * TAR_BLOCK_SIZE
+
+
+class BuildBundleException(Exception):
+    def __init__(self, message):
+        self.msg = message
+        self.message = message
+
+    def __str__(self):
+        return self.message
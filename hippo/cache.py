@@ -0,0 +1,185 @@
+import collections
+import concurrent.futures
+import threading
+import time
+
+from hippo.util import create_logger, CACHE_REFRESH_WORKERS
+
+log = create_logger("Cache")
+
+# Refreshes the stale entries that are handed out while they are reloaded
+refresh_executor = concurrent.futures.ThreadPoolExecutor(max_workers=CACHE_REFRESH_WORKERS)
+# Every cache that has been created, for the /metrics endpoint
+caches = []
+
+
+class CacheEntry:
+    """A cached value, along with the validators that were sent with it, used to check whether it has changed"""
+    def __init__(self, value, etag=None, last_modified=None):
+        self.value = value
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored = time.time()
+
+    def is_fresh(self, ttl):
+        return time.time() - self.stored < ttl
+
+    def get_conditional_headers(self):
+        """
+        :return
+            - dict: The If-None-Match/If-Modified-Since headers that ask the server to only send the value if it changed
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def refresh(self):
+        """Marks the entry as fresh again, once the server has said the value has not changed"""
+        self.stored = time.time()
+        return self
+
+
+class Cache:
+    """
+    A thread-safe, least recently used cache. Entries are kept past their ttl, so they can still be revalidated with
+    the server instead of being downloaded again, and only max_entries are ever kept.
+    """
+    def __init__(self, name, max_entries, ttl):
+        """
+        :param
+            - name:         string - The name of the cache, used in the logs
+            - max_entries:  int - The number of entries kept
+            - ttl:          int - The number of seconds an entry is used without being revalidated
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.loading = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        caches.append(self)
+
+    def get(self, key):
+        """
+        :return
+            - CacheEntry: The entry for the key, fresh or not, or None when nothing is cached for the key
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def get_or_load(self, key, load, ttl=None, refresh_in_background=False):
+        """
+        Returns the cached value for the key while it is fresh. Otherwise the value is loaded, and anyone else asking
+        for the same key while it loads waits for that load instead of starting their own
+        :param
+            - key:                      hashable - The key of the value
+            - load:                     function - Called with the stale CacheEntry (or None) and returns the new
+                                                   CacheEntry. It can return the stale entry refreshed, when the
+                                                   server says the value has not changed
+            - ttl:                      int - Overrides the cache's ttl
+            - refresh_in_background:    bool - Whether a stale value is returned straight away, while it is reloaded
+                                               on the refresh_executor for whoever asks next
+        :return
+            - The cached value
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry.is_fresh(ttl):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry.value
+
+            future = self.loading.get(key)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self.loading[key] = future
+
+            if entry and refresh_in_background:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            elif owner:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if entry and refresh_in_background:
+            if owner:
+                refresh_executor.submit(self._refresh, key, load, entry, future)
+            return entry.value
+
+        if not owner:
+            return future.result()
+
+        return self._load(key, load, entry, future)
+
+    def _refresh(self, key, load, entry, future):
+        try:
+            self._load(key, load, entry, future)
+        except Exception as e:
+            log.warning(f"Unable to refresh {key!r} in the {self.name} cache, the stale value is kept: {e}")
+
+    def _load(self, key, load, entry, future):
+        try:
+            entry = self.set(key, load(entry))
+            future.set_result(entry.value)
+            return entry.value
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.loading.pop(key, None)
+
+    def clear(self, key=None):
+        """Removes the entry for the key, or every entry when no key is given"""
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def clear_matching(self, matches):
+        """
+        Removes every entry whose key the function matches
+        :return
+            - list: The keys of the removed entries
+        """
+        with self.lock:
+            keys = [key for key in self.entries if matches(key)]
+            for key in keys:
+                del self.entries[key]
+        return keys
+
+    def get_hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get_stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.get_hit_rate(), 3)}
+
+
+def get_cache_stats():
+    """
+    :return
+        - dict: The size and hit rate of every cache, keyed by its name
+    """
+    return {cache.name: cache.get_stats() for cache in caches}
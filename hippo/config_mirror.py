@@ -0,0 +1,223 @@
+import base64
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+from hippo.util import create_logger, CONFIG_MIRROR_GIT_TIMEOUT, DEFAULT_CONFIG_MIRROR_INTERVAL, \
+    DEFAULT_CONFIG_MIRROR_PATH, GITHUB_DIRECTORY, GITHUB_TOKEN, HIPPO_CONFIG_MIRROR_INTERVAL, \
+    HIPPO_CONFIG_MIRROR_PATH, HIPPO_CONFIG_MIRROR_URL, HIPPO_ENVIRONMENT, HIPPO_SITES_PATH, get_github_branch
+
+log = create_logger("Config Mirror")
+
+# The mirror that the whole service reads configs from, once it has been started
+config_mirror = None
+
+
+def start_config_mirror(config):
+    """
+    Starts the mirror of the hippo-sites repo, unless the configs are already being read from a local GitHub directory.
+    The branch the builds read configs from by default is mirrored, and every other branch is read from GitHub
+    :param
+        - config:   dict - The Hippo service's configuration
+    :return
+        - ConfigMirror: The running mirror, or None when it was not started
+    """
+    global config_mirror
+    if config.get(GITHUB_DIRECTORY) and config.get(HIPPO_ENVIRONMENT) in ["local"]:
+        return None
+
+    repo_url = config.get(HIPPO_CONFIG_MIRROR_URL) or f"https://github.com/{HIPPO_SITES_PATH}.git"
+    branch = get_github_branch(config)
+    config_mirror = ConfigMirror(repo_url, branch, config.get(HIPPO_CONFIG_MIRROR_PATH, DEFAULT_CONFIG_MIRROR_PATH),
+                                 config.get(GITHUB_TOKEN),
+                                 int(config.get(HIPPO_CONFIG_MIRROR_INTERVAL, DEFAULT_CONFIG_MIRROR_INTERVAL)))
+    config_mirror.setDaemon(True)
+    config_mirror.start()
+    return config_mirror
+
+
+def get_mirror(branch):
+    """
+    :return
+        - ConfigMirror: The mirror, when it has synced the given branch. Otherwise None, and GitHub should be used
+    """
+    if config_mirror and config_mirror.branch == branch and config_mirror.revision:
+        return config_mirror
+    if config_mirror and config_mirror.branch != branch:
+        log.debug(f"Only the {config_mirror.branch!r} branch is mirrored, reading {branch!r} from GitHub")
+    return None
+
+
+class ConfigMirror(threading.Thread):
+    """
+    Keeps a shallow clone of a single branch of the hippo-sites repo up to date, so that configs and action libraries
+    are read off the disk instead of being requested from GitHub one file at a time. The clone is fetched every
+    interval, or straight away when a sync is requested.
+    """
+    def __init__(self, repo_url, branch, path, token=None, interval=DEFAULT_CONFIG_MIRROR_INTERVAL):
+        """
+        :param
+            - repo_url: string - The https url of the hippo-sites repo
+            - branch:   string - The branch of the repo to mirror
+            - path:     string - The folder the repo is cloned in to
+            - token:    string - The GitHub token used to clone the repo
+            - interval: int - The number of seconds between fetches
+        """
+        threading.Thread.__init__(self)
+        self.repo_url = repo_url
+        self.branch = branch
+        self.path = os.path.abspath(path)
+        self.token = token
+        self.interval = interval
+        self.revision = None
+        self.last_sync = None
+        self.sync_requested = threading.Event()
+        self.stopped = threading.Event()
+        # Held while the working tree is being updated, so a file is never read half written
+        self.lock = threading.RLock()
+        # Only one sync runs at a time, whether it was started by the interval or requested
+        self.sync_lock = threading.Lock()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.sync_requested.clear()
+            try:
+                self.sync()
+            except ConfigMirrorException as e:
+                log.warning(e)
+            self.sync_requested.wait(self.interval)
+
+    def request_sync(self):
+        """Has the mirror fetch the branch straight away, instead of waiting for the interval"""
+        self.sync_requested.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.sync_requested.set()
+
+    def sync(self):
+        """
+        Clones the branch, or fetches it and updates the working tree when it has already been cloned
+        :return
+            - list: The paths of the files that changed, relative to the root of the repo
+        """
+        with self.sync_lock:
+            return self._sync()
+
+    def _sync(self):
+        if not os.path.isdir(os.path.join(self.path, ".git")):
+            self._clone()
+            self.last_sync = time.time()
+            return self.list_files("")
+
+        self._git("fetch", "--depth", "1", "origin", self.branch)
+        new_revision = self._git("rev-parse", "FETCH_HEAD")
+        changed_files = []
+        if new_revision != self.revision:
+            old_revision = self.revision or self._git("rev-parse", "HEAD")
+            try:
+                changed_files = self._git("diff", "--name-only", old_revision, new_revision).splitlines()
+            except ConfigMirrorException:
+                # - The old commit may have been pruned from the shallow clone, so everything may have changed
+                changed_files = None
+            with self.lock:
+                self._git("reset", "--hard", new_revision)
+                self.revision = new_revision
+            log.info(f"Updated the {self.branch!r} config mirror to {new_revision[:8]}")
+            changed_files = self.list_files("") if changed_files is None else changed_files
+
+        self.last_sync = time.time()
+        return changed_files
+
+    def get_path(self, *parts):
+        """
+        :return
+            - string: The path to a file in the mirror
+        """
+        path = os.path.normpath(os.path.join(self.path, *parts))
+        if not path.startswith(self.path + os.sep) and path != self.path:
+            raise ConfigMirrorException(f"{os.path.join(*parts)!r} is outside of the config mirror")
+        return path
+
+    def list_files(self, directory):
+        """
+        :return
+            - list: The names of the files in the directory of the repo. Every file in the repo, relative to its root,
+                    when the directory is ""
+        """
+        with self.lock:
+            if directory:
+                directory_path = self.get_path(directory)
+                if not os.path.isdir(directory_path):
+                    return []
+                return sorted(f for f in os.listdir(directory_path) if os.path.isfile(os.path.join(directory_path, f)))
+            return sorted(os.path.relpath(os.path.join(root, f), self.path)
+                          for root, dirs, files in os.walk(self.path)
+                          if ".git" not in os.path.relpath(root, self.path).split(os.sep)
+                          for f in files)
+
+    def read_json(self, directory, filename):
+        """
+        :return
+            - The content of the json file, or None when there is no such file in the mirror
+        """
+        file_path = self.get_path(directory, filename)
+        with self.lock:
+            if not os.path.isfile(file_path):
+                return None
+            with open(file_path) as json_file:
+                return json.load(json_file)
+
+    def get_status(self):
+        return {"branch": self.branch, "revision": self.revision,
+                "last_sync": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.last_sync))
+                if self.last_sync else None}
+
+    def _clone(self):
+        if os.path.exists(self.path) and os.listdir(self.path):
+            raise ConfigMirrorException(f"Unable to clone the config mirror in to {self.path}, since the folder is "
+                                        f"not empty and is not a git repo")
+
+        clone_path = f"{self.path}.clone"
+        shutil.rmtree(clone_path, ignore_errors=True)
+        self._git("clone", "--depth", "1", "--single-branch", "--branch", self.branch, self.repo_url, clone_path,
+                  cwd=None)
+        with self.lock:
+            if os.path.exists(self.path):
+                os.rmdir(self.path)
+            os.rename(clone_path, self.path)
+            self.revision = self._git("rev-parse", "HEAD")
+        log.info(f"Cloned the {self.branch!r} branch of {self.repo_url} in to {self.path} at {self.revision[:8]}")
+
+    def _git(self, *args, cwd=""):
+        """
+        Runs a git command in the mirror. The token is passed in the environment, so it does not show up in the
+        process list or the repo's config
+        :return
+            - string: The output of the command
+        """
+        env = dict(os.environ, GIT_TERMINAL_PROMPT="0")
+        if self.token:
+            credentials = base64.b64encode(f"x-access-token:{self.token}".encode()).decode()
+            env.update({"GIT_CONFIG_COUNT": "1", "GIT_CONFIG_KEY_0": "http.extraHeader",
+                        "GIT_CONFIG_VALUE_0": f"Authorization: Basic {credentials}"})
+        try:
+            result = subprocess.run(["git", *args], cwd=self.path if cwd == "" else cwd, env=env, capture_output=True,
+                                    text=True, timeout=CONFIG_MIRROR_GIT_TIMEOUT, check=True)
+        except subprocess.CalledProcessError as e:
+            raise ConfigMirrorException(f"Unable to run 'git {args[0]}' for the config mirror: {e.stderr.strip()}")
+        except (OSError, subprocess.TimeoutExpired) as e:
+            raise ConfigMirrorException(f"Unable to run 'git {args[0]}' for the config mirror: {e}")
+        return result.stdout.strip()
+
+
+class ConfigMirrorException(Exception):
+    def __init__(self, message):
+        self.msg = message
+        self.message = message
+
+    def __str__(self):
+        return self.msg
@@ -0,0 +1,99 @@
+import atexit
+import json
+import threading
+import time
+
+from hippo.util import create_logger, DRIVER_POOL_MAX_IDLE, DRIVER_POOL_IDLE_TIMEOUT
+from src.the_ark.selenium_helpers import SeleniumHelpers
+
+log = create_logger("Driver Pool")
+
+
+class DriverPool:
+    """
+    Keeps browsers open between uses, so that short jobs (i.e. reading a sitemap that needs a login) do not have to
+    start a new browser every time. Browsers are only handed back out for the same desired capabilities and realm
+    (who the browser logs in as, and where) they were created with, since clearing the cookies when they are returned
+    only clears them for the site the browser is on. The sessions of single sign-on providers on other domains are kept.
+    """
+    def __init__(self, max_idle=DRIVER_POOL_MAX_IDLE, idle_timeout=DRIVER_POOL_IDLE_TIMEOUT):
+        """
+        :param
+            - max_idle:     int - The number of browsers kept open while they are not being used
+            - idle_timeout: int - The number of seconds a browser is kept open without being used
+        """
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.idle_drivers = []
+        self.lock = threading.Lock()
+
+    def acquire(self, browser_data, realm=None):
+        """
+        :param
+            - browser_data: dict - The desired capabilities of the browser
+            - realm:        Who the browser logs in as, and where (i.e. the AEM username and the site's base url).
+                            Browsers are never shared between realms
+        :return
+            - SeleniumHelpers: A SeleniumHelpers with a driver that is only used by the caller until it is released
+        """
+        key = _get_pool_key(browser_data, realm)
+        self._quit_expired_drivers()
+        with self.lock:
+            for idle_driver in self.idle_drivers:
+                if idle_driver["key"] == key:
+                    self.idle_drivers.remove(idle_driver)
+                    return idle_driver["selenium_helper"]
+
+        sh = SeleniumHelpers()
+        sh.create_driver(**browser_data)
+        sh.pool_key = key
+        return sh
+
+    def release(self, sh):
+        """
+        Hands a browser back to the pool. It is quit instead if it can no longer be used or the pool is full
+        """
+        try:
+            sh.driver.delete_all_cookies()
+            sh.load_url("about:blank", bypass_status_code_check=True)
+        except Exception as e:
+            log.debug(f"Quitting a browser that could not be reset: {e}")
+            self.discard(sh)
+            return
+
+        with self.lock:
+            if len(self.idle_drivers) < self.max_idle:
+                self.idle_drivers.append({"key": sh.pool_key, "selenium_helper": sh, "released": time.time()})
+                return
+        self.discard(sh)
+
+    def discard(self, sh):
+        """Quits a browser instead of handing it back to the pool"""
+        try:
+            sh.quit_driver()
+        except Exception as e:
+            log.debug(f"Unable to quit a pooled browser: {e}")
+
+    def close(self):
+        """Quits every browser in the pool"""
+        with self.lock:
+            idle_drivers, self.idle_drivers = self.idle_drivers, []
+        for idle_driver in idle_drivers:
+            self.discard(idle_driver["selenium_helper"])
+
+    def _quit_expired_drivers(self):
+        now = time.time()
+        with self.lock:
+            expired = [idle for idle in self.idle_drivers if now - idle["released"] > self.idle_timeout]
+            self.idle_drivers = [idle for idle in self.idle_drivers if idle not in expired]
+        for idle_driver in expired:
+            self.discard(idle_driver["selenium_helper"])
+
+
+def _get_pool_key(browser_data, realm=None):
+    return json.dumps([browser_data, realm], sort_keys=True, default=str)
+
+
+# The pool that the whole service shares
+driver_pool = DriverPool()
+atexit.register(driver_pool.close)
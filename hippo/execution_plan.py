@@ -0,0 +1,260 @@
+import copy
+import hashlib
+import json
+import math
+import time
+import traceback
+import types
+
+import hippo.util as c
+from hippo.actions import Action
+from hippo.cache import Cache, CacheEntry
+from src.the_ark.screen_capture import DEFAULT_SCROLL_PADDING
+
+log = c.create_logger("Execution Plan")
+
+# Plans are compiled once for each distinct config, environment and set of action libraries
+plan_cache = Cache("Execution Plan", c.EXECUTION_PLAN_CACHE_SIZE, math.inf)
+
+
+class Step:
+    """
+    A single action from a config, with the Action method that performs it already looked up. The action lists that
+    reference and external actions point to are looked up as well, when they all exist, and kept in referenced_steps
+    """
+    __slots__ = ["action_type", "action", "handler", "referenced_steps"]
+
+    def __init__(self, action):
+        self.action = action
+        self.action_type = action.get(c.ACTION_KEY) if isinstance(action, dict) else None
+        self.handler = getattr(Action, self.action_type, None) if isinstance(self.action_type, str) else None
+        self.referenced_steps = None
+
+    def run(self, action_class, element=None):
+        if self.referenced_steps is not None:
+            # - Each referenced list is dispatched on its own, as the reference and external actions do
+            for steps in self.referenced_steps:
+                action_class.t.dispatch_actions(steps)
+            return None
+        if self.handler is None:
+            # - Unknown actions are looked up when they are run, so they fail the same way they always have
+            return getattr(action_class, self.action[c.ACTION_KEY])(self.action, element)
+        return self.handler(action_class, self.action, element)
+
+
+class ExecutionPlan:
+    """
+    Everything a screenshot thread needs from a project config, worked out once for an environment. Each page's
+    actions are compiled into Steps, as are the actions of the before screenshot, the reference pages, the action
+    libraries and any actions nested inside other actions. The reference and external actions are then linked to the
+    compiled steps of the lists they point to, so that running them does not look the lists up again. A plan is
+    shared by every thread and every build that uses the same config, so nothing in it is changed once it is compiled.
+    """
+    def __init__(self, config, mobile, action_libraries, plan_hash=None):
+        """
+        :param
+            - config:           dict - The project config
+            - mobile:           bool - Whether the plan is for the mobile environment
+            - action_libraries: dict - The action libraries that the config references
+            - plan_hash:        string - The hash of the config, environment and libraries the plan was compiled from
+        """
+        # - The plan keeps its own copy, so the action lists it compiled are the ones it is asked to run
+        config = copy.deepcopy(config)
+        self.mobile = mobile
+        self.plan_hash = plan_hash
+        self.action_libraries = types.MappingProxyType(copy.deepcopy(action_libraries or {}))
+        self.paginated, self.footers, self.headers, self.browser_size, self.before_screenshot, self.scroll_padding, \
+            self.content_container_selector, self.detect_sticky_elements = parse_screenshot_thread_data(config, mobile)
+        self.common_actions, self.mobile_actions, self.desktop_actions, self.reference_actions = \
+            [types.MappingProxyType(actions) for actions in parse_action_data(config)]
+
+        self.compiled = {}
+        environment_actions = self.mobile_actions if mobile else self.desktop_actions
+        page_steps = {}
+        for path in set(self.common_actions) | set(environment_actions):
+            page_steps[path] = self._compile(self.common_actions.get(path, [])) + \
+                self._compile(environment_actions.get(path, []))
+        self.page_steps = types.MappingProxyType(page_steps)
+
+        if self.before_screenshot:
+            self._compile(self.before_screenshot.get(c.ACTION_LIST_KEY, []))
+        for action_list in self.reference_actions.values():
+            self._compile(action_list)
+        for library in self.action_libraries.values():
+            for action_list in library.values() if isinstance(library, dict) else []:
+                self._compile(action_list)
+
+        # - Every list that can be referenced has been compiled, so the references can be linked to them
+        for steps in list(self.compiled.values()):
+            for step in steps:
+                step.referenced_steps = self._get_referenced_steps(step)
+
+    def get_page_steps(self, path):
+        """
+        :return
+            - tuple: The steps to run on the page, or None when the page only gets a base capture
+        """
+        return self.page_steps.get(path)
+
+    def get_steps(self, action_list):
+        """
+        :return
+            - tuple: The compiled steps of one of the plan's action lists. Lists from outside the plan are compiled
+                     on the spot
+        """
+        steps = self.compiled.get(id(action_list))
+        return steps if steps is not None else tuple(Step(action) for action in action_list)
+
+    def _get_referenced_steps(self, step):
+        """
+        :return
+            - tuple: The compiled steps of each list a reference or external action points to, or None when it is not
+                     one of those actions or one of its lists is missing, so it runs (and logs the problem) as it always has
+        """
+        if step.action_type == c.REFERENCE_ACTION:
+            action_lists = self.reference_actions
+        elif step.action_type == c.EXTERNAL_REFERENCE_ACTION:
+            action_lists = self.action_libraries.get(step.action.get(c.LIBRARY_KEY))
+        else:
+            return None
+
+        references = step.action.get(c.REFERENCE_KEY)
+        references = references if isinstance(references, list) else [references]
+        if not isinstance(action_lists, (dict, types.MappingProxyType)) or \
+                not all(isinstance(reference, str) and isinstance(action_lists.get(reference), list)
+                        for reference in references):
+            return None
+        return tuple(self._compile(action_lists[reference]) for reference in references)
+
+    def _compile(self, action_list):
+        if not isinstance(action_list, list):
+            return ()
+        if id(action_list) not in self.compiled:
+            self.compiled[id(action_list)] = tuple(Step(action) for action in action_list)
+            # - Actions such as for_each run a list of actions of their own
+            for action in action_list:
+                if isinstance(action, dict) and isinstance(action.get(c.ACTION_LIST_KEY), list):
+                    self._compile(action[c.ACTION_LIST_KEY])
+        return self.compiled[id(action_list)]
+
+
+def get_execution_plan(config, mobile, action_libraries=None):
+    """
+    :return
+        - ExecutionPlan: The plan for the config in the environment, from the plan_cache when it has been compiled
+    """
+    key = hashlib.sha256(json.dumps([config, bool(mobile), action_libraries or {}], sort_keys=True,
+                                    default=str).encode("utf-8")).hexdigest()
+
+    def compile_plan(entry):
+        start_time = time.time()
+        plan = ExecutionPlan(config, mobile, action_libraries, key)
+        log.info(f"Compiled the {'mobile' if mobile else 'desktop'} execution plan for "
+                 f"{config.get(c.PROJECT, 'the project')} in {round((time.time() - start_time) * 1000, 1)}ms")
+        return CacheEntry(plan)
+
+    return plan_cache.get_or_load(key, compile_plan)
+
+
+def parse_screenshot_thread_data(config, mobile):
+    try:
+        # - Instantiate variables for cases where there is neither a desktop or mobile environment
+        paginated = False
+        footers = []
+        headers = []
+        config_browser_size = None
+        before_screenshot = None
+        scroll_padding = DEFAULT_SCROLL_PADDING
+        content_container_selector = "html"
+        detect_sticky_elements = True
+
+        # - Set Up Environment variables
+        # Set any common attributes
+        environments = config.get(c.ENVIRONMENTS, {})
+        common_config = environments.get(c.COMMON_ENVIRONMENT)
+        if common_config:
+            paginated = common_config.get(c.PAGINATED, paginated)
+            footers = common_config.get(c.FOOTERS, footers)
+            headers = common_config.get(c.HEADERS, headers)
+            config_browser_size = common_config.get(c.BROWSER_SIZE, config_browser_size)
+            scroll_padding = common_config.get(c.SCROLL_PADDING_KEY, scroll_padding)
+            detect_sticky_elements = common_config.get(c.DETECT_STICKY_ELEMENTS_KEY, detect_sticky_elements)
+            before_screenshot = common_config.get(c.BEFORE_SCREENSHOT_KEY, before_screenshot)
+            content_container_selector = common_config.get(c.CONTENT_CONTAINER_SELECTOR_KEY,
+                                                           content_container_selector)
+
+        # Overwrite environment parameters if they exist in the Mobile or Desktop environments
+        if mobile:
+            mobile_config = environments.get(c.MOBILE_ENVIRONMENT)
+            config_browser_size = c.DEFAULT_MOBILE_BROWSER_SIZE if not config_browser_size else config_browser_size
+            if mobile_config:
+                paginated = mobile_config.get(c.PAGINATED, paginated)
+                footers = mobile_config.get(c.FOOTERS, footers)
+                headers = mobile_config.get(c.HEADERS, headers)
+                config_browser_size = mobile_config.get(c.BROWSER_SIZE, config_browser_size)
+                scroll_padding = mobile_config.get(c.SCROLL_PADDING_KEY, scroll_padding)
+                detect_sticky_elements = mobile_config.get(c.DETECT_STICKY_ELEMENTS_KEY, detect_sticky_elements)
+                before_screenshot = mobile_config.get(c.BEFORE_SCREENSHOT_KEY, before_screenshot)
+                content_container_selector = mobile_config.get(c.CONTENT_CONTAINER_SELECTOR_KEY,
+                                                               content_container_selector)
+        else:
+            desktop_config = environments.get(c.DESKTOP_ENVIRONMENT)
+            config_browser_size = c.DEFAULT_DESKTOP_BROWSER_SIZE if not config_browser_size else config_browser_size
+            if desktop_config:
+                paginated = desktop_config.get(c.PAGINATED, paginated)
+                footers = desktop_config.get(c.FOOTERS, footers)
+                headers = desktop_config.get(c.HEADERS, headers)
+                config_browser_size = desktop_config.get(c.BROWSER_SIZE, config_browser_size)
+                scroll_padding = desktop_config.get(c.SCROLL_PADDING_KEY, scroll_padding)
+                detect_sticky_elements = desktop_config.get(c.DETECT_STICKY_ELEMENTS_KEY, detect_sticky_elements)
+                before_screenshot = desktop_config.get(c.BEFORE_SCREENSHOT_KEY, before_screenshot)
+                content_container_selector = desktop_config.get(c.CONTENT_CONTAINER_SELECTOR_KEY,
+                                                                content_container_selector)
+
+        if all(env not in environments.keys() for env in [c.MOBILE_ENVIRONMENT, c.DESKTOP_ENVIRONMENT]):
+            log.warn(f"This project's configuration file does not have a {c.DESKTOP_ENVIRONMENT!r} or {c.MOBILE_ENVIRONMENT} environment.")
+
+        return paginated, footers, headers, config_browser_size, before_screenshot, scroll_padding, \
+               content_container_selector, detect_sticky_elements
+
+    except KeyError as key:
+        message = f"The key {key} is missing from the config data"
+        raise c.MissingKey(message, key, stacktrace=traceback.format_exc(),
+                           details={"missing_key": str(key)})
+
+    except Exception as e:
+        # Catch all messages coming in and format the message to include the setup method location
+        message = f"Problem encountered while gathering the environment variables for the run: {e}"
+        raise c.HippoThreadError(message, stacktrace=traceback.format_exc())
+
+
+def parse_action_data(config):
+    common_actions = {}
+    mobile_actions = {}
+    desktop_actions = {}
+    reference_actions = {}
+
+    # - Parse out the different actions by environment
+    try:
+        environments = config.get(c.ENVIRONMENTS, {})
+
+        for environment, actions in [(c.COMMON_ENVIRONMENT, common_actions), (c.MOBILE_ENVIRONMENT, mobile_actions),
+                                     (c.DESKTOP_ENVIRONMENT, desktop_actions),
+                                     (c.REFERENCE_ENVIRONMENT, reference_actions)]:
+            if environment in environments:
+                for page in environments[environment].get(c.PAGES, []):
+                    if type(page[c.PATH_KEY]) is list:
+                        for path in page[c.PATH_KEY]:
+                            actions[path] = page[c.ACTION_LIST_KEY]
+                    else:
+                        actions[page[c.PATH_KEY]] = page[c.ACTION_LIST_KEY]
+
+        return common_actions, mobile_actions, desktop_actions, reference_actions
+
+    except KeyError as key:
+        message = f"The key {key!r} was missing from the config data while parsing the action lists"
+        raise c.MissingKey(message, key, stacktrace=traceback.format_exc(), details={"missing_key": str(key)})
+
+    except Exception as e:
+        message = f"Unexpected error while parsing the action list | {e}"
+        raise c.HippoThreadError(message, stacktrace=traceback.format_exc())
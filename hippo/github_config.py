@@ -0,0 +1,278 @@
+import concurrent.futures
+import json
+import logging
+import os
+import requests
+import threading
+import time
+
+from hippo import config_mirror
+
+from hippo.cache import Cache, CacheEntry
+from hippo.config_mirror import get_mirror, ConfigMirrorException
+from hippo.util import create_logger, HippoGeneralException, CONFIG_CACHE_SIZE, DEFAULT_CONFIG_CACHE_TTL, \
+    ACTION_KEY, EXTERNAL_REFERENCE_ACTION, LIBRARY_KEY, ACTION_LIBRARY_FETCH_WORKERS
+
+log = create_logger("Github Config")
+logger = logging.getLogger(__name__)
+
+# The configs and config listings fetched from Github, kept so that every build does not use up the API rate limit.
+# 304 responses to the conditional requests do not count against the rate limit
+config_cache = Cache("Config", CONFIG_CACHE_SIZE, DEFAULT_CONFIG_CACHE_TTL)
+
+
+def get_config_list(repo, branch, directory, headers, local_path=None, cache_ttl=None):
+    """
+    :param
+        - repo:         string - The Github repo the configs are in
+        - branch:       string - The branch of the repo to look on
+        - directory:    string - The directory of the repo to list
+        - headers:      dict - The headers, with the Github token, used to talk to Github
+        - local_path:   string - A local copy of the repo to list instead
+        - cache_ttl:    int - The number of seconds a listing is used from the config_cache without checking whether
+                              it has changed. Defaults to the cache's ttl
+    :return
+        - list: The names of the files in the directory
+    """
+    config_files = []
+    if local_path:
+        local_sites_path = os.path.join(local_path, directory)
+        found_files = [f for f in os.listdir(local_sites_path)
+                       if os.path.isfile(os.path.join(local_sites_path, f))]
+        for file_name in found_files:
+            if file_name.endswith(".json"):
+                config_files.append(file_name)
+    elif get_mirror(branch):
+        config_files = get_mirror(branch).list_files(directory)
+    else:
+        # sites_path = "/repos/meltmedia/{}/contents/{}?ref={}".format(repo, directory, branch)
+        sites_path = f"repos/{repo}/meltmedia/contents/hippo-sites/{directory}?ref={branch}"
+        config_list = json.loads(_get_github_file(("list", repo, branch, directory),
+                                                  f"https://api.github.com/{sites_path}", headers, cache_ttl))
+        for config in config_list:
+            config_files.append(config["name"])
+
+    logger.info(f"Config file {config_files}")
+    return config_files
+
+
+def get_configuration_from_github(project, github_branch, environment, github_token, github_repo, cache_ttl=None):
+    config_filename = f"{project}.json"
+    project_config = None
+
+    headers = {"Authorization": f"token {github_token}"}
+
+    # - Read the config off the disk when the branch is mirrored
+    mirror = get_mirror(github_branch)
+    if mirror:
+        project_config = mirror.read_json("sites", config_filename)
+        if project_config is None:
+            _raise_missing_config(project)
+        return project_config
+
+    # Get a list of all configs available for Hippo (on this environment's branch)
+    try:
+        config_list = get_config_list(github_repo, github_branch, "sites", headers, cache_ttl=cache_ttl)
+        logger.info(f"Config lists {config_list}")
+    except Exception as e:
+        message = f"Unable to fetch the config list for the {github_branch!r} branch: {e}"
+        log.error(message)
+        raise HippoGeneralException(message)
+
+    # - Check whether a config file exists for theis project and branch combination
+    if config_filename in config_list:
+        pass
+    else:
+        _raise_missing_config(project)
+
+    # - Request the config data
+    repo_path = f"{github_repo}/meltmedia/{github_branch}/hippo-sites/sites/{config_filename}"
+
+    # Load the response data into a json object. Each build gets its own copy, since the config is changed as it is used
+    project_config = json.loads(_get_github_file(("config", github_repo, github_branch, project),
+                                                 f"https://raw.githubusercontent.com/{repo_path}", headers, cache_ttl,
+                                                 "config file", repo_path))
+
+    return project_config
+
+
+def get_action_libraries(repo, branch, headers, library_names, local_path=None, cache_ttl=None, library_stats=None):
+    """
+    Loads the action libraries, along with any libraries that their actions reference in turn. The libraries are
+    fetched concurrently, and stale copies in the config_cache are used straight away while they are refreshed in
+    the background, since they so rarely change
+    :param
+        - repo:             string - The Github repo the action libraries are in
+        - branch:           string - The branch of the repo to look on
+        - headers:          dict - The headers, with the Github token, used to talk to Github
+        - library_names:    set - The names of the libraries to load
+        - local_path:       string - The local folder to read the libraries from instead of Github
+        - cache_ttl:        int - The number of seconds a library is used before it is refreshed
+        - library_stats:    dict - Filled in with the number of libraries that were "cached" and "fetched"
+    :return
+        - dict: The content of each library that exists, keyed by its name
+    """
+    library_stats = {} if library_stats is None else library_stats
+    library_stats.setdefault("mirror", 0)
+    library_stats.setdefault("cached", 0)
+    library_stats.setdefault("fetched", 0)
+    stats_lock = threading.Lock()
+
+    def fetch(library_name):
+        if local_path:
+            library_path = os.path.join(local_path, f"{library_name}.json")
+            if not os.path.isfile(library_path):
+                return None
+            with open(library_path) as action_library:
+                return json.load(action_library)
+
+        mirror = get_mirror(branch)
+        if mirror:
+            with stats_lock:
+                library_stats["mirror"] += 1
+            return mirror.read_json("action_libraries", f"{library_name}.json")
+
+        key = ("library", repo, branch, library_name)
+        repo_path = f"/meltmedia/{repo}/{branch}/action_libraries/{library_name}.json"
+        # - Any cached copy is used, even a stale one
+        cached = config_cache.get(key) is not None
+        try:
+            content = _get_github_file(key, f"https://raw.githubusercontent.com{repo_path}", headers, cache_ttl,
+                                       "action library", repo_path, refresh_in_background=True)
+        except HippoGeneralException:
+            # - A library that does not exist is reported when an action tries to use it
+            return None
+        with stats_lock:
+            library_stats["cached" if cached else "fetched"] += 1
+        return json.loads(content)
+
+    action_dict = {}
+    requested = set()
+    library_names = set(library_names)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=ACTION_LIBRARY_FETCH_WORKERS) as executor:
+        while library_names:
+            requested.update(library_names)
+            for library_name, library_content in zip(library_names, executor.map(fetch, library_names)):
+                if library_content is not None:
+                    action_dict[library_name] = library_content
+            library_names = get_external_libraries(list(action_dict.values())) - requested
+
+    return action_dict
+
+
+def refresh_configs(branch, projects=None, libraries=None, changed_files=None):
+    """
+    Drops the cached copies of the project configs and action libraries that changed on the branch, so the next build
+    gets the new ones. When the branch is mirrored, the mirror is synced first and the files that changed in it are
+    dropped as well. Everything cached for the branch is dropped when no changes are given and none are found
+    :param
+        - branch:           string - The branch that changed
+        - projects:         list - The names of the projects whose configs changed
+        - libraries:        list - The names of the action libraries that changed
+        - changed_files:    list - The paths of the files that changed in the hippo-sites repo
+    :return
+        - dict: The "invalidated" cache keys, the "mirror" revision and the number of "seconds" the refresh took
+    """
+    start_time = time.time()
+    projects = set(projects or [])
+    libraries = set(libraries or [])
+    changed_files = list(changed_files or [])
+
+    mirror = config_mirror.config_mirror
+    if mirror and mirror.branch == branch:
+        try:
+            changed_files.extend(mirror.sync())
+        except ConfigMirrorException as e:
+            log.warning(f"Unable to sync the config mirror while refreshing the configs: {e}")
+
+    for changed_file in changed_files:
+        directory, _, filename = changed_file.rpartition("/")
+        directory = directory.rpartition("/")[2]
+        if filename.endswith(".json") and directory == "sites":
+            projects.add(filename[:-len(".json")])
+        elif filename.endswith(".json") and directory == "action_libraries":
+            libraries.add(filename[:-len(".json")])
+
+    everything = not (projects or libraries or changed_files)
+
+    def matches(key):
+        kind, repo, key_branch, name = key
+        if key_branch != branch:
+            return False
+        return everything or (kind == "config" and name in projects) or \
+            (kind == "library" and name in libraries) or \
+            (kind == "list" and (name == "sites" and projects or name == "action_libraries" and libraries))
+
+    invalidated = config_cache.clear_matching(matches)
+    log.info(f"Refreshed the configs on {branch!r}, dropping {len(invalidated)} cached entries")
+    return {"branch": branch, "mirror": mirror.revision if mirror and mirror.branch == branch else None,
+            "invalidated": ["/".join(key) for key in invalidated], "seconds": round(time.time() - start_time, 3)}
+
+
+def get_pushed_files(payload):
+    """
+    :param
+        - payload:  dict - The payload of a GitHub push webhook
+    :return
+        - list: The paths of every file added, modified or removed by the push
+    """
+    changed_files = []
+    for commit in payload.get("commits") or []:
+        for change in ["added", "modified", "removed"]:
+            changed_files.extend(commit.get(change) or [])
+    return changed_files
+
+
+def _raise_missing_config(project):
+    # A config for this project does not exist. Throw an error and freak out!
+    message = f"There does not appear to be a Hippo config on Github for the project {project!r}. " \
+              "Please speak with your QA representative to troubleshoot the issue."
+    log.error(message)
+    raise HippoGeneralException(message)
+
+
+def get_external_libraries(config):
+    """
+    :return
+        - set: The names of the action libraries that the config's external actions reference
+    """
+    libraries = set()
+    if isinstance(config, dict):
+        if config.get(ACTION_KEY) == EXTERNAL_REFERENCE_ACTION and isinstance(config.get(LIBRARY_KEY), str):
+            libraries.add(config[LIBRARY_KEY])
+        for value in config.values():
+            libraries.update(get_external_libraries(value))
+    elif isinstance(config, list):
+        for value in config:
+            libraries.update(get_external_libraries(value))
+    return libraries
+
+
+def _get_github_file(key, url, headers, cache_ttl=None, description="directory listing", repo_path=None,
+                     refresh_in_background=False):
+    """
+    Gets a file from Github through the config_cache. Once the cached copy is older than the ttl, it is only
+    downloaded again if its ETag has changed, and builds asking for the same file at once share the one request
+    :param
+        - refresh_in_background:    bool - Whether a stale copy is returned while it is refreshed in the background
+    :return
+        - bytes: The content of the file
+    """
+    def load(entry):
+        resp = requests.get(url, headers=dict(headers, **entry.get_conditional_headers()) if entry else headers)
+        logging.info(f"API URL Response from Github {resp.status_code}")
+        if resp.status_code == 304 and entry:
+            return entry.refresh()
+
+        # Check that the respone had a good status code
+        if resp.status_code > 400:
+            message = f"A bad status code of {resp.status_code} was returned when attempting to grab the " \
+                      f"{description} at {repo_path or url}. Please see your QA rep for help troubleshooting this " \
+                      f"issue: {resp.text}"
+            log.error(message)
+            raise HippoGeneralException(message)
+
+        return CacheEntry(resp.content, etag=resp.headers.get("ETag"),
+                          last_modified=resp.headers.get("Last-Modified"))
+
+    return config_cache.get_or_load(key, load, cache_ttl, refresh_in_background)
@@ -0,0 +1,153 @@
+import requests
+from bs4 import BeautifulSoup
+from urllib.parse import urljoin, urlparse
+
+from hippo.util import create_logger, check_if_author, check_if_dispatch, parse_base_url, parse_domain, \
+    HippoGeneralException, GENE_SAML_LOGIN_INDICATOR
+
+log = create_logger("HTTP Login")
+
+AEM_LOGIN_PAGE_PATH = "/libs/granite/core/content/login.html"
+AEM_LOGIN_PATH = AEM_LOGIN_PAGE_PATH + "/j_security_check"
+AEM_LOGIN_ERROR_PAGE = "login.error.html"
+SAML_RESPONSE_FIELD = "SAMLResponse"
+# The login form, then the SAML response form that the identity provider sends back, plus a little extra for
+# identity providers that add a step
+MAX_LOGIN_STEPS = 4
+USERNAME_FIELD_HINTS = ["user", "login", "email"]
+
+
+def create_session(pool_size, pool_block=True):
+    """
+    :param
+        - pool_size:    int - The number of connections kept open to each host
+        - pool_block:   bool - Whether requests wait for a free connection instead of opening more than pool_size
+    :return
+        - requests.Session: A session that does not verify certificates, the same as the rest of Hippo's requests
+    """
+    session = requests.Session()
+    session.verify = False
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=pool_block)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def is_login_redirect(response):
+    """
+    Whether a request was redirected off to a login page instead of the page that was asked for. Other redirects,
+    such as from the apex domain to www, are followed like any other
+    """
+    if not response.history:
+        return False
+    return is_login_url(response.url) or _find_login_form(response) is not None
+
+
+def is_login_url(url):
+    """Whether the url is a SAML identity provider's or AEM's login page"""
+    parsed_url = urlparse(url)
+    return any(indicator in parsed_url.netloc.lower() or indicator in parsed_url.path.lower()
+               for indicator in GENE_SAML_LOGIN_INDICATOR) or parsed_url.path.startswith(AEM_LOGIN_PAGE_PATH)
+
+
+def _can_submit_credentials(url):
+    """Whether the AEM username and password can be filled in to a login form at the url"""
+    return is_login_url(url) or check_if_author(url) or check_if_dispatch(url)
+
+
+def login(session, url, base_url, username, password):
+    """
+    Logs the session in to an AEM author environment, or through the SAML login form the url redirects to. The
+    session's cookies are then used for every request made with it
+    :param
+        - session:  requests.Session - The session to log in
+        - url:      string - The url that needs the login to be read
+        - base_url: string - The base url of the site
+        - username: string - The AEM username
+        - password: string - The AEM password
+    :return
+        - bool: Whether the url can now be read with the session. The caller should fall back to a browser when False,
+                which is also the case when no username or password were provided
+    """
+    if not username or not password:
+        log.info(f"No AEM username or password were provided to log in to {base_url} over http")
+        return False
+
+    try:
+        if check_if_author(url) or check_if_dispatch(url):
+            _aem_login(session, base_url, username, password)
+            if _can_read(session, url):
+                return True
+
+        response = session.get(url)
+        for _ in range(MAX_LOGIN_STEPS):
+            if AEM_LOGIN_ERROR_PAGE in response.url:
+                raise HippoGeneralException("Unable to successfully log in.")
+
+            # - The forms are checked first, since the identity provider's pages can come back as a 200 as well
+            form = _find_login_form(response)
+            if not form:
+                break
+            # - The credentials are only ever sent to the identity provider's or AEM's own login pages
+            if form.find("input", {"type": "password"}) and not _can_submit_credentials(response.url):
+                log.warning(f"Not submitting the AEM credentials to the login form at {parse_domain(response.url)}")
+                break
+            log.debug(f"Submitting the login form at {response.url}")
+            response = _submit_form(session, response.url, form, username, password)
+
+        return _can_read(session, url)
+
+    except requests.RequestException as e:
+        log.warning(f"Unable to log in to {base_url} over http: {e}")
+        return False
+
+
+def _aem_login(session, base_url, username, password):
+    response = session.post(urljoin(parse_base_url(base_url), AEM_LOGIN_PATH),
+                            data={"j_username": username, "j_password": password, "j_validate": "true",
+                                  "_charset_": "utf-8"})
+    if response.status_code == 403:
+        raise HippoGeneralException("Unable to successfully log in.")
+    log.info(f"Logged in to {parse_base_url(base_url)} over http")
+
+
+def _can_read(session, url):
+    response = session.get(url, stream=True)
+    response.close()
+    return response.status_code == 200 and not is_login_redirect(response)
+
+
+def _find_login_form(response):
+    """
+    :return
+        - Tag: The form on the page with a password field, or the SAML response form that passes the login back to
+               the site, if there is one
+    """
+    if "html" not in response.headers.get("Content-Type", ""):
+        return None
+    soup = BeautifulSoup(response.text, "html.parser")
+    for form in soup.find_all("form"):
+        if form.find("input", {"type": "password"}) or form.find("input", {"name": SAML_RESPONSE_FIELD}):
+            return form
+    return None
+
+
+def _submit_form(session, page_url, form, username, password):
+    data = {}
+    for field in form.find_all("input"):
+        name = field.get("name")
+        if not name:
+            continue
+        field_type = (field.get("type") or "text").lower()
+        if field_type == "password":
+            data[name] = password
+        elif field_type in ["text", "email"] and any(hint in (name + (field.get("id") or "")).lower()
+                                                     for hint in USERNAME_FIELD_HINTS):
+            data[name] = username
+        elif field_type not in ["button", "checkbox", "radio"] or field.has_attr("checked"):
+            data[name] = field.get("value", "")
+
+    action = urljoin(page_url, form.get("action") or page_url)
+    if (form.get("method") or "get").lower() == "post":
+        return session.post(action, data=data)
+    return session.get(action, params=data)
@@ -0,0 +1,305 @@
+import concurrent.futures
+import copy
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+from hippo import http_login
+from hippo.bundle import get_bundle_index, download_bundle_file, BuildBundleException
+from hippo.util import create_logger, parse_domain, MISC_PATH_TEXT, INCREMENTAL_STATE_PATH, \
+    INCREMENTAL_HEAD_WORKERS, INCREMENTAL_HEAD_TIMEOUT
+from src.the_ark.s3_client import S3ClientException
+
+log = create_logger("Incremental Capture")
+
+# Hashes what a visitor would see on the page, rather than its full html, which usually has tokens and timestamps
+# in it that change on every load
+DOM_HASH_SCRIPT = """
+return [
+    document.title,
+    document.body ? document.body.innerText : "",
+    Array.from(document.images, function(image) { return image.currentSrc || image.src; }).join("|"),
+    Array.from(document.styleSheets, function(sheet) { return sheet.href || ""; }).join("|")
+].join("\\n");
+"""
+
+# - How the pages were found to be unchanged
+LASTMOD = "lastmod"
+HTTP_VALIDATORS = "http_validators"
+DOM_HASH = "dom_hash"
+
+
+def get_capture_fingerprint(plan_hash, browser_name, browser_size, file_extension):
+    """
+    :return
+        - string: A hash of everything that changes how the pages are captured. Images from a build with a different
+                  fingerprint would not match the ones this build captures, so they are never reused
+    """
+    fingerprint = [plan_hash, browser_name, dict(browser_size or {}), file_extension]
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def get_state_path(project, branch, test_url, mobile):
+    """
+    :return
+        - string: The S3 path to the folder the state of the project's last build is stored in
+        - string: The name of the state file
+    """
+    state_path = INCREMENTAL_STATE_PATH.format(project=project, branch=branch, environment=parse_domain(test_url))
+    return state_path, f"{'mobile' if mobile else 'desktop'}.json"
+
+
+class IncrementalCapture:
+    """
+    Keeps track of what each page looked like in the last successful build of a project, branch and environment, so
+    that the pages that have not changed since then can keep their images instead of being captured again.
+
+    A page is unchanged when its sitemap <lastmod> is the same as it was, otherwise when its ETag/Last-Modified
+    headers (from concurrent HEAD requests) are the same, and otherwise when a hash of its DOM is the same once it has
+    been loaded. The state is only read and recorded by builds that have enabled set, so the first of them captures
+    every page. The state is ignored when the last build was captured with a different plan, browser, browser size or
+    file extension.
+    """
+    def __init__(self, s3_client, project, branch, test_url, mobile, s3_path, local_path, enabled=False,
+                 fingerprint=None):
+        """
+        :param
+            - s3_client:    S3Client - Where the state and images of the builds are stored
+            - project:      string - The project being captured
+            - branch:       string - The branch being captured
+            - test_url:     string - The url of the environment being captured
+            - mobile:       bool - Whether this is a mobile build
+            - s3_path:      string - The S3 path of this build's images
+            - local_path:   string - The local folder this build's images are saved in
+            - enabled:      bool - Whether unchanged pages are skipped in this build
+            - fingerprint:  string - The capture fingerprint of this build, from get_capture_fingerprint()
+        """
+        self.s3_client = s3_client
+        self.fingerprint = fingerprint
+        self.state_path, self.state_filename = get_state_path(project, branch, test_url, mobile)
+        self.s3_path = s3_path
+        self.local_path = local_path
+        self.enabled = enabled
+        self.previous = self._load_state() if enabled else None
+        self.page_states = {}
+        self.unchanged = {}
+        self.needs_dom_check = set()
+        self.reused_pages = 0
+        self.lock = threading.Lock()
+
+    def select_pages(self, image_list, page_lastmods=None):
+        """
+        Works out which pages have not changed since the last build, from their sitemap <lastmod> or, when there is
+        none, from the ETag/Last-Modified headers of a HEAD request to them. The pages that neither can tell about
+        are checked with a hash of their DOM once they are loaded
+        :param
+            - image_list:       dict - The image_list of this build
+            - page_lastmods:    dict - The sitemap <lastmod> of each path
+        """
+        page_lastmods = page_lastmods or {}
+        pages = [page for page in image_list["image_list"] if page["url"] != MISC_PATH_TEXT]
+        for page in pages:
+            if page["path"] in page_lastmods:
+                self._get_page_state(page["path"])[LASTMOD] = page_lastmods[page["path"]]
+
+        if not self.enabled:
+            return
+
+        # - The headers are still recorded when there is no previous build, for the next build to compare against
+        head_pages = []
+        for page in pages:
+            lastmod = self.page_states.get(page["path"], {}).get(LASTMOD)
+            if not lastmod:
+                head_pages.append(page)
+            elif lastmod == (self._get_previous_page(page["path"]) or {}).get(LASTMOD):
+                self.unchanged[page["path"]] = LASTMOD
+
+        if head_pages:
+            self._check_http_validators(head_pages)
+
+        if self.previous:
+            log.info(f"{len(self.unchanged)} of {len(pages)} pages are unchanged since build "
+                     f"{self.previous.get('build_id')}, {len(self.needs_dom_check)} will be checked once they are "
+                     f"loaded")
+        else:
+            log.info("There is no previous build to compare against, so every page will be captured")
+
+    def is_unchanged(self, path):
+        return path in self.unchanged
+
+    def check_dom_hash(self, path, dom_text):
+        """
+        Records the hash of the page's DOM
+        :return
+            - bool: Whether the page is unchanged, going by the hash of its DOM
+        """
+        dom_hash = hashlib.sha256(dom_text.encode("utf-8")).hexdigest()
+        self._get_page_state(path)[DOM_HASH] = dom_hash
+        if path in self.needs_dom_check and dom_hash == self._get_previous_page(path).get(DOM_HASH):
+            self.unchanged[path] = DOM_HASH
+            return True
+        return False
+
+    def reuse_page(self, page_object, misc_page, bundle=None):
+        """
+        Adds the images from the last build to the page. The images keep pointing at the last build, unless they were
+        in its bundle, or this build has a bundle, in which case they are copied in to this build. Each image is also
+        saved locally, for the PDF
+        :param
+            - page_object:  dict - The page in this build's image_list
+            - misc_page:    dict - The misc page in this build's image_list
+            - bundle:       BuildBundle - This build's bundle, if it has one
+        :return
+            - bool: Whether the images were reused. The page should be captured when False
+        """
+        previous_page = self._get_previous_page(page_object["path"])
+        try:
+            page_images = [self._reuse_image(image_data, page_object["url"], bundle)
+                           for image_data in previous_page.get("image_data", [])]
+            misc_images = [self._reuse_image(image_data, page_object["url"], bundle)
+                           for image_data in previous_page.get("misc_image_data", [])]
+        except (S3ClientException, BuildBundleException, OSError, KeyError) as e:
+            log.warning(f"Unable to reuse the images of {page_object['path']!r}, it will be captured instead: {e}")
+            return False
+
+        page_object["image_data"].extend(page_images)
+        misc_page["image_data"].extend(misc_images)
+        # - Carry the validators forward, so the page can be compared against them again in the next build
+        page_state = self._get_page_state(page_object["path"])
+        for key in [LASTMOD, DOM_HASH, "etag", "last_modified"]:
+            if key not in page_state and previous_page.get(key):
+                page_state[key] = previous_page[key]
+        with self.lock:
+            self.reused_pages += 1
+        log.info(f"Reused {len(page_images)} images of {page_object['path']!r}, which is unchanged "
+                 f"({self.unchanged.get(page_object['path'])})")
+        return True
+
+    def get_stats(self, page_count):
+        return {"reused": self.reused_pages, "captured": page_count - self.reused_pages,
+                "previous_build": self.previous.get("build_id") if self.previous else None}
+
+    def save(self, image_list, build_id, bundle_record=None):
+        """
+        Stores the state of this build's pages, for the next build to compare against
+        :param
+            - image_list:       dict - The finished image_list of this build
+            - build_id:         string - This build's id
+            - bundle_record:    dict - This build's bundle record, if it has one
+        """
+        pages = {}
+        misc_images = {}
+        for page in image_list["image_list"]:
+            if page["url"] == MISC_PATH_TEXT:
+                for image_data in page["image_data"]:
+                    misc_images.setdefault(image_data.get("url"), []).append(_get_stored_image(image_data))
+
+        for page in image_list["image_list"]:
+            if page["url"] == MISC_PATH_TEXT or not page["image_data"]:
+                continue
+            pages[page["path"]] = dict(self.page_states.get(page["path"], {}),
+                                       image_data=[_get_stored_image(image_data) for image_data in page["image_data"]],
+                                       misc_image_data=misc_images.get(page["url"], []))
+
+        # - Keep track of the bundles that the images are in, for every build they still point at
+        builds = {self.s3_path: {"build_id": build_id, "bundle": bundle_record}}
+        previous_builds = self.previous.get("builds", {}) if self.previous else {}
+        for page in pages.values():
+            for image_data in page["image_data"] + page["misc_image_data"]:
+                if image_data["s3_path"] not in builds and image_data["s3_path"] in previous_builds:
+                    builds[image_data["s3_path"]] = previous_builds[image_data["s3_path"]]
+
+        state = {"build_id": build_id, "s3_path": self.s3_path, "completed": time.time(),
+                 "fingerprint": self.fingerprint, "builds": builds, "pages": pages}
+        self.s3_client.store_file(self.state_path, io.BytesIO(json.dumps(state).encode("utf-8")),
+                                  self.state_filename, mime_type="application/json")
+
+    def _check_http_validators(self, pages):
+        session = http_login.create_session(INCREMENTAL_HEAD_WORKERS)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=INCREMENTAL_HEAD_WORKERS) as executor:
+            responses = executor.map(lambda page: self._head(session, page["url"]), pages)
+            for page, validators in zip(pages, responses):
+                previous_page = self._get_previous_page(page["path"])
+                if not validators:
+                    if previous_page:
+                        self.needs_dom_check.add(page["path"])
+                    continue
+
+                self._get_page_state(page["path"]).update(validators)
+                if previous_page and any(validators.get(key) and validators[key] == previous_page.get(key)
+                                         for key in ["etag", "last_modified"]):
+                    self.unchanged[page["path"]] = HTTP_VALIDATORS
+
+    def _head(self, session, url):
+        """
+        :return
+            - dict: The page's "etag" and "last_modified", or None when the page did not send either
+        """
+        try:
+            response = session.head(url, allow_redirects=True, timeout=INCREMENTAL_HEAD_TIMEOUT)
+        except http_login.requests.RequestException as e:
+            log.debug(f"Unable to send a HEAD request to {url}: {e}")
+            return None
+        # A login page's headers say nothing about the page behind it
+        if response.status_code != 200 or http_login.is_login_redirect(response):
+            return None
+        validators = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+        return validators if any(validators.values()) else None
+
+    def _reuse_image(self, image_data, page_url, bundle):
+        image_data = copy.deepcopy(image_data)
+        local_path = os.path.join(self.local_path, image_data["filename"])
+        previous_bundle = self.previous.get("builds", {}).get(image_data["s3_path"], {}).get("bundle")
+
+        if previous_bundle:
+            bundle_index = get_bundle_index(self.s3_client, image_data["s3_path"], previous_bundle)
+            download_bundle_file(self.s3_client, image_data["s3_path"], previous_bundle,
+                                 bundle_index[image_data["filename"]], local_path)
+        else:
+            self.s3_client.download_file(image_data["s3_path"], image_data["filename"], local_path)
+
+        if bundle:
+            with open(local_path, "rb") as local_file:
+                image_data["s3_location"] = bundle.add_file(image_data["filename"], local_file.read())
+            image_data["s3_path"] = self.s3_path
+        elif previous_bundle:
+            image_data["s3_location"] = self.s3_client.store_file(self.s3_path, local_path, image_data["filename"],
+                                                                  True)
+            image_data["s3_path"] = self.s3_path
+        else:
+            image_data["s3_location"] = self.s3_client.get_file_url(image_data["s3_path"], image_data["filename"])
+
+        image_data["local_path"] = local_path
+        image_data["url"] = page_url
+        return image_data
+
+    def _load_state(self):
+        try:
+            if not self.s3_client.verify_file(self.state_path, self.state_filename):
+                return None
+            state = json.load(self.s3_client.get_file(self.state_path, self.state_filename))
+        except (S3ClientException, ValueError) as e:
+            log.warning(f"Unable to read the state of the last build, so every page will be captured: {e}")
+            return None
+
+        if state.get("fingerprint") != self.fingerprint:
+            log.info(f"Build {state.get('build_id')} was captured with a different plan, browser, browser size or "
+                     f"file extension, so its images will not be reused")
+            return None
+        return state
+
+    def _get_previous_page(self, path):
+        previous_page = self.previous["pages"].get(path) if self.previous else None
+        return previous_page if previous_page and previous_page.get("image_data") else None
+
+    def _get_page_state(self, path):
+        with self.lock:
+            return self.page_states.setdefault(path, {})
+
+
+def _get_stored_image(image_data):
+    """The presigned url and local path of an image are only good for the build they were made in"""
+    return {key: value for key, value in image_data.items() if key not in ["s3_location", "local_path"]}
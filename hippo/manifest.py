@@ -0,0 +1,215 @@
+import gzip
+import json
+import os
+import tempfile
+import threading
+
+from hippo.util import create_logger, MISC_PATH_TEXT, MANIFEST_FILENAME
+from src.the_ark.s3_client import S3ClientException
+
+log = create_logger("Manifest")
+
+MANIFEST_FORMAT = "hippo-manifest"
+MANIFEST_VERSION = 1
+# The image_list keys that are written as part of each page, everything else is build level data
+PAGE_KEYS = ["url", "path", "image_data"]
+
+
+class ManifestWriter:
+    """
+    Writes a compact version of the image_list as pages finish being captured. The manifest is a gzipped json lines
+    file with a header line of build data, then one line per page. The s3 and local folders that every image shares
+    are only written once, in the header, and the presigned s3 urls are left out entirely since they are generated
+    again when the manifest is read with read_manifest().
+
+    The manifest is the build's image list of record. The PDF of a finished build is created from it, and the API
+    builds the json image list from it. The json files are still sent up next to it, for the links in the log and
+    anything that reads them from S3.
+    """
+    def __init__(self, image_list, s3_client, s3_path, local_path, image_url=None):
+        """
+        :param
+            - image_list:   dict - The image_list of the build
+            - s3_client:    S3Client - The client used to send the manifest up to S3
+            - s3_path:      string - The S3 path to the folder the images (and manifest) are stored in
+            - local_path:   string - The local folder the images are saved in
+            - image_url:    string - The url the images are served from when the build is stored as a bundle
+        """
+        self.image_list = image_list
+        self.s3_client = s3_client
+        self.s3_path = s3_path
+        self.local_path = local_path
+        self.image_url = image_url
+        self.page_indexes = {id(page): pin for pin, page in enumerate(image_list["image_list"])}
+        self.written_pages = set()
+        self.lock = threading.Lock()
+        self.closed = False
+
+        self.temp_file = tempfile.NamedTemporaryFile(suffix=".jsonl.gz", delete=False)
+        self.manifest_file = gzip.GzipFile(fileobj=self.temp_file, mode="wb")
+        self._write_line({
+            "format": MANIFEST_FORMAT,
+            "version": MANIFEST_VERSION,
+            "s3_path": s3_path,
+            "local_path": local_path,
+            "image_url": image_url,
+            "build": {key: value for key, value in image_list.items() if key != "image_list"},
+            "page_count": len(image_list["image_list"])
+        })
+
+    def page_finished(self, page_object):
+        """
+        Writes a finished page to the manifest. The misc page is only written on close(), since every page can add to it
+        :param
+            - page_object:  dict - The page object from the image_list that has finished being captured
+        """
+        pin = self.page_indexes.get(id(page_object))
+        if pin is None or page_object["url"] == MISC_PATH_TEXT:
+            return
+        self._write_page(pin)
+
+    def close(self, filename=MANIFEST_FILENAME):
+        """
+        Writes any pages that were not finished, along with any build data added since the manifest was started, and
+        sends the manifest up to S3
+        :return
+            - string:   The link to the manifest on S3
+        """
+        for pin in range(len(self.image_list["image_list"])):
+            self._write_page(pin)
+        self._write_line({"build": {key: value for key, value in self.image_list.items() if key != "image_list"}})
+
+        try:
+            with self.lock:
+                self.closed = True
+                self.manifest_file.close()
+                self.temp_file.close()
+            manifest_url = self.s3_client.store_file(self.s3_path, self.temp_file.name, filename, True)
+        finally:
+            os.remove(self.temp_file.name)
+
+        log.info(f"Sent the manifest for {len(self.written_pages)} pages up to S3")
+        return manifest_url
+
+    def abort(self):
+        with self.lock:
+            self.closed = True
+            self.manifest_file.close()
+            self.temp_file.close()
+        if os.path.exists(self.temp_file.name):
+            os.remove(self.temp_file.name)
+
+    def _write_page(self, pin):
+        with self.lock:
+            if pin in self.written_pages:
+                return
+            self.written_pages.add(pin)
+
+        page = self.image_list["image_list"][pin]
+        line = {"pin": pin, "url": page["url"], "path": page.get("path", "")}
+        line.update({key: value for key, value in page.items() if key not in PAGE_KEYS})
+        line["images"] = [self._compact_image(image_data, page["url"]) for image_data in page.get("image_data", [])]
+        self._write_line(line)
+
+    def _compact_image(self, image_data, page_url):
+        image = {"filename": image_data["filename"], "suffix": image_data.get("suffix")}
+        # Only write out the values that cannot be rebuilt from the header and the page
+        if image_data.get("url") != page_url:
+            image["url"] = image_data.get("url")
+        if image_data.get("s3_path") != self.s3_path:
+            image["s3_path"] = image_data.get("s3_path")
+        if image_data.get("local_path") != self.local_path + image_data["filename"]:
+            image["local_path"] = image_data.get("local_path")
+        # Images that are not in the bundle, such as the PDF's cropped images, are linked to on S3 instead
+        if self.image_url and image_data.get("s3_location") != f"{self.image_url}/{image_data['filename']}":
+            image["on_s3"] = True
+        return image
+
+    def _write_line(self, line):
+        data = (json.dumps(line, separators=(",", ":")) + "\n").encode("utf-8")
+        with self.lock:
+            if not self.closed:
+                self.manifest_file.write(data)
+
+
+def write_manifest(image_list, s3_client, s3_path, local_path, filename=MANIFEST_FILENAME, image_url=None):
+    """
+    Writes a finished image_list out as a manifest in one go
+    :return
+        - string:   The link to the manifest on S3
+    """
+    return ManifestWriter(image_list, s3_client, s3_path, local_path, image_url).close(filename)
+
+
+def read_manifest(s3_client, s3_path, filename=MANIFEST_FILENAME):
+    """
+    Reads a manifest written by the ManifestWriter back into the legacy image_list shape, generating a fresh presigned
+    url for every image
+    :param
+        - s3_client:    S3Client - The client for the bucket the build was stored in
+        - s3_path:      string - The S3 path to the folder the manifest is stored in
+        - filename:     string - The name of the manifest file
+    :return
+        - dict: The image_list, in the shape the request thread built it
+    """
+    try:
+        manifest_file = s3_client.get_file(s3_path, filename)
+    except S3ClientException as e:
+        raise ManifestException(f"Unable to read the manifest at {s3_path}/{filename}: {e}")
+    return parse_manifest(manifest_file, s3_client)
+
+
+def parse_manifest(manifest_file, s3_client=None):
+    """
+    Parses a gzipped manifest file object into the legacy image_list shape. The s3_location of each image is only
+    filled in when an s3_client is given to generate it with
+    """
+    header = None
+    image_list = {}
+    pages = {}
+    with gzip.GzipFile(fileobj=manifest_file, mode="rb") as lines:
+        for raw_line in lines:
+            line = json.loads(raw_line)
+            if header is None:
+                if line.get("format") != MANIFEST_FORMAT:
+                    raise ManifestException("The file is not a Hippo manifest")
+                header = line
+                image_list.update(line["build"])
+            elif "pin" in line:
+                pages[line.pop("pin")] = line
+            else:
+                image_list.update(line.get("build", {}))
+
+    if header is None:
+        raise ManifestException("The manifest is empty")
+
+    image_list["image_list"] = []
+    for pin in sorted(pages):
+        page = pages[pin]
+        images = page.pop("images")
+        page["image_data"] = []
+        for image in images:
+            image_s3_path = image.get("s3_path", header["s3_path"])
+            if header.get("image_url") and not image.get("on_s3"):
+                s3_location = f"{header['image_url']}/{image['filename']}"
+            else:
+                s3_location = s3_client.get_file_url(image_s3_path, image["filename"]) if s3_client else None
+            page["image_data"].append({
+                "filename": image["filename"],
+                "suffix": image.get("suffix"),
+                "s3_path": image_s3_path,
+                "s3_location": s3_location,
+                "local_path": image.get("local_path", header["local_path"] + image["filename"]),
+                "url": image.get("url", page["url"])
+            })
+        image_list["image_list"].append(page)
+    return image_list
+
+
+class ManifestException(Exception):
+    def __init__(self, message):
+        self.msg = message
+        self.message = message
+
+    def __str__(self):
+        return self.message
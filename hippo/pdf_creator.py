@@ -1,15 +1,38 @@
 
+import concurrent.futures
 import copy
-import img2pdf
+import json
 import logging
 import math
+import os
+import re
+import shutil
+import tempfile
+import threading
 
 from PIL import Image
+from hippo.bundle import get_bundle_index, download_bundle_file, BuildBundleException
+from hippo.manifest import read_manifest, ManifestException
+from hippo.pdf_writer import PDFWriter, PDFWriterException, get_image_size, get_image_dpi
 from src.the_ark.s3_client import S3ClientException
-from hippo.util import create_logger, JPEG_FILE_EXTENSION, MISC_PATH_TEXT, PDF_MAX_PAGE_HEIGHT, PDF_CROP_PADDING
+from hippo.util import create_logger, JPEG_FILE_EXTENSION, MISC_PATH_TEXT, PDF_MAX_PAGE_HEIGHT, PDF_CROP_PADDING, \
+    PDF_CROP_WORKERS, PDF_PREFETCH_PAGES, PDF_DOWNLOAD_WORKERS, BUILD_RECORD_PATH, BUILD_RECORD_FILENAME, \
+    PDF_DEFAULT_JPEG_QUALITY, MAX_WIDTH_KEY, DPI_KEY, JPEG_QUALITY_KEY, PDF_VOLUME_WORKERS, BY_SECTION_KEY, \
+    MAX_PAGES_KEY, MAX_BYTES_KEY, create_pdf_volume_index, PDF_IMAGE_LIST_FILENAME, BUILD_PDF_WORKERS
 
 log = create_logger("PDF Creator")
 
+# The PDFs of finished builds are created in the background. Requests for the PDF of the same build share its future,
+# so that it is only created once
+build_pdf_executor = concurrent.futures.ThreadPoolExecutor(max_workers=BUILD_PDF_WORKERS,
+                                                           thread_name_prefix="Build PDF")
+build_pdf_lock = threading.Lock()
+build_pdf_futures = {}
+
+# - The status of the PDF of a finished build
+BUILD_PDF_READY = "ready"
+BUILD_PDF_CREATING = "creating"
+
 
 class PDFCreator:
     """
@@ -24,79 +47,269 @@ class PDFCreator:
         self.s3_client = s3_client
         self.s3_path = s3_path
         self.canv = None
-        self.pdf_list = copy.deepcopy(image_list)  # A new image list with which to make the screenshot log
+
+        # A new image list with which to make the screenshot log. Each page is copied over as it is added to the PDF,
+        # since pages may still be getting captured when the PDF is started
+        self.pdf_list = copy.deepcopy({key: value for key, value in image_list.items() if key != "image_list"})
+        self.pdf_list["image_list"] = list(image_list["image_list"])
+
+        self.pdf_file = None
+        self.file_path = None
+        self.pdf_name = None
+        self.stream_to_s3 = False
+        self.writer = None
+        self.image_extension = JPEG_FILE_EXTENSION
+        self.crop_height = PDF_MAX_PAGE_HEIGHT
+        self.crop_padding = PDF_CROP_PADDING
+
+        # Tall images are cropped on the crop_pool and their slices sent up to S3 by the uploader. The s3_location of
+        # each slice is filled in from pending_uploads once the PDF is finished
+        self.crop_pool = None
+        self.uploader = None
+        self.pending_uploads = []
+        # The crops of the pages that were handed to prefetch_page(), by their index in the image_list
+        self.prefetched = {}
+
+        # When a pdf_profile is given, the PDF is built from smaller renditions of the images that are saved in the
+        # rendition_path. The original images are left untouched
+        self.pdf_profile = {}
+        self.rendition_path = None
+        self.source_size = 0
 
     def create_pdf(self, folder, pdf_name="screenshots.pdf", image_extension=JPEG_FILE_EXTENSION,
-                   crop_height=PDF_MAX_PAGE_HEIGHT, crop_padding=PDF_CROP_PADDING):
+                   crop_height=PDF_MAX_PAGE_HEIGHT, crop_padding=PDF_CROP_PADDING, stream_to_s3=False, pdf_profile=None):
         """
-        Takes an image_list, parses out the image data, adds the image paths to a list, uses that list to create a PDF
+        Takes an image_list, parses out the image data and adds each image to the PDF as its own page. Pages are written
+        out as they are added, so memory use does not grow with the number of images in the image_list
         :param folder: The path to the  folder that contains the images
         :param pdf_name: The name that you'd like to save the PDF as
         :param image_extension: The file type extension that the images were saved as (jpeg, png, bmp, etc.)
         :param crop_height: The max height of images in the pdf. Defaults to 14400 because it is the tallest that
                             Adobe Acrobat will accept
         :param crop_padding: The overlap, in pixels, that you'd like to have between crops.
+        :param stream_to_s3: If True, the PDF is written straight into a multipart upload instead of a local file
+        :param pdf_profile: Optional max_width, dpi and jpeg_quality that the images are scaled down and recompressed to
+                            before being added to the PDF
         :return: The updated pdf image list and a link to the pdf on S3.
         """
-        images = []
+        self.open_pdf(folder, pdf_name, image_extension, crop_height, crop_padding, stream_to_s3, pdf_profile)
+        for pin in range(len(self.image_list["image_list"])):
+            self.add_page(pin)
+        return self.close_pdf()
+
+    def open_pdf(self, folder, pdf_name="screenshots.pdf", image_extension=JPEG_FILE_EXTENSION,
+                 crop_height=PDF_MAX_PAGE_HEIGHT, crop_padding=PDF_CROP_PADDING, stream_to_s3=False, pdf_profile=None):
+        """
+        Opens the PDF file (or multipart upload) so that pages can be added to it one at a time with add_page(). Takes
+        the same parameters as create_pdf()
+        """
+        self.file_path = folder + pdf_name
+        self.pdf_name = pdf_name
+        self.stream_to_s3 = stream_to_s3
+        self.image_extension = image_extension
+        self.crop_height = crop_height
+        self.crop_padding = crop_padding
+        self.pdf_profile = pdf_profile or {}
+
         try:
-            file_path = folder + pdf_name
-
-            for pin, page in enumerate(self.image_list["image_list"]):
-                count = 0  # Tracks the number of times we have updated the length of the pdf_list index
-                for index, image_data in enumerate(page.get("image_data", [])):
-                    # Check the image height
-                    # import pdb; pdb.set_trace();
-                    cropped_images = self._crop_for_pdf(image_data, image_extension, crop_height, crop_padding)
-
-                    # Update the PDF Image list if the image got cropped
-                    if cropped_images:
-                        log.info("Image cropped for pdf...")
-                        # Replace the current image in the list with the cropped image(s)
-                        self.pdf_list["image_list"][pin]["image_data"][index + count:index + count + 1] = cropped_images
-
-                        # Iterate the count by the number of additional images returned by the crop
-                        count += len(cropped_images) - 1
-
-                        # Add the images to the list used to create the PDF
-                        for image in cropped_images:
-                            images.append(image["local_path"])
-                    else:
-                        # If the image did not need to get cropped, add it to the images list alone
-                        images.append(image_data["local_path"])
-
-                else:
-                    # If the page did not have any image data, then send out a warning that no images were caught for it
-                    # Do not worry about the misc page being empty
-                    if not page.get("image_data") and page["url"] != MISC_PATH_TEXT:
-                        log.warning(f"No images were found in the image_list for the page at {page['url']!r}. Check the above log output for errors regarding this page")
+            if stream_to_s3:
+                self.pdf_file = self.s3_client.open_multipart_upload(self.s3_path, pdf_name, "application/pdf")
+            else:
+                self.pdf_file = open(self.file_path, "wb")
+        except (OSError, S3ClientException) as e:
+            message = f"Issue opening the PDF file for writing: {e}"
+            raise PDFCreatorException(message)
+
+        try:
+            self.crop_pool = concurrent.futures.ThreadPoolExecutor(max_workers=PDF_CROP_WORKERS)
+            self.uploader = self.s3_client.open_concurrent_uploader()
+            if self.pdf_profile:
+                self.rendition_path = tempfile.mkdtemp()
+            self.writer = PDFWriter(self.pdf_file)
         except Exception as e:
+            self.abort_pdf()
+            message = f"Issue while creating PDF file: {e}"
+            raise PDFCreatorException(message)
+        log.info("Creating the PDF...")
+
+    def add_page(self, pin):
+        """
+        Copies a finished page of the image_list over to the pdf_list, crops its images as needed and adds them to the
+        open PDF. Pages must be added in image_list order.
+        :param pin: The index of the page in the image_list
+        """
+        page = self.image_list["image_list"][pin]
+        self.pdf_list["image_list"][pin] = copy.deepcopy(page)
+        try:
+            self._add_page_to_pdf(self.writer, pin, page, self.image_extension, self.crop_height, self.crop_padding)
+        except PDFWriterException as e:
+            self.abort_pdf()
+            message = f"Issue while creating PDF file: {e}"
+            raise PDFCreatorException(message)
+        except Exception as e:
+            self.abort_pdf()
             message = f"Issue gathering and/or converting images while attempting to create the PDF S3: {e}"
             raise PDFCreatorException(message)
 
+    def prefetch_page(self, pin):
+        """
+        Starts cropping the images of a finished page on the crop pool, so that they are ready by the time the page is
+        added with add_page(). Pages can be prefetched in any order
+        :param pin: The index of the page in the image_list
+        """
+        if pin not in self.prefetched:
+            self.prefetched[pin] = self._submit_crops(self.image_list["image_list"][pin])
+
+    def close_pdf(self):
+        """
+        Finishes the PDF and sends it up to S3
+        :return: The updated pdf image list and a link to the pdf on S3.
+        """
         try:
-            log.info(f"Creating a {len(images)} page PDF...")
-            # import pdb; pdb.set_trace();
-            # pdf_bytes = img2pdf.convert(images, colorspace="RGB")
-            pdf_bytes = img2pdf.convert(images)
-            with open(file_path, "wb") as pdf_file:
-                pdf_file.write(pdf_bytes)
-            log.info("PDF Creation Complete!")
+            pdf_size = self.writer.close()
+            log.info(f"PDF Creation Complete! {self.writer.page_count} pages, {pdf_size} bytes, from {self.source_size} "
+                     f"bytes of screenshots")
+            self.pdf_list["pdf_size"] = f"{_format_size(pdf_size)} (screenshots: {_format_size(self.source_size)})"
+        except Exception as e:
+            self.abort_pdf()
+            message = f"Issue while creating PDF file: {e}"
+            raise PDFCreatorException(message)
 
+        try:
+            # - Wait for the cropped images to finish uploading and add their locations to the pdf_list
+            for image_data, upload in self.pending_uploads:
+                image_data["s3_location"] = upload.result()
+            self._shutdown_pools()
+            self._remove_renditions()
         except Exception as e:
-            message = "Issue while creating PDF file: {e}"
+            self.abort_pdf()
+            message = f"Issue sending the cropped images up to S3: {e}"
             raise PDFCreatorException(message)
 
         try:
             log.info("Sending the PDF file up to S3... like a boss!!")
             # - Send the PDF to S3 and return the file
-            # s3_url = self.s3_client.store_file(self.s3_path, file_path, pdf_name, True, "application/pdf", 4000000000)
-            s3_url = self.s3_client.store_file(self.s3_path, file_path, pdf_name, True, "application/pdf")
+            if self.stream_to_s3:
+                s3_url = self.pdf_file.close(return_url=True)
+            else:
+                self.pdf_file.close()
+                s3_url = self.s3_client.store_file(self.s3_path, self.file_path, self.pdf_name, True, "application/pdf")
             return s3_url, self.pdf_list
         except S3ClientException as e:
-            message = "Issue sending PDF file up to S3: {e}"
+            message = f"Issue sending PDF file up to S3: {e}"
             raise PDFCreatorException(message)
 
+    def abort_pdf(self):
+        """Cancels a multipart upload, or closes the local file, after a failed PDF creation"""
+        self._shutdown_pools(cancel=True)
+        self._remove_renditions()
+        try:
+            if hasattr(self.pdf_file, "abort"):
+                self.pdf_file.abort()
+            elif self.pdf_file:
+                self.pdf_file.close()
+        except Exception as e:
+            log.warning(f"Unable to clean up the partially written PDF: {e}")
+
+    def _shutdown_pools(self, cancel=False):
+        if self.crop_pool:
+            self.crop_pool.shutdown(wait=True, cancel_futures=cancel)
+            self.crop_pool = None
+        if self.uploader:
+            self.uploader.close(cancel=cancel)
+            self.uploader = None
+
+    def _remove_renditions(self):
+        if self.rendition_path:
+            shutil.rmtree(self.rendition_path, ignore_errors=True)
+            self.rendition_path = None
+
+    def _add_page_to_pdf(self, writer, pin, page, image_extension, crop_height, crop_padding):
+        """
+        Crops the images for a single page of the image_list, as needed, and adds them to the PDF
+        :param writer: The PDFWriter the images are added to
+        :param pin: The index of the page in the image_list
+        :param page: The page object from the image_list
+        """
+        # Use the crops started by prefetch_page(), or crop all of the page's images at once now. Either way, the
+        # images are added to the PDF in order
+        crops = self.prefetched.pop(pin, None)
+        if crops is None:
+            crops = self._submit_crops(page)
+
+        count = 0  # Tracks the number of times we have updated the length of the pdf_list index
+        for index, image_data in enumerate(page.get("image_data", [])):
+            # Check the image height
+            cropped_images, renditions = crops[index].result()
+
+            # Update the PDF Image list if the image got cropped
+            if cropped_images:
+                log.info("Image cropped for pdf...")
+                # Replace the current image in the list with the cropped image(s)
+                self.pdf_list["image_list"][pin]["image_data"][index + count:index + count + 1] = cropped_images
+
+                # Iterate the count by the number of additional images returned by the crop
+                count += len(cropped_images) - 1
+
+            # Add the image(s) to the PDF
+            for source_path, rendition_path, dpi in renditions:
+                self.source_size += os.path.getsize(source_path)
+                writer.add_image_page(rendition_path, dpi)
+
+        # If the page did not have any image data, then send out a warning that no images were caught for it
+        # Do not worry about the misc page being empty
+        if not page.get("image_data") and page["url"] != MISC_PATH_TEXT:
+            log.warning(f"No images were found in the image_list for the page at {page['url']!r}. Check the above log output for errors regarding this page")
+
+    def _submit_crops(self, page):
+        return [self.crop_pool.submit(self._prepare_for_pdf, image_data, self.image_extension, self.crop_height,
+                                      self.crop_padding) for image_data in page.get("image_data", [])]
+
+    def _prepare_for_pdf(self, image_data, image_extension, crop_height, crop_padding):
+        """
+        Crops the image, as needed, and creates the renditions of it that will be added to the PDF
+        :return: a list of cropped image data objects, and a (source path, rendition path, dpi) tuple for each PDF page
+        """
+        cropped_images = self._crop_for_pdf(image_data, image_extension, crop_height, crop_padding)
+        source_paths = [image["local_path"] for image in cropped_images] or [image_data["local_path"]]
+        return cropped_images, [(path,) + self._render_for_pdf(path) for path in source_paths]
+
+    def _render_for_pdf(self, image_path):
+        """
+        Scales the image down to the pdf_profile's max_width and dpi and recompresses it at its jpeg_quality. The page
+        keeps the size of the original image, so only the resolution of the image inside of it changes.
+        :param image_path: The path to the original image
+        :return: The path to the image that should be added to the PDF, and the dpi to add it at
+        """
+        if not self.pdf_profile:
+            return image_path, None
+
+        width, height = get_image_size(image_path)
+        page_width = width / get_image_dpi(image_path)  # In inches
+
+        target_width = width
+        if self.pdf_profile.get(DPI_KEY):
+            target_width = min(target_width, int(round(page_width * self.pdf_profile[DPI_KEY])))
+        if self.pdf_profile.get(MAX_WIDTH_KEY):
+            target_width = min(target_width, self.pdf_profile[MAX_WIDTH_KEY])
+        target_width = max(target_width, 1)
+
+        # Leave the image alone if there is nothing to do to it
+        if target_width >= width and not self.pdf_profile.get(JPEG_QUALITY_KEY):
+            return image_path, None
+
+        target_height = max(int(round(height * target_width / width)), 1)
+        with Image.open(image_path) as image:
+            # Let the JPEG decoder do as much of the scaling down as it can
+            image.draft("RGB", (target_width, target_height))
+            rendition = image.convert("RGB")
+            if rendition.size != (target_width, target_height):
+                rendition = rendition.resize((target_width, target_height), Image.LANCZOS)
+
+        rendition_path = os.path.join(self.rendition_path, f"{os.path.splitext(os.path.basename(image_path))[0]}.jpeg")
+        rendition.save(rendition_path, "JPEG", quality=self.pdf_profile.get(JPEG_QUALITY_KEY, PDF_DEFAULT_JPEG_QUALITY))
+        return rendition_path, target_width / page_width
+
     def _crop_for_pdf(self, image_data, image_extension, crop_height, crop_padding):
         """
         Checks the height of the image and chops it into crop_height sized chunks
@@ -108,12 +321,11 @@ class PDFCreator:
         """
         cropped_images = []
 
-        # Open the image and get its sweet stats
-        full_image = Image.open(image_data["local_path"])
-        full_width = full_image.size[0]
-        full_height = full_image.size[1]
+        # Get the image's sweet stats from its header, so it is only decoded if it actually needs to get cropped
+        full_width, full_height = get_image_size(image_data["local_path"])
         # Chop it up if it's taller than the given crop height
         if full_height > crop_height:
+            full_image = Image.open(image_data["local_path"])
             # Determine how many times you need to crop the image
             crop_count = int(math.ceil(full_height / crop_height))
 
@@ -139,13 +351,10 @@ class PDFCreator:
                 local_path = image_data["local_path"].replace(image_data["filename"], filename)
                 cropped_image.save(local_path)
 
-                # Send saved image to S3
-                s3_location = self.s3_client.store_file(self.s3_path, local_path, filename, True)
-
-                # Create a new image_list page data object
+                # Create a new image_list page data object. The s3_location is filled in once the upload finishes
                 new_data = {
                     "suffix": f"{image_data['suffix']}_00{(iteration + 1)}",
-                    "s3_location": s3_location,
+                    "s3_location": None,
                     "url": image_data["url"],
                     "filename": filename,
                     "local_path": local_path,
@@ -153,9 +362,414 @@ class PDFCreator:
                 }
                 cropped_images.append(new_data)
 
+                # Send saved image to S3
+                upload = self.uploader.store_file(self.s3_path, local_path, filename, True)
+                self.pending_uploads.append((new_data, upload))
+
+            full_image.close()
+
         return cropped_images
 
 
+class PDFBuilderThread(threading.Thread):
+    """
+    Builds the PDF while the screenshots are still being captured. Pages are handed to the thread with page_finished()
+    as the screenshot threads finish them, and are added to the PDF in image_list order as soon as every page before
+    them is done. The misc page collects images from every page, so it is only added once finish() has been called.
+    The PDF file, and the pools that go with it, are only opened once the first page is ready.
+
+    While a page is being added, the images of the next PDF_PREFETCH_PAGES pages that are already finished are cropped
+    on the crop pool too, so that slow crops overlap with writing the PDF instead of holding it up.
+    """
+    def __init__(self, image_list, s3_client, s3_path, folder, pdf_name="screenshots.pdf",
+                 image_extension=JPEG_FILE_EXTENSION, stream_to_s3=False, pdf_profile=None, pins=None, max_bytes=None):
+        """
+        :param
+            - pins:         list - The indexes of the image_list pages that go in this PDF. Defaults to every page
+            - max_bytes:    int - When set, the PDF is split into parts that are started once this size is reached
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.image_list = image_list
+        self.s3_client = s3_client
+        self.s3_path = s3_path
+        self.folder = folder
+        self.pdf_name = pdf_name
+        self.image_extension = image_extension
+        self.stream_to_s3 = stream_to_s3
+        self.pdf_profile = pdf_profile
+        self.pins = list(range(len(image_list["image_list"]))) if pins is None else list(pins)
+        self.max_bytes = max_bytes
+        self.pdf = None
+
+        self.page_indexes = {id(image_list["image_list"][pin]): pin for pin in self.pins}
+        self.finished_pages = set()
+        self.capture_finished = False
+        self.condition = threading.Condition()
+        self.result = None
+        self.parts = []  # A {"name", "pdf_url", "pdf_list", "pins"} dict for each part of the PDF that was created
+        self.exception = None
+
+    def page_finished(self, page_object):
+        """
+        Lets the builder know that the screenshot threads are done with a page of the image_list
+        :param
+            - page_object:  dict - The page object from the image_list that has finished being captured
+        """
+        pin = self.page_indexes.get(id(page_object))
+        if pin is None:
+            return
+        with self.condition:
+            self.finished_pages.add(pin)
+            self.condition.notify()
+
+    def finish(self):
+        """Lets the builder know that every screenshot thread is done, so the rest of the pages can be added"""
+        with self.condition:
+            self.capture_finished = True
+            self.condition.notify()
+
+    def get_result(self):
+        """
+        Waits for the PDF to be finished
+        :return
+            - tuple:    The link to the pdf on S3 and the pdf image list, the same as PDFCreator.create_pdf()
+        """
+        self.join()
+        if self.exception:
+            raise self.exception
+        return self.result
+
+    def run(self):
+        try:
+            part_pins = []
+            for index, pin in enumerate(self.pins):
+                self._wait_for_page(pin)
+
+                if self.pdf is None:
+                    self._open_part()
+                # Start a new part once the current one has used up its byte budget
+                elif self.max_bytes and part_pins and self.pdf.writer.position >= self.max_bytes:
+                    self._close_part(part_pins)
+                    part_pins = []
+                    self._open_part()
+
+                self._prefetch_pages(index)
+                self.pdf.add_page(pin)
+                part_pins.append(pin)
+
+            if self.pdf is None:
+                self._open_part()
+            self._close_part(part_pins)
+            self.result = self.parts[0]["pdf_url"], self.parts[0]["pdf_list"]
+
+        except PDFCreatorException as e:
+            self.exception = e
+        except Exception as e:
+            if self.pdf:
+                self.pdf.abort_pdf()
+            self.exception = PDFCreatorException(f"Unexpected error while building the PDF: {e}")
+
+    def _open_part(self):
+        name = self.pdf_name
+        if self.parts:
+            name = f"{os.path.splitext(self.pdf_name)[0]}_part{len(self.parts) + 1}.pdf"
+        self.pdf = PDFCreator(self.image_list, self.s3_client, self.s3_path)
+        self.pdf.open_pdf(self.folder, name, self.image_extension, stream_to_s3=self.stream_to_s3,
+                          pdf_profile=self.pdf_profile)
+
+    def _close_part(self, part_pins):
+        pdf_url, pdf_list = self.pdf.close_pdf()
+        self.parts.append({"name": self.pdf.pdf_name, "pdf_url": pdf_url, "pdf_list": pdf_list, "pins": part_pins})
+
+    def _prefetch_pages(self, index):
+        """
+        Starts cropping the page at the index in self.pins, and the finished pages after it, on the open part. The crops
+        of pages that end up in the next part are thrown away with this part's pools and are simply redone
+        """
+        with self.condition:
+            upcoming = [pin for pin in self.pins[index + 1:index + 1 + PDF_PREFETCH_PAGES]
+                        if pin in self.finished_pages and self.image_list["image_list"][pin]["url"] != MISC_PATH_TEXT]
+        for pin in [self.pins[index]] + upcoming:
+            self.pdf.prefetch_page(pin)
+
+    def _wait_for_page(self, pin):
+        is_misc_page = self.image_list["image_list"][pin]["url"] == MISC_PATH_TEXT
+        with self.condition:
+            while not self.capture_finished and (is_misc_page or pin not in self.finished_pages):
+                self.condition.wait()
+
+
+class PDFVolumeBuilder:
+    """
+    Splits the PDF into volumes, by site section and/or by a page and byte budget, and builds them with a
+    PDFBuilderThread each. The builders are run, in volume order, on a pool of PDF_VOLUME_WORKERS threads, so only that
+    many volumes are ever open at once however many there are. Has the same start/page_finished/finish/get_result
+    interface as PDFBuilderThread, but its result links to a small index document that lists every volume.
+    """
+    def __init__(self, image_list, s3_client, s3_path, folder, pdf_name="screenshots.pdf",
+                 image_extension=JPEG_FILE_EXTENSION, stream_to_s3=False, pdf_profile=None, pdf_volumes=None):
+        """
+        :param
+            - pdf_volumes:  dict - The by_section, max_pages and max_bytes used to split the PDF into volumes
+        """
+        pdf_volumes = pdf_volumes or {}
+        self.image_list = image_list
+        self.s3_client = s3_client
+        self.s3_path = s3_path
+        self.pdf_name = pdf_name
+        self.executor = None
+        self.futures = []
+
+        base_name = os.path.splitext(pdf_name)[0]
+        self.volumes = split_into_volumes(image_list, pdf_volumes.get(BY_SECTION_KEY), pdf_volumes.get(MAX_PAGES_KEY))
+        self.builders = []
+        for number, (section, pins) in enumerate(self.volumes):
+            volume_name = f"{base_name}_{number + 1:03d}_{section}.pdf"
+            self.builders.append(PDFBuilderThread(image_list, s3_client, s3_path, folder, volume_name, image_extension,
+                                                  stream_to_s3, pdf_profile, pins, pdf_volumes.get(MAX_BYTES_KEY)))
+
+    def start(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=PDF_VOLUME_WORKERS,
+                                                              thread_name_prefix="PDF Volume")
+        # - The builders catch their own errors, and are run on the pool instead of being started as threads
+        self.futures = [self.executor.submit(builder.run) for builder in self.builders]
+
+    def page_finished(self, page_object):
+        for builder in self.builders:
+            builder.page_finished(page_object)
+
+    def finish(self):
+        for builder in self.builders:
+            builder.finish()
+
+    def get_result(self):
+        """
+        Waits for every volume to be finished, then creates and sends the volume index
+        :return
+            - tuple:    The link to the volume index on S3 and the pdf image list, which lists the volumes under
+                        "pdf_volumes"
+        """
+        concurrent.futures.wait(self.futures)
+        self.executor.shutdown()
+        for builder in self.builders:
+            if builder.exception:
+                raise builder.exception
+
+        # - Put the pages each volume created back together into one pdf image list
+        pdf_list = None
+        pdf_volumes = []
+        for builder, (section, _) in zip(self.builders, self.volumes):
+            for part in builder.parts:
+                if pdf_list is None:
+                    pdf_list = part["pdf_list"]
+                for pin in part["pins"]:
+                    pdf_list["image_list"][pin] = part["pdf_list"]["image_list"][pin]
+                pdf_volumes.append({
+                    "name": part["name"],
+                    "section": section,
+                    "pdf_url": part["pdf_url"],
+                    "pages": [self.image_list["image_list"][pin]["url"] for pin in part["pins"]]
+                })
+        pdf_list["pdf_volumes"] = pdf_volumes
+        pdf_list.pop("pdf_size", None)
+
+        try:
+            index_url = self.s3_client.store_file(self.s3_path, create_pdf_volume_index(pdf_list, pdf_volumes),
+                                                  get_volume_index_name(self.pdf_name), True, "text/html")
+        except S3ClientException as e:
+            raise PDFCreatorException(f"Issue sending the PDF volume index up to S3: {e}")
+
+        log.info(f"Created {len(pdf_volumes)} PDF volumes! Index: {index_url}")
+        return index_url, pdf_list
+
+
+def split_into_volumes(image_list, by_section=False, max_pages=None):
+    """
+    Splits the pages of the image_list into volumes. The misc page always goes in the last volume.
+    :param
+        - image_list:   dict - The image_list of the build
+        - by_section:   boolean - Whether each site section (the first folder of the page path) gets its own volumes
+        - max_pages:    int - The max number of site pages in a volume
+    :return
+        - list: A (section name, list of image_list page indexes) tuple for each volume
+    """
+    sections = []
+    section_pins = {}
+    misc_pins = []
+    for pin, page in enumerate(image_list["image_list"]):
+        if page["url"] == MISC_PATH_TEXT:
+            misc_pins.append(pin)
+            continue
+        section = "all"
+        if by_section:
+            section = re.sub(r"[^\w-]+", "-", page.get("path", "").strip("/").split("/")[0]).strip("-") or "home"
+        if section not in section_pins:
+            sections.append(section)
+            section_pins[section] = []
+        section_pins[section].append(pin)
+
+    volumes = []
+    for section in sections:
+        pins = section_pins[section]
+        step = max_pages or len(pins)
+        volumes.extend((section, pins[start:start + step]) for start in range(0, len(pins), step))
+
+    if not volumes:
+        volumes.append(("all", []))
+    volumes[-1] = (volumes[-1][0], volumes[-1][1] + misc_pins)
+    return volumes
+
+
+def get_volume_index_name(pdf_name):
+    return f"{os.path.splitext(pdf_name)[0]}_index.html"
+
+
+def get_build_pdf(s3_client, build_id):
+    """
+    Gets the status of the PDF for a finished build. The first time the PDF of a build is asked for, it starts being
+    created in the background from the build's stored image list, and is cached on S3 once it is done. Any requests
+    for the same build that come in while the PDF is being created get the status of that creation instead of starting
+    their own. The outcome of a creation is only handed out once, so a failed one is started over by the next request.
+    :param
+        - s3_client:    S3Client - The client for the bucket the build was stored in
+        - build_id:     string - The build_id of the finished build
+    :return
+        - string:   BUILD_PDF_READY when the PDF has been created, or BUILD_PDF_CREATING while it is being created
+        - string:   The link to the pdf on S3, once it is ready
+    """
+    with build_pdf_lock:
+        future = build_pdf_futures.get(build_id)
+
+    if future is None:
+        build_record = get_build_record(s3_client, build_id)
+        pdf_url = _get_cached_pdf_url(s3_client, build_record)
+        if pdf_url:
+            return BUILD_PDF_READY, pdf_url
+
+        with build_pdf_lock:
+            future = build_pdf_futures.get(build_id)
+            if future is None:
+                future = build_pdf_executor.submit(_create_build_pdf, s3_client, build_id, build_record)
+                build_pdf_futures[build_id] = future
+
+    if not future.done():
+        return BUILD_PDF_CREATING, None
+
+    with build_pdf_lock:
+        if build_pdf_futures.get(build_id) is future:
+            build_pdf_futures.pop(build_id)
+    return BUILD_PDF_READY, future.result()
+
+
+def get_build_record(s3_client, build_id):
+    """
+    :return
+        - dict: The record of where a finished build was stored. Raises a BuildNotFoundException if there isn't one
+    """
+    try:
+        return json.load(s3_client.get_file(BUILD_RECORD_PATH.format(build_id=build_id), BUILD_RECORD_FILENAME))
+    except (S3ClientException, ValueError) as e:
+        raise BuildNotFoundException(f"Unable to find a finished build with the build_id {build_id!r} | {e}")
+
+
+def get_build_image_list(s3_client, build_record, pdf=False):
+    """
+    Reads the image list of a finished build, in the legacy json shape
+    :param
+        - s3_client:    S3Client - The client for the bucket the build was stored in
+        - build_record: dict - The record of the finished build
+        - pdf:          bool - Whether to read the PDF's image list instead of the build's
+    :return
+        - dict: The image_list
+    """
+    s3_path = build_record["s3_path"]
+    manifest_name = build_record.get("pdf_manifest" if pdf else "manifest")
+    if manifest_name:
+        try:
+            return read_manifest(s3_client, s3_path, manifest_name)
+        except ManifestException as e:
+            raise BuildNotFoundException(f"Unable to read the image list of the build stored at {s3_path} | {e}")
+
+    # - Builds from before the manifest only stored the json image list
+    legacy_name = PDF_IMAGE_LIST_FILENAME if pdf else build_record.get("image_list")
+    if not legacy_name:
+        raise BuildNotFoundException(f"The build stored at {s3_path} does not have an image list")
+    try:
+        return json.load(s3_client.get_file(s3_path, legacy_name))
+    except (S3ClientException, ValueError) as e:
+        raise BuildNotFoundException(f"Unable to read the image list of the build stored at {s3_path} | {e}")
+
+
+def _get_cached_pdf_url(s3_client, build_record):
+    """
+    :return
+        - string:   The link to the PDF (or volume index) of the build on S3, or None when it has not been created yet
+    """
+    pdf_name = build_record["pdf_name"]
+    cached_name = get_volume_index_name(pdf_name) if build_record.get("pdf_volumes") else pdf_name
+    if s3_client.verify_file(build_record["s3_path"], cached_name):
+        return s3_client.get_file_url(build_record["s3_path"], cached_name)
+    return None
+
+
+def _create_build_pdf(s3_client, build_id, build_record):
+    s3_path = build_record["s3_path"]
+    pdf_name = build_record["pdf_name"]
+    pdf_volumes = build_record.get("pdf_volumes")
+
+    log.info(f"Creating the PDF for build {build_id} from its image list...")
+    image_list = get_build_image_list(s3_client, build_record)
+    local_image_path = tempfile.mkdtemp() + "/"
+    try:
+        # - Pull the images down from S3 (or out of the build's bundle), and point the image list at the local copies
+        bundle_record = build_record.get("bundle")
+        bundle_index = get_bundle_index(s3_client, s3_path, bundle_record) if bundle_record else None
+        downloads = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=PDF_DOWNLOAD_WORKERS) as download_pool:
+            for page in image_list["image_list"]:
+                for image_data in page.get("image_data", []):
+                    image_data["local_path"] = os.path.join(local_image_path, image_data["filename"])
+                    if bundle_index:
+                        downloads.append(download_pool.submit(download_bundle_file, s3_client, s3_path, bundle_record,
+                                                              bundle_index[image_data["filename"]],
+                                                              image_data["local_path"]))
+                    else:
+                        downloads.append(download_pool.submit(s3_client.download_file, image_data["s3_path"],
+                                                              image_data["filename"], image_data["local_path"]))
+        for download in downloads:
+            download.result()
+
+        image_extension = build_record.get("file_extension", JPEG_FILE_EXTENSION)
+        if pdf_volumes:
+            # Every page is already finished, so the volumes can all be built right away
+            volume_builder = PDFVolumeBuilder(image_list, s3_client, s3_path, local_image_path, pdf_name, image_extension,
+                                              True, build_record.get("pdf_profile"), pdf_volumes)
+            volume_builder.finish()
+            volume_builder.start()
+            pdf_url, _ = volume_builder.get_result()
+        else:
+            pdf = PDFCreator(image_list, s3_client, s3_path)
+            pdf_url, _ = pdf.create_pdf(local_image_path, pdf_name, image_extension, stream_to_s3=True,
+                                        pdf_profile=build_record.get("pdf_profile"))
+        log.info(f"PDF created successfully for build {build_id}!: {pdf_url}")
+        return pdf_url
+
+    except (S3ClientException, BuildBundleException, KeyError) as e:
+        raise PDFCreatorException(f"Issue pulling down the images for build {build_id} from S3: {e}")
+
+    finally:
+        shutil.rmtree(local_image_path, ignore_errors=True)
+
+
+def _format_size(size):
+    for unit in ["bytes", "KB", "MB"]:
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != "bytes" else f"{size} {unit}"
+        size /= 1024.0
+    return f"{size:.1f} GB"
+
+
 class PDFCreatorException(Exception):
     def __init__(self, message):
         self.msg = message
@@ -163,3 +777,7 @@ class PDFCreatorException(Exception):
 
     def __str__(self):
         return self.message
+
+
+class BuildNotFoundException(PDFCreatorException):
+    pass
@@ -0,0 +1,334 @@
+import hashlib
+import struct
+import zlib
+
+from PIL import Image
+
+DEFAULT_PDF_DPI = 96.0
+PDF_STREAM_CHUNK_SIZE = 1048576
+PDF_STRIP_HEIGHT = 512
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_SIGNATURE = b"\xff\xd8"
+# JPEG Start Of Frame markers (every SOFn except DHT, JPG and DAC)
+JPEG_SOF_MARKERS = [0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF]
+PNG_COLOR_TYPE_GRAY = 0
+PNG_COLOR_TYPE_RGB = 2
+
+
+class PDFWriter:
+    """
+    Writes a PDF one page at a time. Every object is written to the output as soon as it is created, so the memory used
+    while building the PDF only ever depends on the page being added, never on the number of pages in the document.
+    Identical images are only embedded once, and every page that shows them shares the same image XObject.
+    """
+    def __init__(self, output_file):
+        """
+        Writes the PDF header and reserves the catalog and page tree objects, which are written out on close()
+        :param
+            - output_file:  file - Any object with a write() method (local file, S3 multipart upload, etc.)
+        """
+        self.output_file = output_file
+        self.position = 0
+        self.object_offsets = {}
+        self.page_ids = []
+        self.image_objects = {}  # The image XObjects already written to the PDF, keyed by the digest of their file
+        self.next_object_id = 3
+        self.catalog_id = 1
+        self.pages_id = 2
+        self.closed = False
+
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    @property
+    def page_count(self):
+        return len(self.page_ids)
+
+    def add_image_page(self, image_path, dpi=None):
+        """
+        Adds a page to the PDF that is the exact size of the given image and contains only that image
+        :param
+            - image_path:   string - The path to the image file that will become the page
+            - dpi:          float - Used to convert pixels into PDF points. Defaults to the image's own dpi or 96
+        :return
+            - int:  The number of pages in the PDF after adding this one
+        """
+        if self.closed:
+            raise PDFWriterException("Unable to add a page to a PDF that has already been closed")
+
+        digest = _file_digest(image_path)
+        if digest not in self.image_objects:
+            self.image_objects[digest] = self._write_image(image_path)
+        image_id, width, height = self.image_objects[digest]
+        return self._write_page(image_id, width, height, dpi or get_image_dpi(image_path))
+
+    def close(self):
+        """
+        Writes the page tree, catalog, cross reference table and trailer. The output file is left open for the caller.
+        :return
+            - int:  The total number of bytes written to the output file
+        """
+        if self.closed:
+            return self.position
+
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self._write_object(self.pages_id, f"<< /Type /Pages /Kids [ {kids} ] /Count {len(self.page_ids)} >>".encode())
+        self._write_object(self.catalog_id, f"<< /Type /Catalog /Pages {self.pages_id} 0 R >>".encode())
+
+        # - Cross reference table. Each entry must be exactly 20 bytes long
+        xref_position = self.position
+        object_count = self.next_object_id
+        self._write(f"xref\n0 {object_count}\n".encode())
+        self._write(b"0000000000 65535 f \n")
+        for object_id in range(1, object_count):
+            self._write(f"{self.object_offsets.get(object_id, 0):010d} 00000 n \n".encode())
+
+        self._write(f"trailer\n<< /Size {object_count} /Root {self.catalog_id} 0 R >>\n"
+                    f"startxref\n{xref_position}\n%%EOF\n".encode())
+        self.closed = True
+        return self.position
+
+    def _write(self, data):
+        self.output_file.write(data)
+        self.position += len(data)
+
+    def _new_object_id(self):
+        object_id = self.next_object_id
+        self.next_object_id += 1
+        return object_id
+
+    def _begin_object(self, object_id):
+        self.object_offsets[object_id] = self.position
+        self._write(f"{object_id} 0 obj\n".encode())
+
+    def _write_object(self, object_id, body):
+        self._begin_object(object_id)
+        self._write(body)
+        self._write(b"\nendobj\n")
+
+    def _write_stream_object(self, object_id, dictionary, chunks, length=None):
+        """
+        Writes a stream object whose data is provided as an iterable of byte chunks. When the length is not known up
+        front it is written afterwards as its own indirect object.
+        """
+        length_id = None
+        if length is None:
+            length_id = self._new_object_id()
+            length_entry = f"{length_id} 0 R"
+        else:
+            length_entry = f"{length}"
+
+        self._begin_object(object_id)
+        self._write(f"<< {dictionary} /Length {length_entry} >>\nstream\n".encode())
+        stream_start = self.position
+        for chunk in chunks:
+            if chunk:
+                self._write(chunk)
+        stream_length = self.position - stream_start
+        self._write(b"\nendstream\nendobj\n")
+
+        if length_id:
+            self._write_object(length_id, f"{stream_length}".encode())
+
+    def _write_page(self, image_id, width, height, dpi):
+        page_width = width * 72.0 / dpi
+        page_height = height * 72.0 / dpi
+
+        content = f"q {page_width:.4f} 0 0 {page_height:.4f} 0 0 cm /Im0 Do Q".encode()
+        content_id = self._new_object_id()
+        self._write_stream_object(content_id, "", [content], len(content))
+
+        page_id = self._new_object_id()
+        self._write_object(page_id, f"<< /Type /Page /Parent {self.pages_id} 0 R "
+                                    f"/MediaBox [ 0 0 {page_width:.4f} {page_height:.4f} ] "
+                                    f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> "
+                                    f"/Contents {content_id} 0 R >>".encode())
+        self.page_ids.append(page_id)
+        return len(self.page_ids)
+
+    def _write_image(self, image_path):
+        """
+        Writes the image XObject. JPEGs and simple PNGs are copied straight from disk without decoding them, anything
+        else is decoded and re-compressed one strip at a time.
+        :return
+            - tuple:    The object id of the image XObject and the width and height of the image
+        """
+        image_id = self._new_object_id()
+        header = read_image_header(image_path)
+        image_format, width, height = header["format"], header["width"], header["height"]
+
+        if image_format == "JPEG" and header.get("components") in (1, 3):
+            color_space = "/DeviceGray" if header["components"] == 1 else "/DeviceRGB"
+            dictionary = f"/Type /XObject /Subtype /Image /Width {width} /Height {height} " \
+                         f"/ColorSpace {color_space} /BitsPerComponent 8 /Filter /DCTDecode"
+            self._write_stream_object(image_id, dictionary, _iter_file_chunks(image_path), header["file_size"])
+
+        elif image_format == "PNG" and header.get("bit_depth") == 8 and not header.get("interlaced") \
+                and header.get("color_type") in (PNG_COLOR_TYPE_GRAY, PNG_COLOR_TYPE_RGB):
+            colors = 1 if header["color_type"] == PNG_COLOR_TYPE_GRAY else 3
+            color_space = "/DeviceGray" if colors == 1 else "/DeviceRGB"
+            dictionary = f"/Type /XObject /Subtype /Image /Width {width} /Height {height} " \
+                         f"/ColorSpace {color_space} /BitsPerComponent 8 /Filter /FlateDecode " \
+                         f"/DecodeParms << /Predictor 15 /Colors {colors} /BitsPerComponent 8 /Columns {width} >>"
+            self._write_stream_object(image_id, dictionary, _iter_png_idat_chunks(image_path), header["idat_size"])
+
+        else:
+            with Image.open(image_path) as image:
+                mode = "L" if image.mode in ("1", "L") else "RGB"
+                color_space = "/DeviceGray" if mode == "L" else "/DeviceRGB"
+                dictionary = f"/Type /XObject /Subtype /Image /Width {width} /Height {height} " \
+                             f"/ColorSpace {color_space} /BitsPerComponent 8 /Filter /FlateDecode"
+                self._write_stream_object(image_id, dictionary, _iter_deflated_strips(image, mode))
+
+        return image_id, width, height
+
+
+def read_image_header(image_path):
+    """
+    Reads the dimensions (and encoding details used by the PDFWriter) from the header of an image file, without
+    decoding any pixel data. Formats other than PNG and JPEG fall back to PIL, which also only reads the header.
+    :param
+        - image_path:   string - The path to the image file
+    :return
+        - dict: Contains at least the "format", "width" and "height" of the image
+    """
+    with open(image_path, "rb") as image_file:
+        signature = image_file.read(8)
+        image_file.seek(0, 2)
+        file_size = image_file.tell()
+        image_file.seek(0)
+
+        if signature == PNG_SIGNATURE:
+            return _read_png_header(image_file, file_size)
+        elif signature[:2] == JPEG_SIGNATURE:
+            header = _read_jpeg_header(image_file, file_size)
+            if header:
+                return header
+
+    with Image.open(image_path) as image:
+        return {"format": image.format, "width": image.size[0], "height": image.size[1], "file_size": file_size}
+
+
+def get_image_size(image_path):
+    """
+    :return
+        - tuple:    The (width, height) of the image, read from its header
+    """
+    header = read_image_header(image_path)
+    return header["width"], header["height"]
+
+
+def get_image_dpi(image_path):
+    """
+    :return
+        - float:    The horizontal dpi stored in the image, or DEFAULT_PDF_DPI when the image does not have one
+    """
+    with Image.open(image_path) as image:
+        dpi = image.info.get("dpi")
+    try:
+        return float(dpi[0]) if dpi and dpi[0] else DEFAULT_PDF_DPI
+    except (TypeError, ValueError):
+        return DEFAULT_PDF_DPI
+
+
+def _read_png_header(image_file, file_size):
+    image_file.seek(8)
+    header = {"format": "PNG", "file_size": file_size, "idat_size": 0}
+
+    while True:
+        chunk_header = image_file.read(8)
+        if len(chunk_header) < 8:
+            break
+        length, chunk_type = struct.unpack(">I4s", chunk_header)
+
+        if chunk_type == b"IHDR":
+            width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", image_file.read(13))
+            header.update({"width": width, "height": height, "bit_depth": bit_depth, "color_type": color_type,
+                           "interlaced": bool(interlace)})
+            image_file.seek(4, 1)
+        elif chunk_type == b"IDAT":
+            header["idat_size"] += length
+            image_file.seek(length + 4, 1)
+        elif chunk_type == b"IEND":
+            break
+        else:
+            image_file.seek(length + 4, 1)
+
+    return header
+
+
+def _read_jpeg_header(image_file, file_size):
+    image_file.seek(2)
+    while True:
+        marker = image_file.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+
+        # Skip any fill bytes before the marker
+        while marker[1] == 0xFF:
+            marker = marker[1:] + image_file.read(1)
+
+        segment_length = struct.unpack(">H", image_file.read(2))[0]
+        if marker[1] in JPEG_SOF_MARKERS:
+            _, height, width, components = struct.unpack(">BHHB", image_file.read(6))
+            return {"format": "JPEG", "width": width, "height": height, "components": components,
+                    "file_size": file_size}
+        image_file.seek(segment_length - 2, 1)
+
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    for chunk in _iter_file_chunks(path):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _iter_file_chunks(path):
+    with open(path, "rb") as source:
+        chunk = source.read(PDF_STREAM_CHUNK_SIZE)
+        while chunk:
+            yield chunk
+            chunk = source.read(PDF_STREAM_CHUNK_SIZE)
+
+
+def _iter_png_idat_chunks(path):
+    with open(path, "rb") as source:
+        source.seek(8)
+        while True:
+            chunk_header = source.read(8)
+            if len(chunk_header) < 8:
+                return
+            length, chunk_type = struct.unpack(">I4s", chunk_header)
+            if chunk_type == b"IDAT":
+                remaining = length
+                while remaining:
+                    data = source.read(min(remaining, PDF_STREAM_CHUNK_SIZE))
+                    if not data:
+                        return
+                    remaining -= len(data)
+                    yield data
+                source.seek(4, 1)
+            elif chunk_type == b"IEND":
+                return
+            else:
+                source.seek(length + 4, 1)
+
+
+def _iter_deflated_strips(image, mode):
+    compressor = zlib.compressobj(6)
+    width, height = image.size
+    for top in range(0, height, PDF_STRIP_HEIGHT):
+        strip = image.crop((0, top, width, min(top + PDF_STRIP_HEIGHT, height)))
+        if strip.mode != mode:
+            strip = strip.convert(mode)
+        yield compressor.compress(strip.tobytes())
+    yield compressor.flush()
+
+
+class PDFWriterException(Exception):
+    def __init__(self, message):
+        self.msg = message
+        self.message = message
+
+    def __str__(self):
+        return self.message
@@ -1,13 +1,20 @@
 import logging
 from hippo import pdf_creator
+from hippo.bundle import BuildBundle
+from hippo.execution_plan import get_execution_plan
+from hippo.incremental import IncrementalCapture, get_capture_fingerprint
+from hippo.manifest import ManifestWriter, write_manifest
+from hippo import sitemap
+from hippo.github_config import get_action_libraries, get_configuration_from_github, \
+    get_external_libraries
+import itertools
 import json
 import os
 import queue
-import requests
 import shutil
-from io import StringIO, BytesIO
 import tempfile
 import threading
+import time
 import traceback
 from hippo import util as c
 
@@ -15,8 +22,8 @@ from hippo.schemas.validate_schemas import SchemaValidationException, validate_p
 from hippo.screenshot_thread import DEFAULT_SCREENSHOT_THREAD_COUNT, ScreenshotThread
 from src.the_ark.email_client import EmailClientException
 from src.the_ark.rhino_client import RhinoClientException
-from src.the_ark.s3_client import S3Client, S3ClientException
-from src.the_ark.screen_capture import DEFAULT_SCROLL_PADDING
+from hippo.storage import create_storage
+from src.the_ark.s3_client import S3ClientException
 from src.the_ark import selenium_helpers
 
 log = c.create_logger("Request Thread")
@@ -29,7 +36,7 @@ class Request(threading.Thread):
         self.is_alive = True
         self.environment = config[c.HIPPO_ENVIRONMENT]
         self.s3_bucket = config[c.HIPPO_S3_BUCKET]
-        self.s3 = S3Client(self.s3_bucket)
+        self.s3 = create_storage(config)
         self.mandrill_key = config.get(c.MANDRILL_KEY, None)
         self.rhino_host = config[c.RHINO_HOST]
         self.content_path = ""
@@ -39,10 +46,8 @@ class Request(threading.Thread):
         self.repo = config[c.GITHUB_REPO]
         self.github_token = config.get(c.GITHUB_TOKEN)
         self.github_directory = config.get(c.GITHUB_DIRECTORY, '')
-        self.github_branch = config[c.GITHUB_BRANCH]
-        if not self.github_branch:
-            # Default the git branch to develop if not set and not running on production
-            self.github_branch = "develop" if self.environment not in ["production"] else "production"
+        # Default the git branch to develop if not set and not running on production
+        self.github_branch = c.get_github_branch(config)
 
         # AEM tish
         self.username = config.get(c.HIPPO_AEM_USERNAME)
@@ -55,6 +60,18 @@ class Request(threading.Thread):
         self.sauce_labs_username = config.get(c.SAUCE_LABS_USERNAME)
         self.sauce_labs_access_key = config.get(c.SAUCE_LABS_ACCESS_KEY)
 
+        # The url this service is reached at, used to link to images stored in a build bundle and to the image lists
+        self.public_url = config.get(c.HIPPO_PUBLIC_URL) or ""
+        if self.public_url and not c.is_absolute_url(self.public_url):
+            log.warning(f"{c.HIPPO_PUBLIC_URL} must be an absolute url, ignoring {self.public_url!r}")
+            self.public_url = ""
+
+        # How long a sitemap is used from the sitemap cache before checking whether it has changed
+        self.sitemap_cache_ttl = int(config.get(c.HIPPO_SITEMAP_CACHE_TTL, c.DEFAULT_SITEMAP_CACHE_TTL))
+
+        # How long a project config is used from the config cache before checking Github for changes to it
+        self.config_cache_ttl = int(config.get(c.HIPPO_CONFIG_CACHE_TTL, c.DEFAULT_CONFIG_CACHE_TTL))
+
     def run(self):
         while self.is_alive:
             request_data = request_queue.get()
@@ -95,6 +112,8 @@ class Request(threading.Thread):
 
 
         pdf_image_list = {}
+        bundle = None
+        manifest = None
 
         # - Set up the path in which the screenshots will be stored
         s3_image_path = f"hippo/screenshots/{requested_project}/{branch}/{build_id}"
@@ -140,8 +159,10 @@ class Request(threading.Thread):
         project = project_config.get(c.PROJECT, requested_project)
         thread_count = request_data.get(c.THREAD_COUNT) or project_config.get(c.THREAD_COUNT) or DEFAULT_SCREENSHOT_THREAD_COUNT
 
-        action_libraries = self.get_action_libraries()
-
+        library_stats = {}
+        action_libraries = self.get_action_libraries(project_config, library_stats)
+        if library_stats:
+            image_list[c.ACTION_LIBRARY_LOAD] = library_stats
 
         # Create content path if running on a platform site
         self.content_path = request_data.get(c.CONTENT_PATH, "")
@@ -172,8 +193,13 @@ class Request(threading.Thread):
                     error_list.append("Unable to find a usable Sauce Labs tunnel. Due to this, the requested "
                                       "screenshot job was completed using Firefox on the running Hippo Prod service.")
 
+                crawl_stats = {}
+                page_lastmods = {}
                 site_paths = self.gather_urls(site_paths, url, project, browser, skip_sections, site_sections,
-                                              project_config, self.username, self.password)
+                                              project_config, self.username, self.password, crawl_stats,
+                                              page_lastmods)
+                if crawl_stats:
+                    image_list[c.SITEMAP_CRAWL] = crawl_stats
             except Exception as e:
                 message = "An error was caught while crawling the site | {e}"
                 raise c.HippoThreadError(message, stacktrace=traceback.format_exc())
@@ -186,56 +212,152 @@ class Request(threading.Thread):
             image_list = c.add_urls_to_image_list(image_list, user, project, branch, sanitized_url, site_paths,
                                                   build_id, mobile, browser, self.content_path)
 
-            paginated, footers, headers, browser_size, before_screenshot, scroll_padding, \
-                content_container_selector = self.parse_screenshot_thread_data(project_config, mobile, project,
-                                                                               browser_size)
+            # - The config's actions are compiled once, and the plan is shared by every thread and later builds
+            plan = get_execution_plan(project_config, mobile, action_libraries)
+            paginated = plan.paginated if requested_pagination is None else requested_pagination
 
-            if requested_pagination is not None:
-                paginated = requested_pagination
+            # Set the browser size to the requested values, if one was provided
+            if browser_size:
+                # Use thte width/height from the request if available, otherwise retain the value from the config
+                width = browser_size.get(c.WIDTH_KEY)
+                height = browser_size.get(c.HEIGHT_KEY)
 
-            common_actions, mobile_actions, desktop_actions, reference_actions = self.parse_action_data(project_config)
+                # Make sure a None or 0 value is not accepted
+                if not width:
+                    width = plan.browser_size[c.WIDTH_KEY]
+                if not height:
+                    height = plan.browser_size[c.HEIGHT_KEY]
+                browser_size = {c.WIDTH_KEY: width, c.HEIGHT_KEY: height}
+            else:
+                browser_size = plan.browser_size
+
+            # - Work out which pages have changed since the last build, when only those are being captured
+            fingerprint = get_capture_fingerprint(plan.plan_hash, browser.get(c.BROWSER_NAME), browser_size,
+                                                  file_extension)
+            incremental = IncrementalCapture(self.s3, requested_project, branch, sanitized_url, mobile, s3_image_path,
+                                             local_image_path, request_data.get(c.INCREMENTAL, False), fingerprint)
+            incremental.select_pages(image_list, page_lastmods)
+
+            # - Start the PDF builder so pages are added to the PDF as soon as they finish being captured. When the
+            # request skips the PDF, it can be created later on from the /build/<build_id>/pdf endpoint
+            pdf_name = f"{requested_project}_{('Mobile' if mobile else 'Desktop')}_screenshots.pdf"
+            pdf_builder = None
+            if request_data.get(c.CREATE_PDF, True):
+                log.info("Starting PDF generation process....")
+                if request_data.get(c.PDF_VOLUMES):
+                    pdf_builder = pdf_creator.PDFVolumeBuilder(image_list, self.s3, s3_image_path, local_image_path,
+                                                               pdf_name, file_extension,
+                                                               pdf_profile=request_data.get(c.PDF_PROFILE),
+                                                               pdf_volumes=request_data.get(c.PDF_VOLUMES))
+                else:
+                    pdf_builder = pdf_creator.PDFBuilderThread(image_list, self.s3, s3_image_path, local_image_path,
+                                                               pdf_name, file_extension,
+                                                               pdf_profile=request_data.get(c.PDF_PROFILE))
+                pdf_builder.start()
 
-            # - Create screenshot threads
-            for i in range(thread_count):
-                sc_thread = ScreenshotThread(screenshot_queue, self.s3, s3_image_path, local_image_path, project_config,
-                                             project, url, image_list, browser, self.content_path, scroll_padding,
-                                             footers, headers, before_screenshot, browser_size, paginated,
-                                             custom_inputs, common_actions, desktop_actions, mobile_actions,
-                                             action_libraries, reference_actions, error_list, self.username,
-                                             self.password, self.pfizer_username, self.pfizer_password, self.pfizer_url,
-                                             content_container_selector, mobile, file_extension, resize_delay=1)
-                sc_thread.setDaemon(True)
-                sc_thread.start()
-                screenshot_thread_list.append(sc_thread)
+            # - In bundle mode the images are streamed into a single archive on S3 instead of being stored one by one
+            if request_data.get(c.BUNDLE):
+                bundle = BuildBundle(self.s3, s3_image_path, build_id, self.public_url)
 
-            # - Add the pages to be captured to the queue for the threads to begin capturing
-            for page_object in image_list["image_list"]:
-                screenshot_queue.put(page_object)
+            # - The compact manifest of the image_list is written out as each page finishes
+            manifest = ManifestWriter(image_list, self.s3, s3_image_path, local_image_path,
+                                      bundle.get_image_url() if bundle else None)
 
-            # - Wait for all of the threads to finish their tasks
-            for t in screenshot_thread_list:
-                t.join()
+            def page_finished(page_object):
+                manifest.page_finished(page_object)
+                if pdf_builder:
+                    pdf_builder.page_finished(page_object)
 
             try:
-                # - Create and send the pdf
-                # Instantiate the pdf creator class
-                log.info("Starting PDF generation process....")
-                pdf = pdf_creator.PDFCreator(image_list, self.s3, s3_image_path)
-                pdf_url, pdf_image_list = pdf.create_pdf(local_image_path, f"{requested_project}_{('Mobile' if mobile else 'Desktop')}_screenshots.pdf", file_extension)
-                log.info(f"PDF created successfully!: {pdf_url}")
-                # Add pdf url to the image_list(s)
-                image_list["pdf_url"] = pdf_url
-                pdf_image_list["pdf_url"] = pdf_url
+                # - Create screenshot threads
+                for i in range(thread_count):
+                    sc_thread = ScreenshotThread(screenshot_queue, self.s3, s3_image_path, local_image_path,
+                                                 project_config, project, url, image_list, browser, self.content_path,
+                                                 plan.scroll_padding, plan.footers, plan.headers,
+                                                 plan.before_screenshot, browser_size, paginated, custom_inputs,
+                                                 plan.common_actions, plan.desktop_actions, plan.mobile_actions,
+                                                 plan.action_libraries, plan.reference_actions, error_list,
+                                                 self.username, self.password, self.pfizer_username,
+                                                 self.pfizer_password, self.pfizer_url,
+                                                 plan.content_container_selector, mobile, file_extension,
+                                                 resize_delay=1, page_finished_callback=page_finished,
+                                                 bundle=bundle,
+                                                 incremental=incremental if incremental.enabled else None,
+                                                 execution_plan=plan)
+                    sc_thread.setDaemon(True)
+                    sc_thread.start()
+                    screenshot_thread_list.append(sc_thread)
+
+                # - Add the pages to be captured to the queue for the threads to begin capturing
+                for page_object in image_list["image_list"]:
+                    screenshot_queue.put(page_object)
+
+                # - Wait for all of the threads to finish their tasks
+                for t in screenshot_thread_list:
+                    t.join()
+            finally:
+                # - Let the PDF builder add whatever pages are left, even if the capture did not finish cleanly
+                if pdf_builder:
+                    pdf_builder.finish()
 
-                # Send the full page image list up to S3 and store its url in the pdf list
-                image_list_url = self._send_image_list_to_s3(image_list, s3_image_path, "falcon_image_list.json")
-                pdf_image_list["falcon_image_list"] = image_list_url
+            if pdf_builder:
+                try:
+                    # - Wait for the pdf to be finished and sent
+                    pdf_url, pdf_image_list = pdf_builder.get_result()
+                    log.info(f"PDF created successfully!: {pdf_url}")
+                    # Add pdf url to the image_list(s)
+                    image_list[c.PDF_URL] = pdf_url
+                    pdf_image_list[c.PDF_URL] = pdf_url
+
+                except Exception as e:
+                    message = f"Error while creating/Sending the pdf | {e}"
+                    log.error(message)
+                    error_list.append(message)
+
+            # The screenshot log is still created from the image list when there is no pdf list. Only the page list is
+            # copied, since the log only removes the misc page from it
+            if not pdf_image_list:
+                pdf_image_list = dict(image_list, image_list=list(image_list["image_list"]))
+
+            if incremental.enabled:
+                image_list[c.INCREMENTAL_CAPTURE] = incremental.get_stats(len(image_list["image_list"]) - 1)
+                pdf_image_list[c.INCREMENTAL_CAPTURE] = image_list[c.INCREMENTAL_CAPTURE]
+
+            try:
+                bundle_record = bundle.close() if bundle else None
+                manifest.close()
+
+                # Send the full page image list up to S3 next to the manifest, and store its url in the pdf list
+                image_list_url = self._send_image_list_to_s3(image_list, s3_image_path, c.FALCON_IMAGE_LIST_FILENAME)
+                pdf_image_list["falcon_image_list"] = self.get_image_list_url(build_id, image_list_url)
+
+                # Record where the build was stored, so that its PDF can be created later on
+                build_record = {
+                    "build_id": build_id,
+                    "project": requested_project,
+                    "branch": branch,
+                    "mobile": mobile,
+                    "s3_path": s3_image_path,
+                    "image_list": c.FALCON_IMAGE_LIST_FILENAME,
+                    "manifest": c.MANIFEST_FILENAME,
+                    "pdf_manifest": c.PDF_MANIFEST_FILENAME,
+                    "pdf_name": pdf_name,
+                    "file_extension": file_extension,
+                    "pdf_profile": request_data.get(c.PDF_PROFILE),
+                    "pdf_volumes": request_data.get(c.PDF_VOLUMES),
+                    "bundle": bundle_record
+                }
+                self._send_image_list_to_s3(build_record, c.BUILD_RECORD_PATH.format(build_id=build_id),
+                                            c.BUILD_RECORD_FILENAME)
+
+                # Only an incremental build that finished without errors is compared against by the next one
+                if incremental.enabled and not error_list:
+                    incremental.save(image_list, build_id, bundle_record)
 
             except Exception as e:
-                message = f"Error while creating/Sending the pdf | {e}"
+                message = f"Error while sending the image list to S3 | {e}"
                 log.error(message)
                 error_list.append(message)
-                pass
 
         except c.HippoGeneralException as hippo_error:
             message = f"An exception occurred within Hippo while performing this run, causing the job to be " \
@@ -249,10 +371,17 @@ class Request(threading.Thread):
             log.error(message)
             error_list.append(message)
 
+        # - Cancel the bundle upload if the build never got far enough to finish it
+        if bundle and not bundle.closed:
+            bundle.abort()
+        if manifest and not manifest.closed:
+            manifest.abort()
+
         # - Create and send log to Rhino and Email
         self._output_screenshot_log(requested_project, sanitized_url, branch, send_to_rhino, build_id, user,
                                     pdf_image_list, error_list, s3_image_path, recipients, request_data["start_date"],
-                                    request_data["start_time"], site_sections, skip_sections)
+                                    request_data["start_time"], site_sections, skip_sections, local_image_path,
+                                    bundle.get_image_url() if bundle else None)
 
         # Delete local screenshot folder
         try:
@@ -313,7 +442,8 @@ class Request(threading.Thread):
 
         # - Look up on github if a local file was not available
         if not project_config:
-            project_config = c.get_configuration_from_github(project, branch, self.environment, self.github_token, self.repo)
+            project_config = get_configuration_from_github(project, branch, self.environment, self.github_token, self.repo,
+                                                           self.config_cache_ttl)
 
         # - Validate that the configuration matches the schema
         if project_config:
@@ -321,45 +451,44 @@ class Request(threading.Thread):
 
         return project_config
 
-    def get_action_libraries(self):
-        action_dict = {}
-
+    def get_action_libraries(self, project_config, library_stats=None):
+        """
+        Loads the action libraries that the project config's external actions reference
+        :param
+            - project_config:   dict - The project's configuration
+            - library_stats:    dict - Filled in with how long the libraries took to load and where they came from
+        :return
+            - dict: The content of each action library, keyed by its name
+        """
+        start_time = time.time()
+        library_stats = {} if library_stats is None else library_stats
+        library_names = get_external_libraries(project_config)
+        if not library_names:
+            return {}
+
+        # - Read the libraries from the local hippo-sites directory when running locally, otherwise from GitHub
+        local_path = None
         if self.github_directory and self.environment in ["local"]:
-            local_action_path = self.github_directory + "/action_libraries"
-            config_files = [f for f in os.listdir(local_action_path)
-                            if os.path.isfile(os.path.join(local_action_path, f))]
-            for file_name in config_files:
-                if file_name.endswith(".json"):
-                    with open(f"{local_action_path}/{file_name}") as action_library:
-                        action_dict[file_name.rstrip(".json")] = json.load(action_library)
-
-        # - Get actions libraries for GitHub
-        else:
-            headers = {"Authorization": f"token {self.github_token}"}
-
-            # Get a list of all action libraries available for Hippo (on this environment's branch)
-            action_libraries = c.get_config_list(self.repo, self.github_branch, "action_libraries", headers)
-
-            # - Request the config data
-            for library in action_libraries:
-
-                repo_path = f"/meltmedia/{self.repo}/{self.github_branch}/action_libraries/{library}"
-                resp = requests.get(f"https://raw.githubusercontent.com{repo_path}", headers=headers)
-                # Check that the respone had a good status code
-                if resp.status_code > 400:
-                    message = f"A bad status code of {resp.status_code} was returned when attempting to grab the action library at {repo_path}. " \
-                              "Please see your QA rep for help troubleshooting this issue: {resp.text}"
-                    log.error(message)
-                    raise c.HippoGeneralException(message)
-                else:
-                    library_name = library.rstrip(".json")
-                    library_content = json.loads(resp.content)
-                    action_dict[library_name] = library_content
-
+            local_path = self.github_directory + "/action_libraries"
+        headers = {"Authorization": f"token {self.github_token}"}
+
+        action_dict = get_action_libraries(self.repo, self.github_branch, headers, library_names, local_path,
+                                           self.config_cache_ttl, library_stats)
+
+        library_stats["libraries"] = len(action_dict)
+        library_stats["seconds"] = round(time.time() - start_time, 2)
+        # - The share of this build's libraries that came out of the config cache, rather than from GitHub
+        lookups = library_stats["cached"] + library_stats["fetched"]
+        library_stats["hit_rate"] = round(library_stats["cached"] / lookups, 2) if lookups else 0.0
+        log.info(f"Loaded {len(action_dict)} action libraries in {library_stats['seconds']}s")
         return action_dict
 
-    def gather_urls(self, site_paths, url, project, browser, skip_sections, site_sections, config, username, password):
+    def gather_urls(self, site_paths, url, project, browser, skip_sections, site_sections, config, username, password,
+                    crawl_stats=None, page_lastmods=None):
         # - Gather urls for the site
+        start_time = time.time()
+        crawl_stats = {} if crawl_stats is None else crawl_stats
+
         # Check whether urls were provided within the project config and use those
         if not site_paths:
             site_paths = config.get(c.SITE_PATHS)
@@ -373,12 +502,12 @@ class Request(threading.Thread):
                 sitemap_url = c.get_sitemap_path(project, config, url, self.content_path)
 
             # Crawl the sitemap_url for the internal urls for this site
-            site_paths = c.crawl(sitemap_url, browser, url, username, password, self.content_path)
-            # TODO: These site path are full URLs at this point
+            site_paths = sitemap.crawl(sitemap_url, browser, url, username, password, self.content_path,
+                                       self.sitemap_cache_ttl, crawl_stats, page_lastmods)
 
-            # - Add the hidden pages of the site to the url list, if there are any specified in the config
-            for page in config.get(c.HIDDEN_PAGES, []):
-                site_paths.append(page)
+            # - Add the hidden pages of the site to the url list, if there are any specified in the config. The
+            # sitemap is still being read at this point, so they are chained on to the end of it
+            site_paths = itertools.chain(site_paths, config.get(c.HIDDEN_PAGES, []))
 
         # Add any skip sections from the project config to the skip sections list
         skip_sections = skip_sections + config.get(c.SKIP_SECTIONS, [])
@@ -386,144 +515,17 @@ class Request(threading.Thread):
         # - Remove sections and pages that are not specified to be captured this screenshot run
         site_paths = c.trim_sections(site_paths, self.content_path, site_sections, skip_sections)
 
-        return site_paths
-
-    def parse_screenshot_thread_data(self, config, mobile, project, browser_size):
-        try:
-            # - Instantiate variables for cases where there is neither a desktop or mobile environment
-            paginated = False
-            footers = []
-            headers = []
-            config_browser_size = None
-            before_screenshot = None
-            scroll_padding = DEFAULT_SCROLL_PADDING
-            content_container_selector = "html"
-
-            # - Set Up Environment variables
-            # Set any common attributes
-            environments = config.get(c.ENVIRONMENTS, {})
-            common_config = environments.get(c.COMMON_ENVIRONMENT)
-            if common_config:
-                paginated = common_config.get(c.PAGINATED, paginated)
-                footers = common_config.get(c.FOOTERS, footers)
-                headers = common_config.get(c.HEADERS, headers)
-                config_browser_size = common_config.get(c.BROWSER_SIZE, config_browser_size)
-                scroll_padding = common_config.get(c.SCROLL_PADDING_KEY, scroll_padding)
-                before_screenshot = common_config.get(c.BEFORE_SCREENSHOT_KEY, before_screenshot)
-                content_container_selector = common_config.get(c.CONTENT_CONTAINER_SELECTOR_KEY,
-                                                               content_container_selector)
-
-            # Overwrite environment parameters if they exist in the Mobile or Desktop environments
-            if mobile:
-                mobile_config = environments.get(c.MOBILE_ENVIRONMENT)
-                config_browser_size = c.DEFAULT_MOBILE_BROWSER_SIZE if not config_browser_size else config_browser_size
-                if mobile_config:
-                    paginated = mobile_config.get(c.PAGINATED, paginated)
-                    footers = mobile_config.get(c.FOOTERS, footers)
-                    headers = mobile_config.get(c.HEADERS, headers)
-                    config_browser_size = mobile_config.get(c.BROWSER_SIZE, config_browser_size)
-                    scroll_padding = mobile_config.get(c.SCROLL_PADDING_KEY, scroll_padding)
-                    before_screenshot = mobile_config.get(c.BEFORE_SCREENSHOT_KEY, before_screenshot)
-                    content_container_selector = mobile_config.get(c.CONTENT_CONTAINER_SELECTOR_KEY,
-                                                                   content_container_selector)
-            else:
-                desktop_config = environments.get(c.DESKTOP_ENVIRONMENT)
-                config_browser_size = c.DEFAULT_DESKTOP_BROWSER_SIZE if not config_browser_size else config_browser_size
-                if desktop_config:
-                    paginated = desktop_config.get(c.PAGINATED, paginated)
-                    footers = desktop_config.get(c.FOOTERS, footers)
-                    headers = desktop_config.get(c.HEADERS, headers)
-                    config_browser_size = desktop_config.get(c.BROWSER_SIZE, config_browser_size)
-                    scroll_padding = desktop_config.get(c.SCROLL_PADDING_KEY, scroll_padding)
-                    before_screenshot = desktop_config.get(c.BEFORE_SCREENSHOT_KEY, before_screenshot)
-                    content_container_selector = desktop_config.get(c.CONTENT_CONTAINER_SELECTOR_KEY,
-                                                                    content_container_selector)
-
-            # Set the browser size to the requested values, if one was provided
-            if browser_size:
-                # Use thte width/height from the request if available, otherwise retain the value from the config
-                width = browser_size.get(c.WIDTH_KEY)
-                height = browser_size.get(c.HEIGHT_KEY)
+        # - The sitemap is read as the sections are trimmed, so the crawl is only finished now
+        if crawl_stats:
+            crawl_stats["seconds"] = round(time.time() - start_time, 2)
+            crawl_stats["source"] = c.get_crawl_source(crawl_stats)
+            log.info(f"Crawled the sitemap from the {crawl_stats['source']} in {crawl_stats['seconds']}s")
 
-                # Make sure a None or 0 value is not accepted
-                if not width:
-                    width = config_browser_size[c.WIDTH_KEY]
-                if not height:
-                    height = config_browser_size[c.HEIGHT_KEY]
-                browser_size = {c.WIDTH_KEY: width, c.HEIGHT_KEY: height}
-            else:
-                browser_size = config_browser_size
-
-            if all(env not in environments.keys() for env in [c.MOBILE_ENVIRONMENT, c.DESKTOP_ENVIRONMENT]):
-                log.warn(f"This project's configuration file does not have a {c.DESKTOP_ENVIRONMENT!r} or {c.MOBILE_ENVIRONMENT} environment.")
-
-            return paginated, footers, headers, browser_size, before_screenshot, scroll_padding, \
-                   content_container_selector
-
-        except KeyError as key:
-            message = f"The key {key} is missing from the config data"
-            raise c.MissingKey(message, key, stacktrace=traceback.format_exc(),
-                               details={"missing_key": str(key)})
-
-        except Exception as e:
-            # Catch all messages coming in and format the message to include the setup method location
-            message = "Problem encountered while gathering the environment variables for the run: {e}"
-            raise c.HippoThreadError(message, stacktrace=traceback.format_exc())
-
-    def parse_action_data(self, config):
-        common_actions = {}
-        mobile_actions = {}
-        desktop_actions = {}
-        reference_actions = {}
-
-        # - Parse out the different actions by environment
-        try:
-            environments = config.get(c.ENVIRONMENTS, {})
-
-            if c.COMMON_ENVIRONMENT in environments:
-                for page in environments[c.COMMON_ENVIRONMENT].get(c.PAGES, []):
-                    if type(page[c.PATH_KEY]) is list:
-                        for path in page[c.PATH_KEY]:
-                            common_actions[path] = page[c.ACTION_LIST_KEY]
-                    else:
-                        common_actions[page[c.PATH_KEY]] = page[c.ACTION_LIST_KEY]
-
-            if c.MOBILE_ENVIRONMENT in environments:
-                for page in environments[c.MOBILE_ENVIRONMENT].get(c.PAGES, []):
-                    if type(page[c.PATH_KEY]) is list:
-                        for path in page[c.PATH_KEY]:
-                            mobile_actions[path] = page[c.ACTION_LIST_KEY]
-                    else:
-                        mobile_actions[page[c.PATH_KEY]] = page[c.ACTION_LIST_KEY]
-
-            if c.DESKTOP_ENVIRONMENT in environments:
-                for page in environments[c.DESKTOP_ENVIRONMENT].get(c.PAGES, []):
-                    if type(page[c.PATH_KEY]) is list:
-                        for path in page[c.PATH_KEY]:
-                            desktop_actions[path] = page[c.ACTION_LIST_KEY]
-                    else:
-                        desktop_actions[page[c.PATH_KEY]] = page[c.ACTION_LIST_KEY]
-
-            if c.REFERENCE_ENVIRONMENT in environments:
-                for page in environments[c.REFERENCE_ENVIRONMENT].get(c.PAGES, []):
-                    if type(page[c.PATH_KEY]) is list:
-                        for path in page[c.PATH_KEY]:
-                            reference_actions[path] = page[c.ACTION_LIST_KEY]
-                    else:
-                        reference_actions[page[c.PATH_KEY]] = page[c.ACTION_LIST_KEY]
-
-            return common_actions, mobile_actions, desktop_actions, reference_actions
-
-        except KeyError as key:
-            message = f"The key {key!r} was missing from the config data while parsing the action lists"
-            raise c.MissingKey(message, key, stacktrace=traceback.format_exc(), details={"missing_key": str(key)})
-
-        except Exception as e:
-            message = f"Unexpected error while parsing the action list | {e}"
-            raise c.HippoThreadError(message, stacktrace=traceback.format_exc())
+        return site_paths
 
     def _output_screenshot_log(self, project, url, branch, send_to_rhino, build_id, user, image_list, error_list,
-                               image_path, recipients, start_date, start_time, site_sections, skip_sections):
+                               image_path, recipients, start_date, start_time, site_sections, skip_sections,
+                               local_image_path="", image_url=None):
         """Handles output creation of the form submissions
         :param
             - 'name':           String name of the form under test
@@ -551,10 +553,12 @@ class Request(threading.Thread):
 
             # import pdb; pdb.set_trace()
             # Add the log path to the image_list
-            image_list[c.SCREENSHOT_LOG_URL] = f"http://{self.s3_bucket}.s3.amazonaws.com/{(self.s3._generate_file_path(image_path, c.LOG_FILENAME))}"
+            image_list[c.SCREENSHOT_LOG_URL] = self.s3.get_file_url(image_path, c.LOG_FILENAME)
 
-            # Send the image_list up to S3
-            image_list_url = self._send_image_list_to_s3(image_list, image_path, "pdf_image_list.json")
+            # Send the image_list up to S3, as json and as a manifest
+            image_list_url = self._send_image_list_to_s3(image_list, image_path, c.PDF_IMAGE_LIST_FILENAME)
+            write_manifest(image_list, self.s3, image_path, local_image_path, c.PDF_MANIFEST_FILENAME, image_url)
+            image_list_url = self.get_image_list_url(build_id, image_list_url, pdf=True)
             image_list[c.IMAGE_LIST_URL] = image_list_url
             log.info(f"Image List JSON: {image_list_url}")
             try:
@@ -596,8 +600,25 @@ class Request(threading.Thread):
             log.error(f"Unexpected error occurred when attempting to output {c.LOG_FILENAME!r} screenshot results for project {project!r}: {e.message}")
             raise e
 
+    def get_image_list_url(self, build_id, s3_url, pdf=False):
+        """
+        :param
+            - build_id: string - The id of the build
+            - s3_url:   string - The link to the json image list on S3
+            - pdf:      bool - Whether the link is to the PDF's image list instead of the build's
+        :return
+            - string:   The link to the image list on the API when HIPPO_PUBLIC_URL is set, since it does not expire.
+                        Otherwise the link to it on S3
+        """
+        if not self.public_url:
+            return s3_url
+        return f"{self.public_url.rstrip('/')}/build/{build_id}/image_list{'/pdf' if pdf else ''}"
+
     def _send_image_list_to_s3(self, image_list, image_path, filename):
-        image_list_file = BytesIO()
-        image_list_file.write(bytes(json.dumps(image_list), encoding="utf-8"))
-        image_list_file.seek(0)
-        return self.s3.store_file(image_path, image_list_file, filename, True)
+        # The json is written out to a temp file as it is encoded, rather than being built up as one string in memory
+        with tempfile.NamedTemporaryFile("w", suffix=".json", encoding="utf-8", delete=False) as image_list_file:
+            json.dump(image_list, image_list_file)
+        try:
+            return self.s3.store_file(image_path, image_list_file.name, filename, True)
+        finally:
+            os.remove(image_list_file.name)
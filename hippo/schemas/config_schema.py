@@ -485,7 +485,8 @@ CONFIG_SCHEMA = {
                     "required": [c.ACTION_LIST_KEY]
                 },
                 c.CONTENT_CONTAINER_SELECTOR_KEY: {"type": "string"},
-                c.SCROLL_PADDING_KEY: {"type": "integer"}
+                c.SCROLL_PADDING_KEY: {"type": "integer"},
+                c.DETECT_STICKY_ELEMENTS_KEY: {"type": "boolean"}
             },
             "additionalProperties": False,
         }
@@ -37,6 +37,27 @@ REQUEST_SCHEMA = {
             "enum": [c.PNG_FILE_EXTENSION, c.JPEG_FILE_EXTENSION, c.BMP_FILE_EXTENSION]
         },
         c.CROP_IMAGES_FOR_PDF: {"type": "boolean"},
+        c.CREATE_PDF: {"type": "boolean"},
+        c.BUNDLE: {"type": "boolean"},
+        c.INCREMENTAL: {"type": "boolean"},
+        c.PDF_PROFILE: {
+            "type": "object",
+            "properties": {
+                c.MAX_WIDTH_KEY: {"type": "integer", "minimum": 1},
+                c.DPI_KEY: {"type": "number", "minimum": 1},
+                c.JPEG_QUALITY_KEY: {"type": "integer", "minimum": 1, "maximum": 95}
+            },
+            "additionalProperties": False
+        },
+        c.PDF_VOLUMES: {
+            "type": "object",
+            "properties": {
+                c.BY_SECTION_KEY: {"type": "boolean"},
+                c.MAX_PAGES_KEY: {"type": "integer", "minimum": 1},
+                c.MAX_BYTES_KEY: {"type": "integer", "minimum": 1}
+            },
+            "additionalProperties": False
+        },
         c.SKIP_SECTIONS: {
             "type": "array",
             "items": {
@@ -1,7 +1,23 @@
+import hashlib
+import json
+import math
+import threading
+import time
+
 import jsonschema
 from jsonschema.exceptions import ValidationError, RefResolutionError
+from hippo.cache import Cache, CacheEntry
 from hippo.schemas.config_schema import CONFIG_SCHEMA
 from hippo.schemas.request_schema import REQUEST_SCHEMA
+from hippo.util import VALIDATION_CACHE_SIZE
+from src.the_ark.resources.action_schema import ACTION_SCHEMA
+
+# The results of validating each project config, keyed by the schema and a hash of the config. A result never goes stale,
+# since the same data always has the same result against the same schema. Request bodies are not kept, since they are
+# rarely the same twice
+validation_cache = Cache("Schema Validation", VALIDATION_CACHE_SIZE, math.inf)
+validation_stats = {}
+validation_stats_lock = threading.Lock()
 
 
 class SchemaValidationException(Exception):
@@ -9,7 +25,7 @@ class SchemaValidationException(Exception):
         self.message = message
         self.data = schema_data if schema_data is not None else {}
         self.schema = schema if schema is not None else {}
-        self.details = schema_data if schema_data is not None else {}
+        self.details = schema_data if isinstance(schema_data, dict) else {}
 
         self.code = 'SCHEMA_VALIDATION_ERROR'
         self.details["stacktrace"] = stacktrace
@@ -42,27 +58,122 @@ class RequestValidationError(SchemaValidationException):
         self.code = 'REQUEST_VALIDATION_ERROR'
 
 
-def _validate(data, schema):
+class CompiledSchema:
+    """
+    A schema along with the validator built for it, which is reused for every validation against the schema. How long
+    the validator took to build is recorded in the validation_stats
+    """
+    def __init__(self, name, schema):
+        start_time = time.time()
+        self.name = name
+        self.schema = schema
+        validator_class = jsonschema.validators.validator_for(schema)
+        validator_class.check_schema(schema)
+        self.validator = validator_class(schema)
+        with validation_stats_lock:
+            _get_stats(name)["compile_seconds"] += time.time() - start_time
+
+
+def _validate(data, schema, memoize=False):
     """Validates json against a schema
     :param
         -   request:    JSON Dict to validate
-        -   schema:     Schema to validate against
+        -   schema:     CompiledSchema, or schema dict, to validate against
+        -   memoize:    Whether the result is kept in the validation_cache, for data that is validated again and again
 
     :returns
         True if valid data
     """
+    start_time = time.time()
+    if not isinstance(schema, CompiledSchema):
+        schema = _get_compiled_schema(schema)
+
+    data_hash = None
+    if memoize:
+        try:
+            data_hash = hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        except (TypeError, ValueError):
+            pass
+
+    if data_hash is None:
+        message = _check(data, schema)
+        cached = False
+    else:
+        # - The result was cached unless this lookup is the one that checked the data
+        checked = []
+
+        def check(entry):
+            checked.append(True)
+            return CacheEntry(_check(data, schema))
+
+        message = validation_cache.get_or_load((schema.name, data_hash), check)
+        cached = not checked
+    _record_validation(schema.name, time.time() - start_time, cached)
+
+    if message:
+        raise SchemaValidationException(message, data, schema.schema)
+
+    return True
+
+
+def _check(data, schema):
+    """
+    :return
+        - string: The message explaining why the data is not valid, or None when it is valid
+    """
     try:
-        jsonschema.validate(data, schema)
+        error = jsonschema.exceptions.best_match(schema.validator.iter_errors(data))
+        if error is not None:
+            raise error
     except (ValidationError, RefResolutionError) as jsonschema_exception:
         # TODO: Check for specific errors, like URL's that have a slash at the end, and give specific messages back
-        message = f"The given data was not valid based on the given schema: {jsonschema_exception}"
-        raise SchemaValidationException(message, data, schema)
+        return f"The given data was not valid based on the given schema: {jsonschema_exception}"
     except Exception as e:
-        error_message = f"Unexpected problem encountered while validating the data against the schema. " \
-                        "Caught Exception: {e}"
-        raise SchemaValidationException(error_message, data, schema)
+        return f"Unexpected problem encountered while validating the data against the schema. " \
+               f"Caught Exception: {e}"
+    return None
+
+
+def _get_compiled_schema(schema):
+    """Compiles schemas that were not compiled up front, such as a request schema passed in by the caller"""
+    name = hashlib.sha256(json.dumps(schema, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    if name not in compiled_schemas:
+        compiled_schemas[name] = CompiledSchema(name, schema)
+    return compiled_schemas[name]
+
+
+def _get_stats(name):
+    return validation_stats.setdefault(name, {"validations": 0, "cached": 0, "seconds": 0.0, "compile_seconds": 0.0})
 
-    return True
+
+def _record_validation(name, seconds, cached):
+    with validation_stats_lock:
+        stats = _get_stats(name)
+        stats["validations"] += 1
+        stats["cached"] += int(cached)
+        stats["seconds"] += seconds
+
+
+def get_validation_stats():
+    """
+    :return
+        - dict: How many times data was validated against each schema, how many of those results were cached, how
+                long the validations took, and how long the schema's validator took to build
+    """
+    with validation_stats_lock:
+        return {name: dict(stats, seconds=round(stats["seconds"], 4),
+                           compile_seconds=round(stats["compile_seconds"], 4),
+                           average_ms=round(stats["seconds"] / stats["validations"] * 1000, 3)
+                           if stats["validations"] else 0.0)
+                for name, stats in validation_stats.items()}
+
+
+# - The validators are built once, when Hippo starts
+COMPILED_CONFIG_SCHEMA = CompiledSchema("config", CONFIG_SCHEMA)
+COMPILED_REQUEST_SCHEMA = CompiledSchema("request", REQUEST_SCHEMA)
+COMPILED_ACTION_SCHEMA = CompiledSchema("action", ACTION_SCHEMA)
+compiled_schemas = {"config": COMPILED_CONFIG_SCHEMA, "request": COMPILED_REQUEST_SCHEMA,
+                    "action": COMPILED_ACTION_SCHEMA}
 
 
 def validate_project_config(project_config):
@@ -73,12 +184,25 @@ def validate_project_config(project_config):
     :returns
         True if valid config
     """
-    result = _validate(project_config, CONFIG_SCHEMA)
+    result = _validate(project_config, COMPILED_CONFIG_SCHEMA, memoize=True)
+
+    return result
+
+
+def validate_action_list(action_list):
+    """Validates a list of actions against the_ark's action schema
+    :param
+        -   action_list:    List of action dicts
+
+    :returns
+        True if valid action list
+    """
+    result = _validate(action_list, COMPILED_ACTION_SCHEMA)
 
     return result
 
 
-def validate_hippo_request(request, schema=REQUEST_SCHEMA):
+def validate_hippo_request(request, schema=COMPILED_REQUEST_SCHEMA):
     """Validates an emu request against a request schema
     :param
         -   request:    Request dict
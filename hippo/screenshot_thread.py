@@ -1,4 +1,7 @@
 from hippo import actions
+from hippo.cache import Cache, CacheEntry
+from hippo.execution_plan import get_execution_plan
+from hippo.incremental import DOM_HASH_SCRIPT
 import threading
 import time
 import traceback
@@ -10,13 +13,18 @@ from src.the_ark.selenium_helpers import SeleniumHelperExceptions
 log = c.create_logger("Screenshot Thread")
 DEFAULT_SCREENSHOT_THREAD_COUNT = 4
 
+# The headers and footers found on the pages of each project, environment and template, so they are only looked for
+# on the first page of each template that is captured
+sticky_element_cache = Cache("Sticky Elements", c.STICKY_ELEMENT_CACHE_SIZE, c.DEFAULT_STICKY_ELEMENT_CACHE_TTL)
+
 
 class ScreenshotThread(threading.Thread):
     def __init__(self, screenshot_queue, s3_client, s3_path, local_path, config, project, base_url, image_lists,
                  desired_capabilities, content_path, padding, footers, headers, before_screenshot, browser_size,
                  paginated, custom_inputs, common_actions, desktop_actions, mobile_actions, action_libaries,
                  reference_actions, error_list, username, password, pfizer_username, pfizer_password, pfizer_url,
-                 content_container_selector="html", mobile=False, file_extension=c.JPEG_FILE_EXTENSION, resize_delay=0):
+                 content_container_selector="html", mobile=False, file_extension=c.JPEG_FILE_EXTENSION, resize_delay=0,
+                 page_finished_callback=None, bundle=None, incremental=None, execution_plan=None):
         threading.Thread.__init__(self)
         self.url_queue = screenshot_queue
         self.s3_client = s3_client
@@ -37,6 +45,10 @@ class ScreenshotThread(threading.Thread):
         self.dispatch = False
         self.file_extension = file_extension
         self.resize_delay = resize_delay
+        self.page_finished_callback = page_finished_callback
+        self.bundle = bundle
+        self.incremental = incremental
+        self.plan = execution_plan or get_execution_plan(config, mobile, action_libaries)
 
         self.paginated = paginated
         self.footers = footers
@@ -80,8 +92,13 @@ class ScreenshotThread(threading.Thread):
                     if test_url == c.MISC_PATH_TEXT:
                         continue
 
+                    # - Pages that have not changed since the last build keep the images from it
+                    if self.incremental and self.incremental.is_unchanged(self.path) and self.reuse_page():
+                        continue
+
                     self.load_url(test_url)
                     time.sleep(5)
+                    sticky_key = self.load_sticky_elements()
 
                     c.close_iperceptions(self.sh)
 
@@ -102,31 +119,20 @@ class ScreenshotThread(threading.Thread):
                     except Exception as e:
                         log.error(f"Unexpected error occurred while performing the Before Screenshot Actions on {test_url!r}: {e}")
 
-                    # - Path not in any environment
-                    if all(self.path not in path_list for path_list in [self.common_actions,
-                                                                        self.desktop_actions,
-                                                                        self.mobile_actions]):
-                        self.launch_capture()
-
-                    # - On desktop, but path not specified for desktop
-                    elif not self.is_mobile and self.path not in self.common_actions and self.path \
-                            not in self.desktop_actions:
-                        self.launch_capture()
+                    # - Pages that could not be checked before they were loaded are compared by their DOM instead
+                    if self.incremental and self.check_dom_hash() and self.reuse_page():
+                        continue
 
-                    # - On mobile, but path not specified for mobile
-                    elif self.is_mobile and self.path not in self.common_actions and self.path \
-                            not in self.mobile_actions:
+                    # - Path without any actions for this environment
+                    page_steps = self.plan.get_page_steps(self.path)
+                    if page_steps is None:
                         self.launch_capture()
 
-                    # - Otherwise, perform the actions specified for the environment
+                    # - Otherwise, perform the common actions followed by the ones specified for the environment
                     else:
-                        if self.path in self.common_actions:
-                            self.dispatch_actions(self.common_actions[self.path])
+                        self.dispatch_actions(page_steps)
 
-                        if self.is_mobile and self.path in self.mobile_actions:
-                            self.dispatch_actions(self.mobile_actions[self.path])
-                        elif not self.is_mobile and self.path in self.desktop_actions:
-                            self.dispatch_actions(self.desktop_actions[self.path])
+                    self.save_sticky_elements(sticky_key)
 
                 except ScreenshotException as screen_error:
                     message = f"Screenshot Exception caught while capturing for the page at {test_url!r} | "
@@ -153,6 +159,12 @@ class ScreenshotThread(threading.Thread):
                     self.error_list.append(message)
 
                 finally:
+                    # Let the PDF builder know that this page is done being captured
+                    if self.page_finished_callback and self.image_list_object:
+                        try:
+                            self.page_finished_callback(self.image_list_object)
+                        except Exception as e:
+                            log.error(f"Unable to hand the page at {test_url!r} off to the PDF builder: {e}")
                     self.url_queue.task_done()
 
         except ScreenshotException as e:
@@ -198,7 +210,8 @@ class ScreenshotThread(threading.Thread):
         try:
             self.sc = Screenshot(selenium_helper=self.sh, paginated=self.paginated, header_ids=self.headers,
                                  footer_ids=self.footers, scroll_padding=self.scroll_padding,
-                                 file_extenson=self.file_extension, content_container_selector=self.content_container_selector, resize_delay=self.resize_delay)
+                                 file_extenson=self.file_extension, content_container_selector=self.content_container_selector, resize_delay=self.resize_delay,
+                                 detect_sticky_elements=self.plan.detect_sticky_elements)
 
 
 
@@ -297,14 +310,21 @@ class ScreenshotThread(threading.Thread):
             time.sleep(5)
 
     def dispatch_actions(self, actions_list, element=None):
+        """
+        :param
+            - actions_list: tuple/list - The compiled steps from the execution plan, or a list of actions, which is
+                                         run from the plan's compiled steps when it is one of the plan's lists
+            - element:      WebElement - The element the actions are performed on, if any
+        """
         action_type = ""
+        steps = actions_list if isinstance(actions_list, tuple) else self.plan.get_steps(actions_list)
         try:
-            for action in actions_list:
-                action_type = action[c.ACTION_KEY]
+            for step in steps:
+                action_type = step.action_type
 
                 # Dispatch the action to the appropriate method in the Action Class
                 try:
-                    getattr(self.ac, action_type)(action, element)
+                    step.run(self.ac, element)
                 except c.HippoGeneralException as actions_error:
                     log.warning(f"An error occurred while performing a {action_type!r} action on the {self.path} | {actions_error}")
 
@@ -446,9 +466,12 @@ class ScreenshotThread(threading.Thread):
         else:
             image_name = f"{image_name_base}.{self.file_extension}"
 
-        # - Send file to S3 and get its file location url
+        # - Send file to S3 (or add it to the build's bundle) and get its file location url
         image_file.seek(0)
-        image_url = self.s3_client.store_file(self.s3_path, image_file, image_name, True)
+        if self.bundle:
+            image_url = self.bundle.add_file(image_name, image_file)
+        else:
+            image_url = self.s3_client.store_file(self.s3_path, image_file, image_name, True)
 
         image_file.seek(0)
         c.save_stringIO_file_locally(self.local_path, image_name, image_file)
@@ -471,6 +494,44 @@ class ScreenshotThread(threading.Thread):
         # - Log the path so we can easily view the screenshot on S3
         log.info(f"Sent {image_name} to S3: {image_url}")
 
+    def reuse_page(self):
+        """
+        :return
+            - bool: Whether the page's images were reused from the last build
+        """
+        return self.incremental.reuse_page(self.image_list_object, self.image_lists["image_list"][-1], self.bundle)
+
+    def check_dom_hash(self):
+        """
+        Records the hash of the loaded page's DOM for the next build to compare against
+        :return
+            - bool: Whether the page is unchanged since the last build, going by its DOM
+        """
+        try:
+            return self.incremental.check_dom_hash(self.path, self.sh.execute_script(DOM_HASH_SCRIPT) or "")
+        except DriverExceptions as selenium_error:
+            log.debug(f"Unable to hash the DOM of {self.path!r}: {selenium_error.msg}")
+            return False
+
+    def load_sticky_elements(self):
+        """
+        Hands the Screenshot class the headers and footers already found on a page with the same template, on the same
+        environment, if any
+        :return
+            - tuple: The key of the page's template in the sticky_element_cache, or None when the cache is not used
+        """
+        if not self.sc.detect_sticky_elements:
+            return None
+        sticky_key = (self.project, self.base_url, self.is_mobile, c.get_page_template(self.path))
+        entry = sticky_element_cache.get(sticky_key)
+        self.sc.sticky_elements = entry.value if entry and entry.is_fresh(sticky_element_cache.ttl) else None
+        return sticky_key if self.sc.sticky_elements is None else None
+
+    def save_sticky_elements(self, sticky_key):
+        """Keeps the headers and footers found on the page for the other pages with the same template"""
+        if sticky_key and self.sc.sticky_elements is not None:
+            sticky_element_cache.set(sticky_key, CacheEntry(self.sc.sticky_elements))
+
     def kill(self):
         if self.sh:
             self.sh.quit_driver()
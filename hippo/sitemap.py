@@ -0,0 +1,432 @@
+import concurrent.futures
+import queue
+import re
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+import zlib
+
+from bs4 import BeautifulSoup
+from hippo import http_login
+from hippo.cache import Cache, CacheEntry
+from hippo.driver_pool import driver_pool
+from hippo.util import create_logger, parse_url_path, check_if_author, platform_login, HippoGeneralException, \
+    BROWSER_NAME, URL_BLACKLIST, GENE_SAML_LOGIN_INDICATOR, AUTHOR_SITE_INDICATOR, DISPATCH_INDICATOR, \
+    SITEMAP_FETCH_WORKERS, SITEMAP_HOST_CONNECTIONS, SITEMAP_MAX_DEPTH, SITEMAP_CACHE_SIZE, DEFAULT_SITEMAP_CACHE_TTL, \
+    SITEMAP_CACHE_MAX_BYTES
+
+log = create_logger("Sitemap")
+
+GZIP_MAGIC_NUMBER = b"\x1f\x8b"
+SITEMAP_INDEX_TAG = "sitemapindex"
+LOC_TAG = "loc"
+LASTMOD_TAG = "lastmod"
+ENTRY_TAGS = ["url", "sitemap"]
+SITEMAP_CHUNK_SIZE = 65536
+# How many urls the child sitemap threads can get ahead of the code reading them
+SITEMAP_QUEUE_SIZE = 1000
+SITEMAP_QUEUE_TIMEOUT = 1
+
+# Every sitemap read over http, keyed by its url and the user it was read as. The mobile and desktop builds of a site
+# usually run back to back, so the second one can use the sitemaps the first one read
+sitemap_cache = Cache("Sitemap", SITEMAP_CACHE_SIZE, DEFAULT_SITEMAP_CACHE_TTL)
+
+
+def crawl(sitemap_url, browser_data, base_url, username, password, content_path=None,
+          cache_ttl=DEFAULT_SITEMAP_CACHE_TTL, crawl_stats=None, page_lastmods=None):
+    """
+    Gathers the paths of every page listed in the sitemap. Sitemap indexes are followed down to the sitemaps they
+    list, which are fetched concurrently. The sitemaps are parsed as they download, and the paths are yielded as they
+    are found. Sitemaps read in the last cache_ttl seconds are used from the sitemap_cache, and older ones are only
+    downloaded again if the server says they have changed.
+    :param
+        - sitemap_url:  string - The url of the sitemap, or sitemap index, to crawl
+        - browser_data: dict - The browser used to read the sitemap when it cannot be fetched directly
+        - base_url:     string - The base url of the site, used to log in to AEM environments
+        - username:     string - The AEM username
+        - password:     string - The AEM password
+        - content_path: string - The AEM content path, which is removed from the paths found
+        - cache_ttl:    int - The number of seconds a cached sitemap is used without checking whether it changed
+        - crawl_stats:  dict - Filled in with the number of sitemaps that were "cached", "revalidated", "fetched" or
+                               read with a "browser", as the paths are read
+        - page_lastmods: dict - Filled in with the <lastmod> of each path that has one, as the paths are read
+    :return
+        - generator: The normalized path of every page found, without duplicates, in the order they are found
+    """
+    crawler = SitemapCrawler(realm=username, cache_ttl=cache_ttl, stats=crawl_stats)
+    try:
+        if crawler.is_fresh(sitemap_url):
+            return iter_page_paths(_close_when_read(crawler, crawler.iter_sitemap(sitemap_url)), content_path,
+                                   page_lastmods)
+
+        response = crawler.open(sitemap_url)
+        if check_if_author(sitemap_url) or response.status_code not in (200, 304) or \
+                http_login.is_login_redirect(response):
+            response.close()
+            # - Log in over http, so the sitemap can be streamed with the session's cookies. A browser is only used
+            # when the login cannot be done without one
+            if http_login.login(crawler.session, sitemap_url, base_url, username, password):
+                locations = crawler.iter_sitemap(sitemap_url)
+            else:
+                log.info(f"Unable to read {sitemap_url} over http, reading it with a browser instead")
+                locations = _crawl_with_browser(sitemap_url, browser_data, base_url, username, password)
+                crawler.count("browser")
+        else:
+            locations = crawler.iter_sitemap(sitemap_url, response)
+
+    except Exception:
+        crawler.close()
+        raise
+
+    return iter_page_paths(_close_when_read(crawler, locations), content_path, page_lastmods)
+
+
+def _close_when_read(crawler, locations):
+    """Passes the locations through, closing the crawler's session once they have all been read or are abandoned"""
+    try:
+        yield from locations
+    finally:
+        crawler.close()
+
+
+def iter_page_paths(locations, content_path=None, page_lastmods=None):
+    """
+    Turns the urls listed in the sitemap into the paths to capture. Urls in the URL_BLACKLIST are skipped and each
+    path is only yielded once
+    :param
+        - locations:        iterable - The (loc, lastmod) of every page in the sitemap
+        - content_path:     string - The AEM content path, which is removed from the paths
+        - page_lastmods:    dict - Filled in with the lastmod of each path, when the sitemap has one for it
+    """
+    found_paths = set()
+    for location, lastmod in locations:
+        location = location.strip()
+        if not location or any(blacklist in location for blacklist in URL_BLACKLIST):
+            continue
+
+        # - Remove the path from the url to remove the prod domain from the path (if there)
+        path = normalize_path(parse_url_path(location, content_path))
+        if path not in found_paths:
+            found_paths.add(path)
+            if lastmod and page_lastmods is not None:
+                page_lastmods[path] = lastmod.strip()
+            yield path
+
+
+def normalize_path(path):
+    """Collapses repeated slashes in a path, and makes sure it starts with one"""
+    path = re.sub("/{2,}", "/", path)
+    if not path.startswith("/"):
+        path = f"/{path}"
+    return path
+
+
+def iter_sitemap_entries(chunks):
+    """
+    Parses a sitemap as it is downloaded. Each <url> or <sitemap> entry is thrown away once it has been read, so
+    memory use does not grow with the size of the sitemap
+    :param
+        - chunks:   iterable - The bytes of the sitemap, gzipped or not, in the pieces they are received in
+    :return
+        - generator: (is_index, loc, lastmod) for every entry, where is_index is whether the sitemap is a sitemap index
+                     and lastmod is None when the entry does not have one
+    """
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    decompressor = None
+    # - The bytes are kept until the first entry is found, in case the sitemap needs to go to the html parser
+    received = []
+    started = False
+    is_index = False
+    root = None
+    depth = 0
+    location = None
+    lastmod = None
+
+    try:
+        for chunk in chunks:
+            if not started and decompressor is None and chunk[:2] == GZIP_MAGIC_NUMBER:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            if decompressor:
+                chunk = decompressor.decompress(chunk)
+            if not started:
+                # The xml declaration has to be the first thing in the document, so any leading whitespace is dropped
+                chunk = chunk.lstrip()
+                if not chunk:
+                    continue
+                started = True
+            if received is not None:
+                received.append(chunk)
+
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if event == "start":
+                    depth += 1
+                    if depth == 1:
+                        root = element
+                        is_index = _local_name(element.tag) == SITEMAP_INDEX_TAG
+                    continue
+
+                # - Only the <loc> directly under each <url> or <sitemap> entry, so that the <image:loc> of image
+                # sitemaps is skipped
+                if depth == 3 and _local_name(element.tag) == LOC_TAG:
+                    location = element.text or ""
+                elif depth == 3 and _local_name(element.tag) == LASTMOD_TAG:
+                    lastmod = element.text
+                elif depth == 2:
+                    if location is not None:
+                        received = None
+                        yield is_index, location, lastmod
+                    location = None
+                    lastmod = None
+                    root.clear()
+                depth -= 1
+        parser.close()
+
+    except ElementTree.ParseError as e:
+        if received is None:
+            raise HippoGeneralException(f"Unable to parse the rest of the sitemap: {e}")
+
+        # Fall back to the forgiving html parser for sitemaps that are not well-formed xml
+        log.debug(f"Unable to parse the sitemap as xml, falling back to the html parser: {e}")
+        body = b"".join(received)
+        for chunk in chunks:
+            body += decompressor.decompress(chunk) if decompressor else chunk
+        yield from _get_soup_entries(BeautifulSoup(body, "html.parser"))
+
+
+def _get_soup_entries(soup):
+    """
+    :return
+        - list: (is_index, loc, lastmod) for every entry in a sitemap parsed with BeautifulSoup
+    """
+    is_index = soup.find(SITEMAP_INDEX_TAG) is not None
+    entries = []
+    for entry in soup.find_all(ENTRY_TAGS):
+        loc = entry.find(LOC_TAG)
+        lastmod = entry.find(LASTMOD_TAG)
+        if loc:
+            entries.append((is_index, loc.text, lastmod.text if lastmod else None))
+    # - Some sitemaps are only a list of <loc> elements
+    return entries or [(is_index, loc.text, None) for loc in soup.find_all(LOC_TAG)]
+
+
+class SitemapCrawler:
+    """
+    Fetches sitemaps over a pooled http session. The child sitemaps of a sitemap index are fetched concurrently,
+    with at most host_connections requests open to any one host at a time. When the session has been logged in with
+    http_login.login(), its cookies are used for every sitemap.
+
+    Each sitemap is kept in the cache with its parsed entries and the ETag/Last-Modified it was sent with. Once it is
+    older than cache_ttl, it is requested with If-None-Match/If-Modified-Since, so that it is only downloaded and
+    parsed again when it has changed. Sitemaps larger than max_cached_bytes only have their ETag/Last-Modified cached,
+    which marks them as too large to keep, so they are streamed without their entries being held on to again.
+    """
+    def __init__(self, max_workers=SITEMAP_FETCH_WORKERS, host_connections=SITEMAP_HOST_CONNECTIONS, realm=None,
+                 cache=sitemap_cache, cache_ttl=DEFAULT_SITEMAP_CACHE_TTL, stats=None,
+                 max_cached_bytes=SITEMAP_CACHE_MAX_BYTES):
+        """
+        :param
+            - max_workers:      int - The number of child sitemaps fetched at once
+            - host_connections: int - The number of connections that can be open to a single host
+            - realm:            string - Who the sitemaps are read as (i.e. the AEM username), so that sitemaps
+                                         read while logged in are not used for anyone else
+            - cache:            Cache - Where the sitemaps are cached
+            - cache_ttl:        int - The number of seconds a cached sitemap is used without checking it changed
+            - stats:            dict - Counts how many sitemaps were "cached", "revalidated" and "fetched"
+            - max_cached_bytes: int - The size of the largest sitemap whose entries are cached
+        """
+        self.max_workers = max_workers
+        self.session = http_login.create_session(host_connections)
+        self.realm = realm or ""
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self.stats = {} if stats is None else stats
+        self.stats_lock = threading.Lock()
+        self.max_cached_bytes = max_cached_bytes
+
+    def open(self, url):
+        """
+        Requests the sitemap, only asking for its content if it changed when it is already cached
+        :return
+            - Response: The response, with its body left to be streamed. A 304 when the cached sitemap can be used
+        """
+        entry = self.cache.get((url, self.realm))
+        conditional = entry and entry.value["entries"] is not None
+        return self.session.get(url, stream=True, headers=entry.get_conditional_headers() if conditional else None)
+
+    def is_fresh(self, url):
+        """Whether the sitemap is cached and can be used without asking the server whether it changed"""
+        entry = self.cache.get((url, self.realm))
+        return bool(entry and entry.value["entries"] is not None and entry.is_fresh(self.cache_ttl))
+
+    def close(self):
+        """Closes the connections of the session"""
+        self.session.close()
+
+    def count(self, stat):
+        with self.stats_lock:
+            self.stats[stat] = self.stats.get(stat, 0) + 1
+
+    def iter_sitemap(self, sitemap_url, response=None, max_depth=SITEMAP_MAX_DEPTH):
+        """
+        Reads a sitemap, following it down through any sitemap indexes
+        :param
+            - sitemap_url:  string - The url of the sitemap
+            - response:     Response - The already opened response for the sitemap, if there is one
+            - max_depth:    int - How many levels of sitemap indexes are followed
+        :return
+            - generator: The (loc, lastmod) of every page found
+        """
+        sitemap_urls = []
+        for is_index, location, lastmod in self._iter_entries(sitemap_url, response):
+            if is_index:
+                sitemap_urls.append(location.strip())
+            else:
+                yield location, lastmod
+
+        if sitemap_urls:
+            yield from self._iter_child_sitemaps(sitemap_url, sitemap_urls, max_depth)
+
+    def _iter_child_sitemaps(self, sitemap_url, sitemap_urls, max_depth):
+        """Reads the sitemaps listed in a sitemap index, on a pool of threads that hand the urls they find back"""
+        found = queue.Queue(maxsize=SITEMAP_QUEUE_SIZE)
+        stop = threading.Event()
+        read_sitemaps = {sitemap_url}
+        page_count = 0
+        depth = 0
+
+        def put(entry):
+            # - Gives up once the urls stop being read, so the threads never wait on a full queue forever
+            while not stop.is_set():
+                try:
+                    found.put(entry, timeout=SITEMAP_QUEUE_TIMEOUT)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def read_child_sitemap(child_url):
+            # A single sitemap that cannot be read is skipped, so the rest of the site can still be captured
+            try:
+                for entry in self._iter_entries(child_url):
+                    if not put(entry):
+                        return
+            except Exception as e:
+                log.warning(f"Unable to read the sitemap {child_url}: {e}")
+            # None marks that the sitemap has been read
+            put(None)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                while sitemap_urls and depth < max_depth:
+                    depth += 1
+                    # - Only read each sitemap once, in case the indexes list the same sitemap or each other
+                    sitemap_urls = [url for url in dict.fromkeys(sitemap_urls) if url not in read_sitemaps]
+                    read_sitemaps.update(sitemap_urls)
+                    for child_url in sitemap_urls:
+                        executor.submit(read_child_sitemap, child_url)
+
+                    remaining = len(sitemap_urls)
+                    sitemap_urls = []
+                    while remaining:
+                        entry = found.get()
+                        if entry is None:
+                            remaining -= 1
+                        elif entry[0]:
+                            sitemap_urls.append(entry[1].strip())
+                        else:
+                            page_count += 1
+                            yield entry[1], entry[2]
+            finally:
+                stop.set()
+
+        if sitemap_urls:
+            log.warning(f"Stopped following the sitemap indexes of {sitemap_url} after {max_depth} levels")
+        log.info(f"Found {page_count} pages in the {len(read_sitemaps) - 1} sitemaps of {sitemap_url}")
+
+    def _iter_entries(self, sitemap_url, response=None):
+        key = (sitemap_url, self.realm)
+        entry = self.cache.get(key)
+        # - Only the ETag/Last-Modified of sitemaps that were too large to cache are kept, to mark them as too large
+        too_large = bool(entry and entry.value["entries"] is None)
+        if too_large:
+            entry = None
+        if response is None:
+            if entry and entry.is_fresh(self.cache_ttl):
+                self.count("cached")
+                yield from entry.value["entries"]
+                return
+            response = self.open(sitemap_url)
+
+        try:
+            if response.status_code == 304 and entry:
+                self.cache.set(key, entry.refresh())
+                self.count("revalidated")
+                yield from entry.value["entries"]
+                return
+
+            if response.status_code != 200:
+                raise HippoGeneralException(f"Received a bad status code when fetching the sitemap {sitemap_url} : "
+                                            f"Status Code - {response.status_code}")
+
+            # - The entries are only kept while the sitemap is small enough to cache
+            size = [0]
+            entries = None if too_large else []
+            for sitemap_entry in iter_sitemap_entries(_count_bytes(response.iter_content(SITEMAP_CHUNK_SIZE), size)):
+                if entries is not None and size[0] > self.max_cached_bytes:
+                    entries = None
+                if entries is not None:
+                    entries.append(sitemap_entry)
+                yield sitemap_entry
+
+            # - Only cached once the whole sitemap has been read
+            self.cache.set(key, CacheEntry({"entries": entries}, etag=response.headers.get("ETag"),
+                                           last_modified=response.headers.get("Last-Modified")))
+            self.count("fetched")
+        finally:
+            response.close()
+
+
+def _crawl_with_browser(sitemap_url, browser_data, base_url, username, password):
+    """Reads the sitemap through a browser from the driver pool, for sites that cannot be logged in to over http"""
+    browser_under_test = browser_data.get(BROWSER_NAME)
+    sh = driver_pool.acquire(browser_data, realm=[username, base_url])
+    try:
+        sh.load_url(sitemap_url, bypass_status_code_check=True)
+        time.sleep(5)
+        if any(login_indicator in sh.get_current_url() for login_indicator in GENE_SAML_LOGIN_INDICATOR or AUTHOR_SITE_INDICATOR or DISPATCH_INDICATOR):
+            log.debug("GENE SAML LOGIN DETECTED")
+            platform_login(sh, base_url, username, password)
+            sh.load_url(sitemap_url, bypass_status_code_check=True)
+            time.sleep(5)
+
+        entries = _get_soup_entries(BeautifulSoup(sh.driver.page_source, "html.parser"))
+        locations = [(loc, lastmod) for is_index, loc, lastmod in entries if not is_index]
+        # - The browser is already logged in, so the child sitemaps are read through it one at a time
+        for is_index, child_url, lastmod in entries:
+            if is_index:
+                sh.load_url(child_url.strip(), bypass_status_code_check=True)
+                locations.extend((loc, lastmod) for is_index, loc, lastmod in
+                                 _get_soup_entries(BeautifulSoup(sh.driver.page_source, "html.parser")))
+
+        # Setting the browser back to what the user requested now that the crawl has completed.
+        browser_data.update({BROWSER_NAME: browser_under_test})
+        driver_pool.release(sh)
+        return locations
+
+    except Exception as e:
+        driver_pool.discard(sh)
+        log.warning(e)
+        raise e
+
+
+def _count_bytes(chunks, size):
+    """Passes the chunks of a response through, adding up their size in the first item of the size list"""
+    for chunk in chunks:
+        size[0] += len(chunk)
+        yield chunk
+
+
+def _local_name(tag):
+    """Removes the namespace from an xml tag, i.e. {http://www.sitemaps.org/schemas/sitemap/0.9}loc becomes loc"""
+    return tag.rsplit("}", 1)[-1]
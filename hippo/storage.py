@@ -0,0 +1,337 @@
+import abc
+import hashlib
+import io
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from hippo.util import create_logger, HIPPO_S3_BUCKET, HIPPO_STORAGE_BACKEND, HIPPO_STORAGE_PATH, \
+    HIPPO_STORAGE_ENDPOINT_URL, HIPPO_STORAGE_URL, S3_STORAGE_BACKEND, S3_COMPATIBLE_STORAGE_BACKEND, \
+    LOCAL_STORAGE_BACKEND, DEFAULT_LOCAL_STORAGE_PATH
+from src.the_ark.s3_client import S3Client, S3ClientException, S3ConcurrentUploader, DEFAULT_UPLOAD_WORKERS, \
+    DEFAULT_FILE_SPLIT_SIZE
+
+log = create_logger("Storage")
+
+LOCAL_STORAGE_CHUNK_SIZE = 1048576
+LOCAL_OBJECTS_FOLDER = ".objects"
+LOCAL_TEMP_FOLDER = ".tmp"
+# How often the objects that no path links to any more are removed, and how old they have to be first, so that an
+# object that was just written is not removed before it is linked into place
+LOCAL_OBJECTS_PRUNE_INTERVAL = 3600
+LOCAL_OBJECTS_PRUNE_AGE = 3600
+
+# Held while objects are linked into place or removed, so an object is never removed as it is being linked
+objects_lock = threading.Lock()
+last_prune = {}
+
+
+def create_storage(config):
+    """
+    Creates the storage backend that builds are stored in, based on the HIPPO_STORAGE_BACKEND setting
+        - s3:               Amazon S3, in the HIPPO_S3_BUCKET bucket (the default)
+        - s3-compatible:    Any service that speaks the S3 API (MinIO, LocalStack, etc.) at HIPPO_STORAGE_ENDPOINT_URL
+        - local:            The local filesystem, under HIPPO_STORAGE_PATH
+    :param
+        - config:   dict - The Hippo app config
+    :return
+        - Storage:  An S3Client or a LocalStorage
+    """
+    backend = config.get(HIPPO_STORAGE_BACKEND) or S3_STORAGE_BACKEND
+
+    if backend == S3_STORAGE_BACKEND:
+        return S3Client(config[HIPPO_S3_BUCKET])
+    elif backend == S3_COMPATIBLE_STORAGE_BACKEND:
+        if not config.get(HIPPO_STORAGE_ENDPOINT_URL):
+            raise StorageException(f"{HIPPO_STORAGE_ENDPOINT_URL} must be set to use the {backend} storage backend")
+        return S3Client(config[HIPPO_S3_BUCKET], endpoint_url=config[HIPPO_STORAGE_ENDPOINT_URL])
+    elif backend == LOCAL_STORAGE_BACKEND:
+        storage = LocalStorage(config.get(HIPPO_STORAGE_PATH) or DEFAULT_LOCAL_STORAGE_PATH,
+                               config.get(HIPPO_STORAGE_URL))
+        # - Clear out the objects that are no longer stored at any path, in the background
+        with objects_lock:
+            prune_due = time.time() - last_prune.get(storage.root, 0) >= LOCAL_OBJECTS_PRUNE_INTERVAL
+            if prune_due:
+                last_prune[storage.root] = time.time()
+        if prune_due:
+            threading.Thread(target=storage.prune_objects, name="Storage Prune", daemon=True).start()
+        return storage
+
+    raise StorageException(f"Unknown storage backend {backend!r}. Expected one of: {S3_STORAGE_BACKEND}, "
+                           f"{S3_COMPATIBLE_STORAGE_BACKEND}, {LOCAL_STORAGE_BACKEND}")
+
+
+class Storage(abc.ABC):
+    """
+    The methods that every storage backend has. LocalStorage implements them, and the S3Client, which lives in the_ark,
+    is registered as one below
+    """
+
+    @abc.abstractmethod
+    def store_file(self, s3_path, file_to_store, filename, return_url=False, mime_type=None):
+        """Stores a file path, file object, bytes or string at the path"""
+
+    @abc.abstractmethod
+    def get_file(self, s3_path, file_to_get):
+        """Reads a file into a BytesIO"""
+
+    @abc.abstractmethod
+    def get_file_url(self, s3_path, filename, expires_in=None):
+        """Gets the url a file can be read from"""
+
+    @abc.abstractmethod
+    def verify_file(self, s3_path, file_to_verify):
+        """Checks whether a file is stored at the path"""
+
+    @abc.abstractmethod
+    def download_file(self, s3_path, file_to_get, local_path):
+        """Copies a file to a local path"""
+
+    @abc.abstractmethod
+    def open_multipart_upload(self, s3_path, filename, mime_type=None, part_size=DEFAULT_FILE_SPLIT_SIZE,
+                              max_workers=None):
+        """Opens a writable object that stores everything written to it as a single file once it is closed"""
+
+    @abc.abstractmethod
+    def open_concurrent_uploader(self, max_workers=DEFAULT_UPLOAD_WORKERS):
+        """Opens an uploader that stores files on a pool of threads"""
+
+
+Storage.register(S3Client)
+
+
+class LocalStorage(Storage):
+    """
+    Stores files on the local filesystem with the same interface as the S3Client. Files are written to a temp file and
+    renamed into place, so a file is never seen half written. Every file is kept once under the .objects folder, by
+    the hash of its content, and hardlinked to each path it is stored at, so identical files only take up space once.
+    """
+
+    def __init__(self, root, base_url=None):
+        """
+        :param
+            - root:     string - The folder that files are stored in
+            - base_url: string - The url the root folder is served at. File urls are file:// urls when not given
+        """
+        self.root = os.path.abspath(root)
+        self.bucket_name = self.root
+        self.base_url = base_url.rstrip("/") if base_url else None
+        os.makedirs(os.path.join(self.root, LOCAL_OBJECTS_FOLDER), exist_ok=True)
+        os.makedirs(os.path.join(self.root, LOCAL_TEMP_FOLDER), exist_ok=True)
+
+    def connect(self):
+        pass
+
+    def store_file(self, s3_path, file_to_store, filename, return_url=False, mime_type=None):
+        """
+        Stores the file. Takes the same parameters as S3Client.store_file()
+        :return
+            - file_url: string - The url to the file. This is returned only is return_url is set to true
+        """
+        try:
+            if isinstance(file_to_store, str) and os.path.isfile(file_to_store):
+                temp_path = self._new_temp_path()
+                shutil.copyfile(file_to_store, temp_path)
+            else:
+                temp_path = self._write_temp_file(file_to_store)
+
+            self._commit(temp_path, self._generate_file_path(s3_path, filename))
+            if return_url:
+                return self.get_file_url(s3_path, filename)
+
+        except (OSError, TypeError) as store_file_exception:
+            raise StorageException(f"Exception while storing file locally: {store_file_exception}")
+
+    def get_file(self, s3_path, file_to_get):
+        """
+        :return
+            - BytesIO:  The content of the file
+        """
+        try:
+            with open(self._get_local_path(s3_path, file_to_get), "rb") as stored_file:
+                return io.BytesIO(stored_file.read())
+        except OSError as get_file_exception:
+            raise StorageException(f"Exception while retrieving file from local storage: {get_file_exception}")
+
+    def download_file(self, s3_path, file_to_get, local_path):
+        try:
+            shutil.copyfile(self._get_local_path(s3_path, file_to_get), local_path)
+            return local_path
+        except OSError as download_file_exception:
+            raise StorageException(f"Exception while copying file from local storage: {download_file_exception}")
+
+    def get_file_range(self, s3_path, file_to_get, start, end):
+        try:
+            with open(self._get_local_path(s3_path, file_to_get), "rb") as stored_file:
+                stored_file.seek(start)
+                return stored_file.read(end - start + 1)
+        except OSError as get_range_exception:
+            raise StorageException(f"Exception while reading a range of a file from local storage: "
+                                   f"{get_range_exception}")
+
+    def verify_file(self, s3_path, file_to_verify):
+        return os.path.isfile(self._get_local_path(s3_path, file_to_verify))
+
+    def get_file_url(self, s3_path, filename, expires_in=None):
+        key = self._generate_file_path(s3_path, filename)
+        if self.base_url:
+            return f"{self.base_url}/{key}"
+        return Path(self._get_local_path(s3_path, filename)).as_uri()
+
+    def get_all_filenames_in_folder(self, path_to_folder):
+        """
+        :return
+            - list: The keys of every file under the folder
+        """
+        folder = self._get_local_path(path_to_folder, "")
+        keys = []
+        for directory, folders, filenames in os.walk(folder):
+            folders[:] = [name for name in folders if name not in (LOCAL_OBJECTS_FOLDER, LOCAL_TEMP_FOLDER)]
+            for filename in filenames:
+                keys.append(os.path.relpath(os.path.join(directory, filename), self.root).replace(os.sep, "/"))
+        return sorted(keys)
+
+    def open_multipart_upload(self, s3_path, filename, mime_type=None, part_size=DEFAULT_FILE_SPLIT_SIZE,
+                              max_workers=None):
+        return LocalUpload(self, s3_path, filename)
+
+    def open_concurrent_uploader(self, max_workers=DEFAULT_UPLOAD_WORKERS):
+        return S3ConcurrentUploader(self, max_workers)
+
+    def prune_objects(self, min_age=LOCAL_OBJECTS_PRUNE_AGE):
+        """
+        Removes the objects that are no longer linked to from any path, since every file that pointed at them has been
+        replaced. Objects are only found to be unreferenced where the filesystem supports hardlinks
+        :param
+            - min_age:  int - The number of seconds since an object was written before it can be removed
+        :return
+            - int:  The number of objects that were removed
+        """
+        removed = 0
+        cutoff = time.time() - min_age
+        for directory, folders, filenames in os.walk(os.path.join(self.root, LOCAL_OBJECTS_FOLDER)):
+            for filename in filenames:
+                object_path = os.path.join(directory, filename)
+                with objects_lock:
+                    try:
+                        stat = os.stat(object_path)
+                        if stat.st_nlink == 1 and stat.st_mtime < cutoff:
+                            os.remove(object_path)
+                            removed += 1
+                    except OSError as e:
+                        log.warning(f"Unable to prune the stored object {object_path}: {e}")
+        if removed:
+            log.info(f"Removed {removed} stored objects that no file links to any more from {self.root}")
+        return removed
+
+    def _generate_file_path(self, s3_path, file_to_store):
+        return f"{(s3_path.strip('/'))}/{(file_to_store.strip('/'))}"
+
+    def _get_local_path(self, s3_path, filename):
+        local_path = os.path.normpath(os.path.join(self.root, self._generate_file_path(s3_path, filename)))
+        if local_path != self.root and not local_path.startswith(self.root + os.sep):
+            raise StorageException(f"{s3_path}/{filename} is outside of the storage folder")
+        return local_path
+
+    def _new_temp_path(self):
+        return os.path.join(self.root, LOCAL_TEMP_FOLDER, uuid.uuid4().hex)
+
+    def _write_temp_file(self, file_to_store):
+        temp_path = self._new_temp_path()
+        with open(temp_path, "wb") as temp_file:
+            if isinstance(file_to_store, (bytes, bytearray)):
+                temp_file.write(file_to_store)
+            elif isinstance(file_to_store, str):
+                temp_file.write(file_to_store.encode("utf-8"))
+            else:
+                file_to_store.seek(0)
+                chunk = file_to_store.read(LOCAL_STORAGE_CHUNK_SIZE)
+                while chunk:
+                    temp_file.write(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+                    chunk = file_to_store.read(LOCAL_STORAGE_CHUNK_SIZE)
+        return temp_path
+
+    def _commit(self, temp_path, key):
+        """Moves a finished temp file into the object store and links it into place at the key"""
+        digest = hashlib.sha256()
+        with open(temp_path, "rb") as temp_file:
+            for chunk in iter(lambda: temp_file.read(LOCAL_STORAGE_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+
+        object_path = os.path.join(self.root, LOCAL_OBJECTS_FOLDER, digest[:2], digest)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        local_path = self._get_local_path(key, "")
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        link_path = self._new_temp_path()
+        with objects_lock:
+            if os.path.exists(object_path):
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, object_path)
+
+            try:
+                os.link(object_path, link_path)
+            except OSError:
+                # Not every filesystem supports hardlinks
+                shutil.copyfile(object_path, link_path)
+        os.replace(link_path, local_path)
+
+
+class LocalUpload(object):
+    """The local storage version of the S3MultipartUpload. The file only shows up at its path once it is closed"""
+
+    def __init__(self, storage, s3_path, filename):
+        self.storage = storage
+        self.s3_path = s3_path
+        self.filename = filename
+        self.temp_path = storage._new_temp_path()
+        self.temp_file = open(self.temp_path, "wb")
+        self.bytes_written = 0
+        self.closed = False
+
+    def write(self, data):
+        self.temp_file.write(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.bytes_written
+
+    def flush(self):
+        """Everything written is already in the file, so there is nothing to hand off"""
+
+    def close(self, return_url=False):
+        if not self.closed:
+            self.closed = True
+            try:
+                self.temp_file.close()
+                self.storage._commit(self.temp_path, self.storage._generate_file_path(self.s3_path, self.filename))
+            except OSError as close_exception:
+                raise StorageException(f"Exception while storing {self.filename} locally: {close_exception}")
+
+        if return_url:
+            return self.storage.get_file_url(self.s3_path, self.filename)
+
+    def abort(self):
+        if not self.closed:
+            self.closed = True
+            self.temp_file.close()
+            if os.path.exists(self.temp_path):
+                os.remove(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+
+class StorageException(S3ClientException):
+    pass
@@ -10,9 +10,8 @@ import time
 import urllib3
 from src.the_ark import selenium_helpers
 
-from bs4 import BeautifulSoup
 from github import Github
-from io import StringIO
+from io import StringIO, BytesIO
 from src.the_ark.email_client import EmailClient
 from src.the_ark.rhino_client import RhinoClient
 
@@ -36,6 +35,35 @@ PFIZER_AUTH_URL_LIST = [
 MISC_PATH_TEXT = "Miscellaneous Images"
 PDF_MAX_PAGE_HEIGHT = 19200.0
 PDF_CROP_PADDING = 40
+PDF_CROP_WORKERS = 4
+# The number of finished pages, after the one being added, whose images are cropped ahead of time
+PDF_PREFETCH_PAGES = 4
+PDF_DOWNLOAD_WORKERS = 8
+PDF_DEFAULT_JPEG_QUALITY = 85
+PDF_VOLUME_WORKERS = 4
+# The number of PDFs of finished builds that are created at the same time
+BUILD_PDF_WORKERS = 2
+SITEMAP_FETCH_WORKERS = 8
+SITEMAP_HOST_CONNECTIONS = 4
+SITEMAP_MAX_DEPTH = 3
+SITEMAP_CACHE_SIZE = 64
+# Sitemaps larger than this many bytes only have their ETag/Last-Modified cached, not their entries
+SITEMAP_CACHE_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_SITEMAP_CACHE_TTL = 300
+CONFIG_CACHE_SIZE = 64
+VALIDATION_CACHE_SIZE = 256
+EXECUTION_PLAN_CACHE_SIZE = 32
+STICKY_ELEMENT_CACHE_SIZE = 256
+DEFAULT_STICKY_ELEMENT_CACHE_TTL = 3600
+DEFAULT_CONFIG_CACHE_TTL = 60
+CACHE_REFRESH_WORKERS = 4
+ACTION_LIBRARY_FETCH_WORKERS = 8
+DEFAULT_CONFIG_MIRROR_INTERVAL = 300
+CONFIG_MIRROR_GIT_TIMEOUT = 120
+DRIVER_POOL_MAX_IDLE = 1
+DRIVER_POOL_IDLE_TIMEOUT = 300
+INCREMENTAL_HEAD_WORKERS = 8
+INCREMENTAL_HEAD_TIMEOUT = 10
 
 # App constants
 S3_CONFIG_LOCATION = "configurations"
@@ -44,6 +72,16 @@ RHINO_TEST_NAME = "Hippo Screenshot"
 LOG_FILENAME = "screenshot_log.html"
 SCREENSHOT_LOG_URL = "screenshot_log_url"
 IMAGE_LIST_URL = "image_list_url"
+PDF_URL = "pdf_url"
+FALCON_IMAGE_LIST_FILENAME = "falcon_image_list.json"
+PDF_IMAGE_LIST_FILENAME = "pdf_image_list.json"
+BUILD_RECORD_PATH = "hippo/builds/{build_id}"
+BUILD_RECORD_FILENAME = "build.json"
+BUILD_BUNDLE_FILENAME = "bundle.tar"
+BUILD_BUNDLE_INDEX_FILENAME = "bundle_index.json"
+MANIFEST_FILENAME = "image_list.jsonl.gz"
+PDF_MANIFEST_FILENAME = "pdf_image_list.jsonl.gz"
+INCREMENTAL_STATE_PATH = "hippo/state/{project}/{branch}/{environment}"
 
 # - Environment Variables
 HIPPO_ENVIRONMENT = "HIPPO_ENVIRONMENT"
@@ -68,7 +106,25 @@ AWS_SECRET = "AWS_SECRET_ACCESS_KEY"
 WATERING_HOLE_CLIENT = "WATERING_HOLE_CLIENT"
 SAUCE_LABS_USERNAME = "SAUCE_LABS_USERNAME"
 SAUCE_LABS_ACCESS_KEY = "SAUCE_LABS_ACCESS_KEY"
+HIPPO_PUBLIC_URL = "HIPPO_PUBLIC_URL"
+HIPPO_STORAGE_BACKEND = "HIPPO_STORAGE_BACKEND"
+HIPPO_STORAGE_PATH = "HIPPO_STORAGE_PATH"
+HIPPO_STORAGE_ENDPOINT_URL = "HIPPO_STORAGE_ENDPOINT_URL"
+HIPPO_STORAGE_URL = "HIPPO_STORAGE_URL"
+HIPPO_SITEMAP_CACHE_TTL = "HIPPO_SITEMAP_CACHE_TTL"
+HIPPO_CONFIG_CACHE_TTL = "HIPPO_CONFIG_CACHE_TTL"
+HIPPO_CONFIG_MIRROR_PATH = "HIPPO_CONFIG_MIRROR_PATH"
+HIPPO_CONFIG_MIRROR_URL = "HIPPO_CONFIG_MIRROR_URL"
+HIPPO_CONFIG_MIRROR_INTERVAL = "HIPPO_CONFIG_MIRROR_INTERVAL"
+HIPPO_WEBHOOK_SECRET = "HIPPO_WEBHOOK_SECRET"
+
+# - Storage backends
+S3_STORAGE_BACKEND = "s3"
+S3_COMPATIBLE_STORAGE_BACKEND = "s3-compatible"
+LOCAL_STORAGE_BACKEND = "local"
+DEFAULT_LOCAL_STORAGE_PATH = "hippo-storage"
 HIPPO_SITES_PATH = "meltmedia/hippo-sites"
+DEFAULT_CONFIG_MIRROR_PATH = "hippo-sites-mirror"
 
 DEFAULT_APP_CONFIG = {
     HIPPO_ENVIRONMENT: "develop",
@@ -78,7 +134,11 @@ DEFAULT_APP_CONFIG = {
     GITHUB_REPO: "GITHUB_REPO",
     GITHUB_BRANCH: "develop",
     ALLOW_BASE_CAPTURE: False,
-    WATERING_HOLE_CLIENT: "meltmedia"
+    WATERING_HOLE_CLIENT: "meltmedia",
+    HIPPO_STORAGE_BACKEND: S3_STORAGE_BACKEND,
+    HIPPO_SITEMAP_CACHE_TTL: DEFAULT_SITEMAP_CACHE_TTL,
+    HIPPO_CONFIG_CACHE_TTL: DEFAULT_CONFIG_CACHE_TTL,
+    HIPPO_CONFIG_MIRROR_INTERVAL: DEFAULT_CONFIG_MIRROR_INTERVAL
 }
 
 # - REQUEST KEYS
@@ -109,6 +169,14 @@ BINARY = "binary"
 WEBDRIVER = "webdriver"
 SCALE_FACTOR = "scale_factor"
 CROP_IMAGES_FOR_PDF = "crop_images_for_pdf"
+CREATE_PDF = "create_pdf"
+PDF_PROFILE = "pdf_profile"
+PDF_VOLUMES = "pdf_volumes"
+BUNDLE = "bundle"
+SITEMAP_CRAWL = "sitemap_crawl"
+INCREMENTAL = "incremental"
+INCREMENTAL_CAPTURE = "incremental_capture"
+ACTION_LIBRARY_LOAD = "action_library_load"
 USE_SAUCE_LABS = "use_sauce_labs"
 
 # - CONFIG KEYS
@@ -129,6 +197,7 @@ SITEMAP_PATH = "sitemap_path"
 PAGES = "pages"
 BEFORE_SCREENSHOT_KEY = "before_screenshot"
 CONTENT_CONTAINER_SELECTOR_KEY = "content_container_selector"
+DETECT_STICKY_ELEMENTS_KEY = "detect_sticky_elements"
 CONTENT_PATH = "content_path"
 CUSTOM_INPUTS = "custom_inputs"
 LABEL = "label"
@@ -201,6 +270,12 @@ ADD_TO_MISC_KEY = "add_to_misc"
 DEFAULT_CONTENT_KEY = "default_content"
 WIDTH_KEY = "width"
 HEIGHT_KEY = "height"
+MAX_WIDTH_KEY = "max_width"
+DPI_KEY = "dpi"
+JPEG_QUALITY_KEY = "jpeg_quality"
+BY_SECTION_KEY = "by_section"
+MAX_PAGES_KEY = "max_pages"
+MAX_BYTES_KEY = "max_bytes"
 CONTENT_HEIGHT_KEY = "content_height"
 PATHS_TO_SKIP_KEY = "paths_to_skip"
 NAME_KEY = "name"
@@ -254,95 +329,100 @@ def get_sitemap_path(project, config, base_url, content_path):
     return sitemap_url
 
 
-def crawl(sitemap_url, browser_data, base_url, username, password, content_path=None):
-    internal_urls = []
-    sh = selenium_helpers.SeleniumHelpers()
-    http = urllib3.PoolManager(cert_reqs = 'CERT_NONE')
-    browser_under_test = browser_data.get(BROWSER_NAME)
-
-    try:
-        request = http.request("GET", sitemap_url)
-        if check_if_author(sitemap_url) or request.status != 200:
-            sh.create_driver(**browser_data)
-            # sh.driver.set_page_load_timeout(30)
-            sh.load_url(sitemap_url, bypass_status_code_check=True)
-            time.sleep(5)
-            if any(login_indicator in sh.get_current_url() for login_indicator in GENE_SAML_LOGIN_INDICATOR or AUTHOR_SITE_INDICATOR or DISPATCH_INDICATOR):
-                log.debug("GENE SAML LOGIN DETECTED")
-                platform_login(sh, base_url, username, password)
-                sh.load_url(sitemap_url, bypass_status_code_check=True)
-                time.sleep(5)
-
-            soup = BeautifulSoup(sh.driver.page_source, "html.parser")
-            discovered_urls = soup.find_all("loc")
-        else:
-            # Using the http response if it was successful.
-            soup = BeautifulSoup(request.data, "html.parser")
-            discovered_urls = soup.find_all("loc")
-
-        for page in discovered_urls:
-            page_link = page.text
-            if all(blacklist not in page_link for blacklist in URL_BLACKLIST):
-                # - Remove the path from the url to remove the prod domain from the path (if there)
-                path = parse_url_path(page_link, content_path)
-
-                # - Add it to the url list
-                internal_urls.append(path)
-
-        # Setting the browser back to what the user requested now that the crawl has completed.
-        browser_data.update({BROWSER_NAME: browser_under_test})
-    except Exception as e:
-        if sh.driver:
-            sh.quit_driver()
-        log.warning(e)
-        raise e
-
-    finally:
-        if sh.driver:
-            sh.quit_driver()
-
-    return internal_urls
-
-
 def trim_sections(site_paths, content_path, site_sections=None, skip_sections=None):
-    # - Remove any paths not in the site_sections
-    # Gather "clean" paths from the list of site_paths
-    urls_in_sections = []
+    """
+    Removes the paths that are not in one of the site_sections, or that are in one of the skip_sections. site_paths
+    can be any iterable, i.e. the generator from sitemap.crawl(), and is only read through once
+    """
+    site_sections = site_sections or []
+    skip_sections = skip_sections or []
+    in_site_sections = SectionMatcher(site_sections)
+    in_skip_sections = SectionMatcher(skip_sections)
+    urls_in_sections = set()
+    approved_pages = []
+
     for path in site_paths:
-        for section in site_sections:
-            if path in urls_in_sections:
+        # - Remove any paths not in the site_sections
+        if site_sections:
+            if path in urls_in_sections or not in_site_sections.matches(path):
                 continue
+            urls_in_sections.add(path)
 
-            if ("*" in section and all(
-                    segment in path for segment in filter(None, section.split("*")))) or path.startswith(section):
-                urls_in_sections.append(path)
+        # - Remove any pages with a skip_section in the path
+        if not in_skip_sections.matches(path):
+            approved_pages.append(path)
 
-    if urls_in_sections:
-        site_paths = urls_in_sections
-    elif site_sections:
+    if site_sections and not urls_in_sections:
         raise HippoThreadError("None of the site's urls started with one of the site_sections provided. "
                                "Please check the site sections you provided with the request to ensure they "
                                "were spelled correctly and submit it again")
+    if skip_sections and not approved_pages:
+        raise HippoThreadError("No pages remained after the skip_sections were removed from the list of urls")
 
-    # - Remove any pages with a skip_section in the path
-    approved_pages = []
-    for path in site_paths:
-        page_approved = True
-        for section in skip_sections:
-            if "*" in section and all(segment in path for segment in filter(None, section.split("*"))):
-                page_approved = False
-            elif path.startswith(section):
-                page_approved = False
-
-        if page_approved:
-            approved_pages.append(path)
+    return approved_pages
 
-    if approved_pages:
-        site_paths = approved_pages
-    elif skip_sections:
-        raise HippoThreadError("No pages remained after the skip_sections were removed from the list of urls")
 
-    return site_paths
+class SectionMatcher:
+    """
+    Checks paths against a list of site sections. A path is in a section when it starts with the section, or when the
+    section has wildcards (i.e. "/products/*/dosing") and the path contains every piece of it. The sections are
+    compiled once, into a prefix trie and the pieces of each wildcard section, so each path is only walked once for
+    all of the plain sections.
+    """
+    # Marks the end of a section in the trie
+    SECTION_END = ""
+
+    def __init__(self, sections):
+        """
+        :param
+            - sections: list - The site_sections or skip_sections to match paths against
+        """
+        self.prefix_trie = {}
+        self.wildcard_sections = []
+        for section in dict.fromkeys(sections):
+            node = self.prefix_trie
+            for character in section:
+                node = node.setdefault(character, {})
+            node[self.SECTION_END] = True
+
+            if "*" in section:
+                self.wildcard_sections.append(tuple(filter(None, section.split("*"))))
+
+    def matches(self, path):
+        """
+        :return
+            - bool: Whether the path is in any of the sections
+        """
+        node = self.prefix_trie
+        if self.SECTION_END in node:
+            return True
+        for character in path:
+            node = node.get(character)
+            if node is None:
+                break
+            if self.SECTION_END in node:
+                return True
+
+        return any(all(segment in path for segment in segments) for segments in self.wildcard_sections)
+
+
+def get_crawl_source(crawl_stats):
+    """
+    :param
+        - crawl_stats:  dict - The number of sitemaps that were "cached", "revalidated", "fetched" or read with a
+                               "browser" during the crawl
+    :return
+        - string: Where the crawl's sitemaps came from, for the logs
+    """
+    from_cache = crawl_stats.get("cached", 0) + crawl_stats.get("revalidated", 0)
+    downloaded = crawl_stats.get("fetched", 0) + crawl_stats.get("browser", 0)
+    if from_cache and not downloaded:
+        return "cache"
+    elif from_cache:
+        return "cache and network"
+    elif crawl_stats.get("browser"):
+        return "browser"
+    return "network"
 
 
 def add_urls_to_image_list(image_list, user, project, branch, base_url, site_paths, build_id, mobile,
@@ -367,9 +447,10 @@ def parse_url_path(url, remove_from_path=None):
     if remove_from_path:
         url = re.sub(remove_from_path, "", url)
 
-    path = urlparse(url).path
-    query = urlparse(url).query
-    fragment = urlparse(url).fragment
+    parsed_url = urlparse(url)
+    path = parsed_url.path
+    query = parsed_url.query
+    fragment = parsed_url.fragment
     if fragment:
         path = f"{path}#{fragment}"
     if query:
@@ -378,6 +459,22 @@ def parse_url_path(url, remove_from_path=None):
     return path
 
 
+def get_page_template(path):
+    """
+    Pages are assumed to share a template with the other pages in their section of the site
+    :return
+        - string: The section of the site the path is in, ie. "/products/" for "/products/widget?color=red"
+    """
+    path = urlparse(path).path or "/"
+    return path[:path.rstrip("/").rfind("/") + 1] or "/"
+
+
+def is_absolute_url(url):
+    """Whether the url is an http(s) url with a host, which links the same way from anywhere it is opened"""
+    parsed_url = urlparse(url or "")
+    return parsed_url.scheme in ("http", "https") and bool(parsed_url.netloc)
+
+
 def parse_domain(url):
     domain = urlparse(url).netloc
     return domain
@@ -512,6 +609,38 @@ def platform_login(selenium_helper, url, username, password):
         raise e
 
 
+def create_pdf_volume_index(image_list_data, pdf_volumes):
+    """
+    Creates the html document that links to each of the PDF volumes of a build
+    :param
+        - image_list_data:  dict - The image_list of the build
+        - pdf_volumes:      list - The name, section, pdf_url and pages of each volume
+    :return
+        - BytesIO:  The html document
+    """
+    rows = "".join(
+        f"<tr><td><p>{number + 1}</p><td><p>{volume['section']}</p>"
+        f"<td><p><a target=_blank href={volume['pdf_url']}>{volume['name']}</a></p>"
+        f"<td><p>{len(volume['pages'])}</p></tr>\n"
+        for number, volume in enumerate(pdf_volumes))
+
+    index_html = f"""<!DOCTYPE html>
+<html>
+<head><meta http-equiv='Content-Type' content='text/html; charset=utf-8'>
+<link rel="stylesheet" type="text/css" href="https://maxcdn.bootstrapcdn.com/bootstrap/3.3.6/css/bootstrap.min.css">
+<title>{image_list_data.get("project", "")} - {image_list_data.get("branch", "")} PDF Volumes</title></head>
+<body><div class="container">
+<h1>{image_list_data.get("project", "")} - {image_list_data.get("branch", "")} PDF Volumes</h1>
+<p>Build: {image_list_data.get("build_ID", "")}</p>
+<table class="table table-striped">
+<thead><th>Volume</th><th>Section</th><th>PDF</th><th>Pages</th></thead>
+{rows}</table>
+</div></body>
+</html>
+"""
+    return BytesIO(index_html.encode("utf-8"))
+
+
 def create_html_log(image_list_data, result, start_date, start_time, error_list=None, site_sections=None,
                     skip_sections=None):
     screenshot_log_html = StringIO()
@@ -575,6 +704,36 @@ def create_html_log(image_list_data, result, start_date, start_time, error_list=
         }
          </style>\n"""
     )
+    # - List each of the PDF volumes, when the PDF was split up
+    pdf_volume_rows = "".join(
+        f"<tr><td><p class='bold'>PDF Volume {number + 1}</p><td><p><a target=_blank href={volume['pdf_url']}>"
+        f"{volume['name']}</a> ({len(volume['pages'])} pages)</p></tr>"
+        for number, volume in enumerate(image_list_data.get(PDF_VOLUMES, [])))
+
+    # - Where the sitemap came from, when the site was crawled
+    crawl_stats = image_list_data.get(SITEMAP_CRAWL)
+    sitemap_crawl_row = (
+        f"<tr><td><p class='bold'>Sitemap Crawl</p><td><p>From the {crawl_stats.get('source')} in "
+        f"{crawl_stats.get('seconds')}s ({crawl_stats.get('cached', 0)} cached, {crawl_stats.get('revalidated', 0)} "
+        f"unchanged, {crawl_stats.get('fetched', 0) + crawl_stats.get('browser', 0)} downloaded)</p></tr>"
+    ) if crawl_stats else ""
+
+    # - How long the action libraries took to load, and how many came from the config cache
+    library_stats = image_list_data.get(ACTION_LIBRARY_LOAD)
+    action_library_row = (
+        f"<tr><td><p class='bold'>Action Libraries</p><td><p>{library_stats.get('libraries')} loaded in "
+        f"{library_stats.get('seconds')}s ({library_stats.get('mirror', 0)} from the config mirror, "
+        f"{library_stats.get('cached', 0)} cached, {library_stats.get('fetched', 0)} fetched, "
+        f"{library_stats.get('hit_rate', 0):.0%} config cache hit rate)</p></tr>"
+    ) if library_stats else ""
+
+    # - How many pages were reused from the last build, when only the changed pages were captured
+    incremental_stats = image_list_data.get(INCREMENTAL_CAPTURE)
+    incremental_row = (
+        f"<tr><td><p class='bold'>Incremental Capture</p><td><p>{incremental_stats.get('captured')} captured, "
+        f"{incremental_stats.get('reused')} unchanged since build {incremental_stats.get('previous_build')}</p></tr>"
+    ) if incremental_stats else ""
+
     # - Write out run data table heading
     # 0 = Project
     # 1 = Branch
@@ -602,6 +761,11 @@ def create_html_log(image_list_data, result, start_date, start_time, error_list=
         <tr><td><p class='bold'>Excluded Areas</p><td><p>{excludes}</p></tr>
         <tr><td><p class='bold'>Image_list</p><td><p><a target=_blank href={image_list_data["image_list_url"]}>{image_list_data["image_list_url"]}</a></p></tr>
         <tr><td><p class='bold'>PDF Link</p><td><p><a target=_blank href={image_list_data.get("pdf_url", "Not sent")}>{image_list_data.get("pdf_url", "Not sent")}</a></p></tr>
+        <tr><td><p class='bold'>PDF Size</p><td><p>{image_list_data.get("pdf_size", "Not sent")}</p></tr>
+        {pdf_volume_rows}
+        {sitemap_crawl_row}
+        {action_library_row}
+        {incremental_row}
         <tr><td><p class='bold'>Start Time</p><td><p>{start_date}</p></tr>
         <tr><td><p class='bold'>Duration</p><td><p>{datetime.timedelta(seconds=time.time() - start_time)} (includes time in queue)</p></tr>
         </table><p><p>
@@ -823,6 +987,20 @@ def close_gene_cookie_modal(selenium_helper):
         log.debug("No cookie modal found. Moving on without closing it.")
 
 
+def get_github_branch(config):
+    """
+    :param
+        - config:   dict - The Hippo service's configuration
+    :return
+        - string: The branch of the hippo-sites repo that configs are read from. Defaults to production when running
+                  on production, and to develop everywhere else
+    """
+    github_branch = config.get(GITHUB_BRANCH)
+    if not github_branch:
+        github_branch = "develop" if config.get(HIPPO_ENVIRONMENT) not in ["production"] else "production"
+    return github_branch
+
+
 def get_all_github_branches(github_token, hippo_sites_repo):
     """
     This will use the GitHub API to get a list of branches in a specified GitHub repository.
@@ -840,69 +1018,6 @@ def get_all_github_branches(github_token, hippo_sites_repo):
     return branches
 
 
-def get_config_list(repo, branch, directory, headers, local_path=None):
-    config_files = []
-    if local_path:
-        local_sites_path = os.path.join(local_path, directory)
-        found_files = [f for f in os.listdir(local_sites_path)
-                       if os.path.isfile(os.path.join(local_sites_path, f))]
-        for file_name in found_files:
-            if file_name.endswith(".json"):
-                config_files.append(file_name)
-    else:
-        # sites_path = "/repos/meltmedia/{}/contents/{}?ref={}".format(repo, directory, branch)
-        sites_path = f"repos/{repo}/meltmedia/contents/hippo-sites/{directory}?ref={branch}"
-        resp = requests.get(f"https://api.github.com/{sites_path}", headers=headers)
-
-        logging.info(f"API URL Response from Github {resp.status_code}")
-
-        config_list = json.loads(resp.content)
-        for config in config_list:
-            config_files.append(config["name"])
-
-    logger.info(f"Config file {config_files}")
-    return config_files
-
-
-def get_configuration_from_github(project, github_branch, environment, github_token, github_repo):
-    config_filename = f"{project}.json"
-    project_config = None
-
-    headers = {"Authorization": f"token {github_token}"}
-
-    # Get a list of all configs available for Hippo (on this environment's branch)
-    try:
-        config_list = get_config_list(github_repo, github_branch, "sites", headers)
-        logger.info(f"Config lists {config_list}")
-    except Exception as e:
-        print("Unable to fetch config list ", e)
-
-    # - Check whether a config file exists for theis project and branch combination
-    if config_filename in config_list:
-        pass
-    else:
-        # A config for this project does not exist. Throw an error and freak out!
-        message = f"There does not appear to be a Hippo config on Github for the project {project!r}. " \
-                  "Please speak with your QA representative to troubleshoot the issue."
-        log.error(message)
-        raise HippoGeneralException(message)
-
-    # - Request the config data
-    repo_path = f"{github_repo}/meltmedia/{github_branch}/hippo-sites/sites/{config_filename}"
-    resp = requests.get(f"https://raw.githubusercontent.com/{repo_path}", headers=headers)
-    # Check that the respone had a good status code
-    if resp.status_code > 400:
-        message = f"A bad status code of {resp.status_code} was returned when attempting to grab the config file at {repo_path}. " \
-                  f"Please see your QA rep for help troubleshooting this issue: {resp.text}"
-        log.error(message)
-        raise HippoGeneralException(message)
-
-    # Load the response data into a json object
-    project_config = json.loads(resp.content)
-
-    return project_config
-
-
 def get_active_sauce_tunnel(sauce_labs_username, sauce_labs_access_key):
     """
     This will check to see if there are any Sauce Labs tunnels up and running. If there are it will loop through each
@@ -17,7 +17,10 @@ ENV_VARS = [util.GRAYLOG_FACILITY, util.GRAYLOG_LEVEL, util.HIPPO_S3_BUCKET, uti
             util.HIPPO_PORT, util.GITHUB_REPO, util.GITHUB_TOKEN, util.GITHUB_DIRECTORY, util.ALLOW_BASE_CAPTURE,
             util.MANDRILL_KEY, util.HIPPO_AEM_USERNAME, util.HIPPO_AEM_PASSWORD, util.PFIZER_USERNAME,
             util.PFIZER_PASSWORD, util.GITHUB_BRANCH, util.AWS_KEY, util.AWS_SECRET,
-            util.WATERING_HOLE_CLIENT, util.SAUCE_LABS_USERNAME, util.SAUCE_LABS_ACCESS_KEY]
+            util.WATERING_HOLE_CLIENT, util.SAUCE_LABS_USERNAME, util.SAUCE_LABS_ACCESS_KEY, util.HIPPO_PUBLIC_URL,
+            util.HIPPO_STORAGE_BACKEND, util.HIPPO_STORAGE_PATH, util.HIPPO_STORAGE_ENDPOINT_URL, util.HIPPO_STORAGE_URL,
+            util.HIPPO_SITEMAP_CACHE_TTL, util.HIPPO_CONFIG_CACHE_TTL, util.HIPPO_CONFIG_MIRROR_PATH,
+            util.HIPPO_CONFIG_MIRROR_URL, util.HIPPO_CONFIG_MIRROR_INTERVAL, util.HIPPO_WEBHOOK_SECRET]
 
 logger = logging.getLogger(__name__)
 logging.getLogger("requests").setLevel(logging.CRITICAL)
@@ -76,6 +79,40 @@ def get_args():
 
     parser.add_argument("-sa", "--sauce-access-key", help="The access key used to connect to Sauce Labs.")
 
+    parser.add_argument(
+        "-pu", "--hippo-public-url", help="The url this Hippo instance can be reached at, used to link to bundled images")
+
+    parser.add_argument(
+        "-sb", "--hippo-storage-backend", help="Where builds are stored",
+        choices=[util.S3_STORAGE_BACKEND, util.S3_COMPATIBLE_STORAGE_BACKEND, util.LOCAL_STORAGE_BACKEND])
+
+    parser.add_argument(
+        "-sp", "--hippo-storage-path", help="The folder builds are stored in when using the local storage backend")
+
+    parser.add_argument(
+        "-se", "--hippo-storage-endpoint-url", help="The url of the S3 compatible service to store builds in")
+
+    parser.add_argument(
+        "-ct", "--hippo-sitemap-cache-ttl", type=int,
+        help="The number of seconds a crawled sitemap is used before checking whether it has changed")
+
+    parser.add_argument(
+        "-cc", "--hippo-config-cache-ttl", type=int,
+        help="The number of seconds a project config is used before checking Github for changes to it")
+
+    parser.add_argument(
+        "-mp", "--hippo-config-mirror-path", help="The folder the hippo-sites repo is mirrored in to")
+
+    parser.add_argument(
+        "-mu", "--hippo-config-mirror-url", help="The https url of the hippo-sites repo to mirror")
+
+    parser.add_argument(
+        "-mi", "--hippo-config-mirror-interval", type=int,
+        help="The number of seconds between fetches of the hippo-sites mirror")
+
+    parser.add_argument(
+        "-ws", "--hippo-webhook-secret", help="The secret that GitHub signs the /hooks/config webhooks with")
+
     return parser.parse_args()
 
 
@@ -22,7 +22,8 @@ CLOSE_WINDOW_ACTION = "close_window"
 EXECUTE_SCRIPT_ACTION = "execute_script"
 FOCUS_ACTION = "focus"
 
-ALL_ACTION_TYPES = [locals()[v] for v in dir() if v.endswith(ACTION_IDENTIFIER)]
+local_ = locals()
+ALL_ACTION_TYPES = [local_[v] for v in dir() if v.endswith(ACTION_IDENTIFIER)]
 
 # - Action Keys
 ACTION_KEY = "action"
@@ -54,4 +55,4 @@ VIEWPORT_ONLY_KEY = "viewport_only"
 X_POSITION_KEY = "x_position"
 Y_POSITION_KEY = "y_position"
 
-ALL_ACTION_KEYS = [locals()[v] for v in dir() if v.endswith(KEY_IDENTIFIER)]
\ No newline at end of file
+ALL_ACTION_KEYS = [local_[v] for v in dir() if v.endswith(KEY_IDENTIFIER)]
\ No newline at end of file
@@ -1,5 +1,5 @@
-from action_constants import *
-from the_ark.input_generator import STRING_FIELD, EMAIL_FIELD, PHONE_FIELD, ZIP_CODE_FIELD, DATE_FIELD, PASSWORD_FIELD
+from src.the_ark.resources.action_constants import *
+from src.the_ark.field_handlers import STRING_FIELD, EMAIL_FIELD, PHONE_FIELD, ZIP_CODE_FIELD, DATE_FIELD, PASSWORD_FIELD
 
 
 ACTION_SCHEMA = {
@@ -1,6 +1,7 @@
 import jsonschema
 
 from jsonschema import ValidationError, RefResolutionError
+from src.the_ark.resources.action_schema import ACTION_SCHEMA
 
 
 def validate(data, schema):
@@ -12,7 +13,10 @@ def validate(data, schema):
         True if valid data
     """
     try:
-        jsonschema.validate(data, schema)
+        validator = ACTION_VALIDATOR if schema is ACTION_SCHEMA else build_validator(schema)
+        error = jsonschema.exceptions.best_match(validator.iter_errors(data))
+        if error is not None:
+            raise error
     except (ValidationError, RefResolutionError) as jsonschema_exception:
         # TODO: Check for specific errors, like URL's that have a slash at the end, and give specific messages back
         message = "The given data was not valid based on the given schema: {0}".format(jsonschema_exception)
@@ -25,6 +29,17 @@ def validate(data, schema):
     return True
 
 
+def build_validator(schema):
+    """Checks the schema and builds the validator for it"""
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+    return validator_class(schema)
+
+
+# - The validator for the action schema is built once, when the module is imported
+ACTION_VALIDATOR = build_validator(ACTION_SCHEMA)
+
+
 class SchemaValidationError(Exception):
     def __init__(self, message=None, schema_data=None, schema=None, stacktrace=""):
         self.message = message
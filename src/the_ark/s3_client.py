@@ -1,4 +1,7 @@
 import boto3
+import botocore.exceptions
+import collections
+import concurrent.futures
 import mimetypes
 import os
 import shutil
@@ -7,12 +10,15 @@ import urllib
 from urllib.parse import urlparse, parse_qs, urlunparse, urlencode
 import logging
 import io
+import threading
 
 logger = logging.getLogger(__name__)
 
 MAX_FILE_SPLITS = 9999
 DEFAULT_FILE_SPLIT_SIZE = 6291456
 DEFAULT_MINIMUM_SPLIT_AT_SIZE = 20000000
+DEFAULT_URL_EXPIRATION = 36000
+DEFAULT_UPLOAD_WORKERS = 8
 
 
 class S3Client(object):
@@ -20,13 +26,15 @@ class S3Client(object):
     s3_connection = None
     bucket = None
 
-    def __init__(self, bucket):
+    def __init__(self, bucket, endpoint_url=None):
         """
         Creates the logger and sets the bucket name that will be used throughout
         :param
-            - bucket:   string - The name of the bucket you will be working with
+            - bucket:       string - The name of the bucket you will be working with
+            - endpoint_url: string - The url of an S3 compatible service to use instead of Amazon S3
         """
         self.bucket_name = bucket
+        self.endpoint_url = endpoint_url
 
     def connect(self):
         """Start the amazon connection using the system's boto.cfg file to retrieve the credentials"""
@@ -35,7 +43,7 @@ class S3Client(object):
 
         try:
             self.s3_connection = boto3.client('s3', aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-                            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'])
+                            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'], endpoint_url=self.endpoint_url)
             # self.bucket_name = [x['Name'] for x in self.s3_connection.list_buckets()['Buckets'] if x['Name'] == self.bucket]
 
         except Exception as s3_connection_exception:
@@ -72,10 +80,7 @@ class S3Client(object):
                 self.s3_connection.upload_file(file_to_store, self.bucket_name, s3_file_path)
             
             if return_url:
-                file_url = self.s3_connection.generate_presigned_url('get_object',
-                                                    Params={'Bucket': self.bucket_name,
-                                                            'Key': s3_file_path},
-                                                    ExpiresIn=36000)
+                file_url = self.get_file_url(s3_path, filename)
 
                 # - Certain server side permissions might cause a x-amz-security-token parameter to be added to the url
                 # Split the url into its pieces
@@ -86,7 +91,58 @@ class S3Client(object):
 
         except Exception as store_file_exception:
             message = f"Exception while storing file on S3: {store_file_exception}"
-            raise message
+            raise S3ClientException(message)
+
+    def get_file_url(self, s3_path, filename, expires_in=DEFAULT_URL_EXPIRATION):
+        """
+        Generates a presigned url for a file on S3
+        :param
+            - s3_path:      string - The S3 path to the folder which contains the file
+            - filename:     string - The name of the file on S3
+            - expires_in:   int - The number of seconds the url will be valid for
+        :return
+            - file_url:     string - The presigned url to the file on S3
+        """
+        self.connect()
+        return self.s3_connection.generate_presigned_url('get_object',
+                                                         Params={'Bucket': self.bucket_name,
+                                                                 'Key': self._generate_file_path(s3_path, filename)},
+                                                         ExpiresIn=expires_in)
+
+    def open_multipart_upload(self, s3_path, filename, mime_type=None, part_size=DEFAULT_FILE_SPLIT_SIZE,
+                              max_workers=None):
+        """
+        Starts a multipart upload that can be written to like a file. Data is sent up to S3 in part_size chunks as it is
+        written, so the whole file never has to exist in memory or on disk.
+        :param
+            - s3_path:      string - The S3 path to the folder in which you'd like to store the file
+            - filename:     string - The name the file will have when on S3. Should include the file extension
+            - mime_type:    string - The mime type the file should be saved as, ex: application/pdf
+            - part_size:    int - The number of Bytes sent per part (Should be > 5 MB for Amazon S3 minimum)
+            - max_workers:  int - When set, the parts are sent up on this many worker threads once flush() is called,
+                                  instead of by write() itself
+        :return
+            - S3MultipartUpload:    A writable object. Call close() to complete the upload or abort() to cancel it
+        """
+        self.connect()
+
+        try:
+            mime_type = mime_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            return S3MultipartUpload(self, s3_path, filename, mime_type, part_size, max_workers)
+        except Exception as multipart_exception:
+            message = f"Exception while starting a multipart upload on S3: {multipart_exception}"
+            raise S3ClientException(message)
+
+    def open_concurrent_uploader(self, max_workers=DEFAULT_UPLOAD_WORKERS):
+        """
+        Creates an uploader that sends files up to S3 on a pool of worker threads
+        :param
+            - max_workers:  int - The number of files that can be uploaded at the same time
+        :return
+            - S3ConcurrentUploader: Call store_file() to queue up a file and close() to wait for every upload to finish
+        """
+        self.connect()
+        return S3ConcurrentUploader(self, max_workers)
 
     def get_file(self, s3_path, file_to_get):
         """
@@ -102,9 +158,9 @@ class S3Client(object):
         try:
             if self.verify_file(s3_path, file_to_get):
                 retrieved_file = io.BytesIO()
-                s3_file = self.bucket.get_key(
-                    self._generate_file_path(s3_path, file_to_get))
-                s3_file.get_contents_to_file(retrieved_file)
+                self.s3_connection.download_fileobj(self.bucket_name, self._generate_file_path(s3_path, file_to_get),
+                                                    retrieved_file)
+                retrieved_file.seek(0)
                 return retrieved_file
             else:
                 raise S3ClientException("File not found in S3")
@@ -113,6 +169,49 @@ class S3Client(object):
             message = f"Exception while retrieving file from S3: {get_file_exception}"
             raise S3ClientException(message)
 
+    def download_file(self, s3_path, file_to_get, local_path):
+        """
+        Saves a file from S3 straight to disk, without holding it in memory
+        :param
+            - s3_path:      string - The S3 path to the folder which contains the file
+            - file_to_get:  string - The name of the file you are looking for in the folder
+            - local_path:   string - The path the file will be saved to
+        :return
+            - local_path:   string - The path the file was saved to
+        """
+        self.connect()
+
+        try:
+            self.s3_connection.download_file(self.bucket_name, self._generate_file_path(s3_path, file_to_get),
+                                             local_path)
+            return local_path
+
+        except Exception as download_file_exception:
+            message = f"Exception while downloading file from S3: {download_file_exception}"
+            raise S3ClientException(message)
+
+    def get_file_range(self, s3_path, file_to_get, start, end):
+        """
+        Reads a range of bytes from a file on S3, without downloading the rest of it
+        :param
+            - s3_path:      string - The S3 path to the folder which contains the file
+            - file_to_get:  string - The name of the file you are looking for in the folder
+            - start:        int - The first byte to read
+            - end:          int - The last byte to read (inclusive)
+        :return
+            - bytes:    The content of the file between start and end
+        """
+        self.connect()
+
+        try:
+            response = self.s3_connection.get_object(Bucket=self.bucket_name, Range=f"bytes={start}-{end}",
+                                                     Key=self._generate_file_path(s3_path, file_to_get))
+            return response["Body"].read()
+
+        except Exception as get_range_exception:
+            message = f"Exception while reading a range of a file from S3: {get_range_exception}"
+            raise S3ClientException(message)
+
     def verify_file(self, s3_path, file_to_verify):
         """
         Verifies a file (e.g. configuration file) is on S3 and returns
@@ -121,16 +220,19 @@ class S3Client(object):
             - s3_path:          string - The S3 path to the folder which contains the file
             - file_to_verify:   string - The name of the file you are looking for in the folder
         :return
-            - boolean:     True if .get_key returns an instance of a Key object and False if .get_key returns None:
+            - boolean:     True if the file exists on S3, False if it does not
         """
         self.connect()
         try:
             file_path = self._generate_file_path(s3_path, file_to_verify)
-            s3_file = self.bucket.get_key(file_path)
-            if s3_file:
-                return True
-            else:
+            self.s3_connection.head_object(Bucket=self.bucket_name, Key=file_path)
+            return True
+
+        except botocore.exceptions.ClientError as verify_file_exception:
+            if verify_file_exception.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
                 return False
+            message = f"Exception while verifying file on S3: {verify_file_exception}"
+            raise S3ClientException(message)
 
         except Exception as verify_file_exception:
             message = f"Exception while verifying file on S3: {verify_file_exception}"
@@ -158,7 +260,10 @@ class S3Client(object):
         self.connect()
 
         s3_folder_path = str(path_to_folder)
-        key_list = self.bucket.list(prefix=s3_folder_path)
+        key_list = []
+        paginator = self.s3_connection.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=s3_folder_path):
+            key_list.extend(s3_object["Key"] for s3_object in page.get("Contents", []))
         return key_list
 
     def get_most_recent_file_from_s3_key_list(self, key_list):
@@ -208,6 +313,171 @@ class S3Client(object):
             raise S3ClientException("Could not split the file.\nError: {e}\n")
 
 
+class S3MultipartUpload(object):
+    """
+    A file-like object that streams everything written to it up to S3 as a multipart upload. With max_workers set,
+    write() only cuts the data into parts, and flush() hands them to a pool of worker threads to be sent up. At most
+    twice max_workers parts are held in memory while they are sent, after which flush() waits for one to finish.
+    """
+
+    def __init__(self, s3_client, s3_path, filename, mime_type, part_size=DEFAULT_FILE_SPLIT_SIZE, max_workers=None):
+        self.s3_client = s3_client
+        self.s3_path = s3_path
+        self.filename = filename
+        self.key = s3_client._generate_file_path(s3_path, filename)
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.parts = []
+        self.part_count = 0
+        self.bytes_written = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self.ready_parts = collections.deque()
+        self.futures = []
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) if max_workers else None
+        self.in_flight = threading.BoundedSemaphore(max_workers * 2) if max_workers else None
+        self.upload_id = s3_client.s3_connection.create_multipart_upload(
+            Bucket=s3_client.bucket_name, Key=self.key, ContentType=mime_type)["UploadId"]
+
+    def write(self, data):
+        self.buffer.extend(data)
+        self.bytes_written += len(data)
+        while len(self.buffer) >= self.part_size:
+            part_number, part = self._next_part_number(), bytes(self.buffer[:self.part_size])
+            del self.buffer[:self.part_size]
+            if self.executor:
+                with self.lock:
+                    self.ready_parts.append((part_number, part))
+            else:
+                self._upload_part(part_number, part)
+        return len(data)
+
+    def flush(self):
+        """Hands the parts that write() has cut to the worker threads. Safe to call from any thread"""
+        if not self.executor:
+            return
+        while True:
+            with self.lock:
+                if self.closed or not self.ready_parts:
+                    return
+                part_number, part = self.ready_parts.popleft()
+            self.in_flight.acquire()
+            future = self.executor.submit(self._upload_queued_part, part_number, part)
+            with self.lock:
+                self.futures.append(future)
+
+    def tell(self):
+        return self.bytes_written
+
+    def close(self, return_url=False):
+        """
+        Sends the remaining data and completes the upload
+        :return
+            - file_url: string - The path to the file on S3. This is returned only is return_url is set to true
+        """
+        if not self.closed:
+            try:
+                self.flush()
+                # S3 requires at least one part, even for an empty file
+                if self.buffer or not self.part_count:
+                    self._upload_part(self._next_part_number(), bytes(self.buffer))
+                    self.buffer = bytearray()
+                if self.executor:
+                    for future in self.futures:
+                        future.result()
+                    self.executor.shutdown()
+                self.s3_client.s3_connection.complete_multipart_upload(
+                    Bucket=self.s3_client.bucket_name, Key=self.key, UploadId=self.upload_id,
+                    MultipartUpload={"Parts": sorted(self.parts, key=lambda uploaded: uploaded["PartNumber"])})
+                self.closed = True
+            except Exception as complete_exception:
+                self.abort()
+                raise S3ClientException(f"Exception while completing the multipart upload of {self.key}: "
+                                        f"{complete_exception}")
+
+        if return_url:
+            return self.s3_client.get_file_url(self.s3_path, self.filename)
+
+    def abort(self):
+        if not self.closed:
+            self.closed = True
+            if self.executor:
+                self.executor.shutdown(wait=True, cancel_futures=True)
+            self.s3_client.s3_connection.abort_multipart_upload(
+                Bucket=self.s3_client.bucket_name, Key=self.key, UploadId=self.upload_id)
+
+    def _next_part_number(self):
+        with self.lock:
+            self.part_count += 1
+            if self.part_count > MAX_FILE_SPLITS:
+                raise S3ClientException(f"Unable to upload more than {MAX_FILE_SPLITS} parts to {self.key}")
+            return self.part_count
+
+    def _upload_queued_part(self, part_number, data):
+        try:
+            self._upload_part(part_number, data)
+        finally:
+            self.in_flight.release()
+
+    def _upload_part(self, part_number, data):
+        response = self.s3_client.s3_connection.upload_part(
+            Bucket=self.s3_client.bucket_name, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=data)
+        with self.lock:
+            self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+
+class S3ConcurrentUploader(object):
+    """Sends files up to S3 in the background, on a pool of worker threads"""
+
+    def __init__(self, s3_client, max_workers=DEFAULT_UPLOAD_WORKERS):
+        self.s3_client = s3_client
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.futures = []
+
+    def store_file(self, s3_path, file_to_store, filename, return_url=False, mime_type=None):
+        """
+        Queues up a file to be sent to S3. Takes the same parameters as S3Client.store_file()
+        :return
+            - Future:   Resolves to whatever S3Client.store_file() returns, or raises its S3ClientException
+        """
+        future = self.executor.submit(self.s3_client.store_file, s3_path, file_to_store, filename, return_url,
+                                      mime_type)
+        self.futures.append(future)
+        return future
+
+    def wait(self):
+        """
+        Waits for every queued upload to finish
+        :return
+            - list: The result of each upload, in the order that they were queued
+        """
+        return [future.result() for future in self.futures]
+
+    def close(self, cancel=False):
+        """
+        Shuts down the worker threads, waiting for the queued uploads to finish unless cancel is True
+        """
+        if cancel:
+            for future in self.futures:
+                future.cancel()
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close(cancel=exc_type is not None)
+
+
 class S3ClientException(Exception):
     def __init__(self, message):
         self.msg = message
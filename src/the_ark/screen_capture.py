@@ -1,8 +1,9 @@
 import base64
+import logging
 import math
 import numpy
 from PIL import Image
-from src.the_ark.selenium_helpers import SeleniumHelperExceptions, ElementNotVisibleError, ElementError
+from src.the_ark.selenium_helpers import SeleniumHelperExceptions, DriverExceptions, SCROLL_SETTLE_TIMEOUT
 from io import StringIO, BytesIO
 import time
 import traceback
@@ -12,6 +13,8 @@ SCREENSHOT_FILE_EXTENSION = "png"
 DEFAULT_PIXEL_MATCH_OFFSET = 100
 FIREFOX_HEAD_HEIGHT = 75
 MAX_IMAGE_HEIGHT = 32768.0
+# How long to wait after a scroll when the browser is unable to tell when the page has settled
+SCROLL_FALLBACK_DELAY = 0.25
 
 
 class Screenshot:
@@ -20,7 +23,8 @@ class Screenshot:
     """
     def __init__(self, selenium_helper, paginated=False, header_ids=None, footer_ids=None,
                  scroll_padding=DEFAULT_SCROLL_PADDING, pixel_match_offset=DEFAULT_PIXEL_MATCH_OFFSET,
-                 file_extenson=SCREENSHOT_FILE_EXTENSION, resize_delay=0, content_container_selector="html"):
+                 file_extenson=SCREENSHOT_FILE_EXTENSION, resize_delay=0, content_container_selector="html",
+                 detect_sticky_elements=False, scroll_settle_timeout=SCROLL_SETTLE_TIMEOUT):
         """
         Initializes the Screenshot class. These variable will be used throughout to help determine how to capture pages
         for this website.
@@ -39,13 +43,22 @@ class Screenshot:
                                     to create an overlapping of content shown on both images to not cut any text in half
             - file_extenson:    string - If provided, this extension will be used while creating the image. This must
                                         be an extension that is usable with PIL
+            - detect_sticky_elements:   bool - If True, the headers and footers of pages are found automatically when
+                                            neither header_ids nor footer_ids are given
+            - scroll_settle_timeout:    int - The longest, in seconds, to wait for the page to settle after each scroll
         """
         # Set parameters as class variables
+        self.log = logging.getLogger(self.__class__.__name__)
         self.sh = selenium_helper
         self.paginated = paginated
         self.headers = header_ids
         self.footers = footer_ids
         self.content_container_selector = content_container_selector
+        self.detect_sticky_elements = detect_sticky_elements
+        self.scroll_settle_timeout = scroll_settle_timeout
+        # The headers and footers found on the current page. Set this to None when a page with a different template is
+        # loaded, so that they are found again
+        self.sticky_elements = None
         self.scroll_padding = scroll_padding
         self.pixel_match_offset = pixel_match_offset
         self.file_extenson = "png"
@@ -104,6 +117,7 @@ class Screenshot:
             image_list = []
             # Scroll the element to the top
             self.sh.scroll_an_element(css_selector, scroll_top=True)
+            self._wait_for_scroll(css_selector)
 
             while True:
                 if self.headless:
@@ -119,6 +133,7 @@ class Screenshot:
                 else:
                     # Scroll down for the next one!
                     self.sh.scroll_an_element(css_selector, scroll_padding=padding)
+                    self._wait_for_scroll(css_selector)
 
             return image_list
 
@@ -154,6 +169,7 @@ class Screenshot:
             image_list = []
             # Scroll the element to the top
             self.sh.scroll_an_element(css_selector, scroll_left=True)
+            self._wait_for_scroll(css_selector)
 
             while True:
                 # - Capture the image
@@ -168,6 +184,7 @@ class Screenshot:
                 else:
                     # - Scroll right for the next one!
                     self.sh.scroll_an_element(css_selector, scroll_padding=padding, scroll_horizontal=True)
+                    self._wait_for_scroll(css_selector)
 
             return image_list
 
@@ -182,13 +199,15 @@ class Screenshot:
                                       stacktrace=traceback.format_exc(),
                                       details={"css_selector": css_selector})
 
-    def _capture_single_viewport(self):
+    def _capture_single_viewport(self, metrics=None):
         """
         Grabs an image of the page and then craps it to just the visible / viewport area
+        :param
+            - metrics:  dict - The page's metrics from SeleniumHelpers.get_page_metrics, if they are already known
         :return
             - StringIO: A StingIO object containing the captured image
         """
-        cropped_image = self._get_image_data(viewport_only=True)
+        cropped_image = self._get_image_data(viewport_only=True, metrics=metrics)
         return self._create_image_file(cropped_image)
 
     def _capture_full_page(self):
@@ -199,78 +218,131 @@ class Screenshot:
         :return
             - StringIO: A StingIO object containing the captured image
         """
-        if self.headers and self.footers:
+        headers, footers = self.get_sticky_elements()
+        if headers and footers:
             # Capture viewport size window of the headers
             self.sh.scroll_window_to_position(0)
-            self._hide_elements(self.footers)
-            header_image = self._get_image_data(True)
+            self._hide_elements(footers)
+            header_image = self._get_image_data(True, self._wait_for_scroll())
 
             # - Capture the page from the bottom without headers
-            self._show_elements(self.footers)
+            self._show_elements(footers)
             #TODO: Update when scroll position updates to have a scroll to bottom option
             self.sh.scroll_window_to_position(40000)
-            self._hide_elements(self.headers)
-            footer_image = self._get_image_data()
+            self._hide_elements(headers)
+            footer_image = self._get_image_data(metrics=self._wait_for_scroll())
 
             # Show all header elements again
-            self._show_elements(self.headers)
+            self._show_elements(headers)
 
             # Send the two images off to get merged into one
             image_data = self._crop_and_stitch_image(header_image, footer_image)
-        elif self.headers:
+        elif headers:
             # Scroll to the top so that the headers are not covering content
             self.sh.scroll_window_to_position(0)
-            time.sleep(0.5)
-            image_data = self._get_image_data()
-        elif self.footers:
+            image_data = self._get_image_data(metrics=self._wait_for_scroll())
+        elif footers:
             # Scroll to the bottom so that the footer items are not covering content
             self.sh.scroll_window_to_position(40000)
-            time.sleep(0.5)
-            image_data = self._get_image_data()
+            image_data = self._get_image_data(metrics=self._wait_for_scroll())
         else:
             image_data = self._get_image_data()
 
         return self._create_image_file(image_data)
 
+    def _wait_for_scroll(self, css_selector=None):
+        """
+        Waits for the page to settle after it, or the scrolling element, has been scrolled. This is until the scroll
+        position and layout stop changing and the images in the viewport have loaded, for at most the
+        scroll_settle_timeout
+        :param
+            - css_selector:     string - The scrolling element that was scrolled, if it was not the window
+        :return
+            - dict: The page's metrics once it settled, as from SeleniumHelpers.get_page_metrics
+        """
+        try:
+            return self.sh.wait_for_scroll_settle(css_selector, self.content_container_selector,
+                                                  self.scroll_settle_timeout)
+        # Fall back to waiting a moment, when the browser is unable to run the script
+        except DriverExceptions:
+            time.sleep(SCROLL_FALLBACK_DELAY)
+            return self.sh.get_page_metrics(self.content_container_selector)
+
+    def get_sticky_elements(self):
+        """
+        Gets the elements that stick to the top and bottom of the screen. These are the header_ids and footer_ids when
+        either was given. Otherwise they are found on the page, when detect_sticky_elements is set, and kept in the
+        sticky_elements variable for the rest of the captures
+        :return
+            - list: The css selectors of the elements that stick to the top of the screen
+            - list: The css selectors of the elements that stick to the bottom of the screen
+        """
+        if self.headers or self.footers or not self.detect_sticky_elements:
+            return self.headers or [], self.footers or []
+
+        if self.sticky_elements is None:
+            try:
+                self.sticky_elements = self.sh.find_sticky_elements()
+            # The page is captured as it is, as it would be without any headers or footers
+            except DriverExceptions:
+                return [], []
+        return self.sticky_elements.get("headers", []), self.sticky_elements.get("footers", [])
+
     def _hide_elements(self, css_selectors):
         """
-        Hides all elements in the given list
+        Hides all elements in the given list, in a single call to the browser. Elements that do not exist or are
+        already not visible are skipped. Elements that were found by detect_sticky_elements are only hidden while they
+        are still sticky, and keep their space on the page
         :param
             - css_selectors:    list - A list of the elements you would like to hide
+        :return
+            - int: The number of elements that were hidden
         """
-        for selector in css_selectors:
-            try:
-                self.sh.hide_element(selector)
-            # Continue to the next item is this one did not exist or was already not visible
-            except ElementNotVisibleError:
-                pass
-            except ElementError:
-                pass
+        if not css_selectors:
+            return 0
+        detected = not (self.headers or self.footers) and self.sticky_elements is not None
+        try:
+            hidden = self.sh.hide_elements(css_selectors, sticky_only=detected)
+        # The capture goes ahead with the elements showing, as it would if none of them existed
+        except DriverExceptions as hide_error:
+            self.log.debug(f"Unable to hide the elements of {len(css_selectors)} selector(s): {hide_error}")
+            return 0
+        self.log.debug(f"Hid {hidden} element(s) matching {len(css_selectors)} selector(s)")
+        return hidden
 
     def _show_elements(self, css_selectors):
         """
-        Shows all elements in the given list
+        Puts back the elements in the given list that were hidden by _hide_elements, in a single call to the browser
         :param
             - css_selectors:    list - A list of the elements you would like to make visible
+        :return
+            - int: The number of elements that were shown
         """
-        # Show footer items again
-        for selector in css_selectors:
-            try:
-                self.sh.show_element(selector)
-            # Continue to the next item is this one did not exist
-            except ElementError:
-                pass
+        if not css_selectors:
+            return 0
+        try:
+            shown = self.sh.show_elements(css_selectors)
+        except DriverExceptions as show_error:
+            self.log.debug(f"Unable to show the elements of {len(css_selectors)} selector(s): {show_error}")
+            return 0
+        self.log.debug(f"Showed {shown} element(s) matching {len(css_selectors)} selector(s)")
+        return shown
 
     def _capture_headless_page(self, viewport_only):
         if self.paginated and not viewport_only:
             return self._capture_headless_paginated_page()
 
-        # Store the current size and scroll position of the browser
+        # Store the current size and scroll position of the browser. The size is the one WebDriver sets, since the
+        # window's outer size in the page is not always the same as it
         width, height = self.sh.get_window_size()
-        current_scroll_position = self.sh.get_window_current_scroll_position()
+        metrics = self.sh.get_page_metrics(self.content_container_selector)
+        current_scroll_position = metrics["scroll_y"]
 
         if not viewport_only:
-            content_height = self.sh.get_content_height(self.content_container_selector)
+            content_height = metrics["content_height"]
+            if content_height is None:
+                # Raises the error for the missing content container
+                content_height = self.sh.get_content_height(self.content_container_selector)
             if content_height > self.max_height:
                 self.sh.resize_browser(width, self.max_height + self.head_padding)
                 time.sleep(self.resize_delay)
@@ -345,72 +417,80 @@ class Screenshot:
         Captures the page viewport by viewport, leaving an overlap of pixels the height of the self.padding variable
         between each image
         """
-        image_list = []
-        scroll_padding = padding if padding else self.scroll_padding
-
-        # Scroll page to the top
-        self.sh.scroll_window_to_position(0)
-
-        current_scroll_position = 0
-        viewport_height = self.sh.driver.execute_script("return document.documentElement.clientHeight")
-
-        while True:
-            # Capture the image
-            image_list.append(self._capture_single_viewport())
-
-            # Scroll for the next one!
-            self.sh.scroll_window_to_position(current_scroll_position + viewport_height - scroll_padding)
-            time.sleep(0.25)
-            new_scroll_position = self.sh.get_window_current_scroll_position()
-
-            # Break if the scroll position did not change (because it was at the bottom)
-            if new_scroll_position == current_scroll_position:
-                break
-            else:
-                current_scroll_position = new_scroll_position
-
-        return image_list
+        return self._capture_viewports(self._capture_single_viewport, padding)
 
     def _capture_headless_paginated_page(self, padding=None):
         """
         Captures the page viewport by viewport, leaving an overlap of pixels the height of the self.padding variable
         between each image
         """
+        def capture_viewport(metrics):
+            image_data = self.sh.get_screenshot_base64()
+            decoded_data = base64.b64decode(image_data)
+            image = Image.open(BytesIO(decoded_data))
+            return self._create_image_file(image)
+
+        return self._capture_viewports(capture_viewport, padding)
+
+    def _capture_viewports(self, capture_viewport, padding=None):
+        """
+        Scrolls down the page one viewport at a time, capturing each one. The headers are only shown in the first
+        image and the footers only in the last, so that they do not cover the content of every image
+        :param
+            - capture_viewport: function - Captures the current viewport, given the page's metrics, and returns the
+                                           image file
+            - padding:          int - Overrides the height of the overlap between the images
+        :return
+            - list: The image files of each viewport, from the top of the page to the bottom
+        """
         image_list = []
         scroll_padding = padding if padding else self.scroll_padding
+        headers, footers = self.get_sticky_elements()
 
         # Scroll page to the top
         self.sh.scroll_window_to_position(0)
 
         current_scroll_position = 0
-        viewport_height = self.sh.driver.execute_script("return document.documentElement.clientHeight")
-
-        while True:
-            # Capture the image
-            image_data = self.sh.get_screenshot_base64()
-            decoded_data = base64.b64decode(image_data)
-            image = Image.open(BytesIO(decoded_data))
-            image_file = self._create_image_file(image)
-            image_list.append(image_file)
+        metrics = self._wait_for_scroll()
+        viewport_height = metrics["viewport_height"]
 
-            # Scroll for the next one!
-            self.sh.scroll_window_to_position(current_scroll_position + viewport_height - scroll_padding)
-            time.sleep(0.25)
-            new_scroll_position = self.sh.get_window_current_scroll_position()
+        try:
+            self._hide_elements(footers)
+            while True:
+                # Capture the image
+                image_list.append(capture_viewport(metrics))
+                if len(image_list) == 1:
+                    self._hide_elements(headers)
+
+                # Scroll for the next one!
+                self.sh.scroll_window_to_position(current_scroll_position + viewport_height - scroll_padding)
+                metrics = self._wait_for_scroll()
+                new_scroll_position = metrics["scroll_y"]
+
+                # Break if the scroll position did not change (because it was at the bottom)
+                if new_scroll_position == current_scroll_position:
+                    break
+                else:
+                    current_scroll_position = new_scroll_position
 
-            # Break if the scroll position did not change (because it was at the bottom)
-            if new_scroll_position == current_scroll_position:
-                break
-            else:
-                current_scroll_position = new_scroll_position
+            # - Capture the bottom of the page again, now with its footers
+            if self._show_elements(footers):
+                if len(image_list) == 1:
+                    self._show_elements(headers)
+                image_list[-1] = capture_viewport(metrics)
+        finally:
+            self._show_elements(headers)
+            self._show_elements(footers)
 
         return image_list
 
-    def _get_image_data(self, viewport_only=False):
+    def _get_image_data(self, viewport_only=False, metrics=None):
         """
         Creates an Image() canvas of the page. The image is cropped to be only the viewport area if specified.
         :param
             - viewport_only:    bool - Captures only the visible /viewport area if true
+            - metrics:          dict - The page's metrics from SeleniumHelpers.get_page_metrics, if they are already
+                                       known
 
         :return
             - image:    Image() - The image canvas of the captured data
@@ -429,10 +509,11 @@ class Screenshot:
         # image = Image.open(BytesIO(image_data))
 
         # - Crop the image to just the visible area
+        metrics = metrics or self.sh.get_page_metrics(self.content_container_selector)
         # Top of the viewport
-        current_scroll_position = self.sh.get_window_current_scroll_position()
+        current_scroll_position = metrics["scroll_y"]
         # Viewport Dimensions
-        viewport_width, viewport_height = self.sh.get_viewport_size()
+        viewport_width, viewport_height = metrics["viewport_width"], metrics["viewport_height"]
 
         # Image size of data returned by Selenium
         image_height, image_width = image.size
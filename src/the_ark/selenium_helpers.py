@@ -12,6 +12,186 @@ from selenium.webdriver.firefox.firefox_binary import FirefoxBinary
 from selenium.webdriver.support import expected_conditions as expected_condition
 from selenium.webdriver.support.ui import WebDriverWait
 
+# The attributes an element's inline display and visibility values are kept in while it is hidden, so that they can
+# be put back as they were
+HIDDEN_DISPLAY_ATTRIBUTE = "data-the-ark-display"
+HIDDEN_VISIBILITY_ATTRIBUTE = "data-the-ark-visibility"
+
+# Hides the first visible element matching each selector, in a single call to the browser. Sticky elements are only
+# hidden while they are still position: fixed or sticky, and with visibility: hidden so that the layout does not move
+HIDE_ELEMENTS_SCRIPT = """
+var selectors = arguments[0], displayAttribute = arguments[1], visibilityAttribute = arguments[2],
+    stickyOnly = arguments[3], matched = 0;
+for (var i = 0; i < selectors.length; i++) {
+    var element, style;
+    try { element = document.querySelector(selectors[i]); } catch (error) { continue; }
+    if (!element || !element.getClientRects().length) {
+        continue;
+    }
+    style = getComputedStyle(element);
+    if (style.visibility === "hidden" || (stickyOnly && style.position !== "fixed" && style.position !== "sticky")) {
+        continue;
+    }
+    var attribute = stickyOnly ? visibilityAttribute : displayAttribute;
+    var property = stickyOnly ? "visibility" : "display";
+    if (!element.hasAttribute(attribute)) {
+        element.setAttribute(attribute, element.style[property]);
+    }
+    element.style[property] = stickyOnly ? "hidden" : "none";
+    matched++;
+}
+return matched;
+"""
+
+# How close, in pixels, a fixed element must be to the top or bottom of the viewport to be counted as sticking to it
+STICKY_EDGE_DISTANCE = 10
+# Fixed elements taller than this share of the viewport are overlays, such as modals, rather than headers or footers
+STICKY_MAX_VIEWPORT_SHARE = 0.5
+
+# Finds the position: fixed and position: sticky elements that are stuck to the top or bottom of the viewport right
+# now, returning a css selector that matches each of them first. Elements inside one that was already found are left out
+STICKY_ELEMENTS_SCRIPT = """
+var edgeDistance = arguments[0], maxViewportShare = arguments[1];
+var viewportHeight = window.innerHeight || document.documentElement.clientHeight;
+var found = {headers: [], footers: []}, stuck = [];
+
+function getSelector(element) {
+    var parts = [];
+    while (element && element !== document.body) {
+        if (element.id && document.querySelectorAll("#" + CSS.escape(element.id)).length === 1) {
+            parts.unshift("#" + CSS.escape(element.id));
+            return parts.join(" > ");
+        }
+        var index = 1, sibling = element;
+        while ((sibling = sibling.previousElementSibling)) {
+            if (sibling.tagName === element.tagName) { index++; }
+        }
+        parts.unshift(element.tagName.toLowerCase() + ":nth-of-type(" + index + ")");
+        element = element.parentElement;
+    }
+    parts.unshift("body");
+    return parts.join(" > ");
+}
+
+var elements = document.body ? document.body.getElementsByTagName("*") : [];
+for (var i = 0; i < elements.length; i++) {
+    var element = elements[i], style = getComputedStyle(element);
+    if (style.position !== "fixed" && style.position !== "sticky") { continue; }
+    if (stuck.some(function(parent) { return parent.contains(element); })) { continue; }
+    var rect = element.getBoundingClientRect();
+    if (!rect.width || !rect.height || style.visibility === "hidden" || rect.height > viewportHeight * maxViewportShare) {
+        continue;
+    }
+
+    // - Sticky elements only count while they sit at the offset they stick at, not further down the page
+    var top = 0, bottom = 0, edge = null;
+    if (style.position === "sticky") {
+        if (style.top === "auto" && style.bottom === "auto") { continue; }
+        top = style.top !== "auto" ? parseFloat(style.top) || 0 : null;
+        bottom = style.bottom !== "auto" ? parseFloat(style.bottom) || 0 : null;
+    }
+    if (top !== null && rect.bottom > 0 && Math.abs(rect.top - top) <= edgeDistance) {
+        edge = "headers";
+    } else if (bottom !== null && rect.top < viewportHeight &&
+               Math.abs(viewportHeight - bottom - rect.bottom) <= edgeDistance) {
+        edge = "footers";
+    }
+    if (edge) {
+        stuck.push(element);
+        found[edge].push(getSelector(element));
+    }
+}
+return found;
+"""
+
+# Measures the page for a screenshot. The content height is null when there is no element matching the css selector
+MEASURE_PAGE_FUNCTION = """
+function measurePage(contentSelector) {
+    var content = document.querySelector(contentSelector);
+    return {
+        scroll_x: window.scrollX,
+        scroll_y: window.scrollY,
+        viewport_width: document.documentElement.clientWidth,
+        viewport_height: document.documentElement.clientHeight,
+        content_height: content ? Math.round(content.getBoundingClientRect().height) : null,
+        device_pixel_ratio: window.devicePixelRatio || 1
+    };
+}
+"""
+
+# Measures the page in a single call to the browser
+PAGE_METRICS_SCRIPT = MEASURE_PAGE_FUNCTION + """
+return measurePage(arguments[0]);
+"""
+
+# The longest, in seconds, to wait for the page to settle after it is scrolled
+SCROLL_SETTLE_TIMEOUT = 2
+# How often, in milliseconds, the page is checked while it settles
+SCROLL_SETTLE_INTERVAL = 50
+# The number of checks in a row that must find the page unchanged for it to have settled
+SCROLL_SETTLE_CHECKS = 2
+
+# Waits, in the browser, until the scroll position and height of the page (and of the scrolling element, if there is
+# one) have stopped changing and the images in the viewport have loaded, or until the timeout. The page's metrics are
+# returned along with whether it "settled" and the milliseconds it took
+SCROLL_SETTLE_SCRIPT = MEASURE_PAGE_FUNCTION + """
+var contentSelector = arguments[0], scrollSelector = arguments[1], timeout = arguments[2], interval = arguments[3],
+    settleChecks = arguments[4], done = arguments[arguments.length - 1];
+var start = Date.now(), lastState = null, unchanged = 0;
+
+function getState() {
+    var element = scrollSelector ? document.querySelector(scrollSelector) : null;
+    var root = document.documentElement, pendingImages = 0;
+    for (var i = 0; i < document.images.length; i++) {
+        var image = document.images[i];
+        if (image.complete) { continue; }
+        var rect = image.getBoundingClientRect();
+        if (rect.bottom > 0 && rect.top < root.clientHeight && rect.right > 0 && rect.left < root.clientWidth) {
+            pendingImages++;
+        }
+    }
+    return [window.scrollX, window.scrollY, root.scrollHeight, element ? element.scrollTop : 0,
+            element ? element.scrollLeft : 0, element ? element.scrollHeight : 0, pendingImages].join(",");
+}
+
+function check() {
+    var state = getState();
+    unchanged = state === lastState ? unchanged + 1 : 0;
+    lastState = state;
+    var settled = unchanged >= settleChecks && /,0$/.test(state);
+    if (settled || Date.now() - start >= timeout) {
+        var metrics = measurePage(contentSelector);
+        metrics.settled = settled;
+        metrics.settle_time = Date.now() - start;
+        done(metrics);
+    } else {
+        setTimeout(check, interval);
+    }
+}
+check();
+"""
+
+# Puts back the display value of the first element matching each selector that was hidden by HIDE_ELEMENTS_SCRIPT
+SHOW_ELEMENTS_SCRIPT = """
+var selectors = arguments[0], attributes = {display: arguments[1], visibility: arguments[2]}, matched = 0;
+for (var i = 0; i < selectors.length; i++) {
+    var element, shown = false;
+    try { element = document.querySelector(selectors[i]); } catch (error) { continue; }
+    if (!element) {
+        continue;
+    }
+    for (var property in attributes) {
+        if (element.hasAttribute(attributes[property])) {
+            element.style[property] = element.getAttribute(attributes[property]);
+            element.removeAttribute(attributes[property]);
+            shown = true;
+        }
+    }
+    if (shown) { matched++; }
+}
+return matched;
+"""
+
 
 class SeleniumHelpers:
     def __init__(self):
@@ -21,6 +201,7 @@ class SeleniumHelpers:
         self.log = logging.getLogger(self.__class__.__name__)
         self.driver = None
         self.desired_capabilities = {}
+        self.script_timeout = None
 
     def create_driver(self, **desired_capabilities):
         """
@@ -82,6 +263,7 @@ class SeleniumHelpers:
 
             # Set the desired_capabilities variable on the class if the browser creation was successful
             self.desired_capabilities = desired_capabilities
+            self.script_timeout = None
 
             return self.driver
         except Exception as driver_creation_error:
@@ -200,6 +382,48 @@ class SeleniumHelpers:
                       f"{refresh_driver_error}"
             raise DriverURLError(msg=message, stacktrace=traceback.format_exc())
 
+    def get_page_metrics(self, css_selector="html"):
+        """
+        This will get the scroll position, the viewport size, the content height and the device pixel ratio of the page
+        all at once, with a single script, instead of a call to the browser for each of them.
+        :param
+            -   css_selector:   string - The element whose height is the height of the content.
+        :return
+            -   metrics:    dict - The page's "scroll_x", "scroll_y", "viewport_width", "viewport_height",
+                                   "content_height" and "device_pixel_ratio". The content_height is None when there is
+                                   no element matching the css_selector.
+        """
+        try:
+            return self.execute_script(PAGE_METRICS_SCRIPT, css_selector)
+        except DriverExceptions as metrics_error:
+            metrics_error.msg = "Unable to get the metrics of the page. | " + metrics_error.msg
+            raise metrics_error
+
+    def wait_for_scroll_settle(self, css_selector=None, content_selector="html", timeout=SCROLL_SETTLE_TIMEOUT):
+        """
+        This will wait, in a single call to the browser, until the page has settled after being scrolled. That is when
+        the scroll position and height of the page, and of the scrolling element if one is given, have stopped
+        changing and the images in the viewport have finished loading. It gives up waiting after the timeout.
+        :param
+            -   css_selector:       string - The scrolling element that was scrolled, if it was not the window.
+            -   content_selector:   string - The element whose height is the height of the content.
+            -   timeout:            int - The longest, in seconds, to wait for the page to settle.
+        :return
+            -   metrics:    dict - The page's metrics, as from get_page_metrics, once it has settled. Along with
+                                   whether it "settled" before the timeout, and the "settle_time" in milliseconds.
+        """
+        try:
+            # - Give the browser enough time to run the script to its own timeout
+            if self.script_timeout != timeout:
+                self.driver.set_script_timeout(timeout + 5)
+                self.script_timeout = timeout
+            return self.driver.execute_async_script(SCROLL_SETTLE_SCRIPT, content_selector, css_selector,
+                                                    int(timeout * 1000), SCROLL_SETTLE_INTERVAL, SCROLL_SETTLE_CHECKS)
+        except Exception as unexpected_error:
+            message = f"Unable to wait for the page to settle after scrolling on page {(self.driver.current_url)!r}.\n" \
+                      f"{unexpected_error}"
+            raise DriverAttributeError(msg=message, stacktrace=traceback.format_exc())
+
     def get_viewport_size(self, get_only_width=False, get_only_height=False):
         """
         This will get the width and/or height of the viewport. The reason for not using driver.get_window_size here
@@ -1060,6 +1284,56 @@ class SeleniumHelpers:
             raise ElementError(msg=message, stacktrace=traceback.format_exc(),
                                current_url=self.driver.current_url, css_selector=css_selector)
 
+    def hide_elements(self, css_selectors, sticky_only=False):
+        """
+        This will hide the first visible element matching each of the selectors, with a single script. The elements'
+        display values are kept so that show_elements() can put them back as they were.
+        :param
+            -   css_selectors:  list - The css selectors of the elements to hide.
+            -   sticky_only:    bool - If True, only elements that are position: fixed or sticky are hidden, and they
+                                       are hidden with visibility: hidden so that the rest of the page does not move.
+        :return
+            -   matched:        int - The number of elements that were hidden.
+        """
+        try:
+            return self.execute_script(HIDE_ELEMENTS_SCRIPT, list(css_selectors), HIDDEN_DISPLAY_ATTRIBUTE,
+                                       HIDDEN_VISIBILITY_ATTRIBUTE, sticky_only) or 0
+        except DriverExceptions as hide_error:
+            hide_error.msg = "Unable to hide elements. | " + hide_error.msg
+            raise hide_error
+
+    def show_elements(self, css_selectors):
+        """
+        This will put back the display or visibility value of the first element matching each of the selectors, with a
+        single script. Only the elements hidden by hide_elements() are changed.
+        :param
+            -   css_selectors:  list - The css selectors of the elements to show.
+        :return
+            -   matched:        int - The number of elements that were shown.
+        """
+        try:
+            return self.execute_script(SHOW_ELEMENTS_SCRIPT, list(css_selectors), HIDDEN_DISPLAY_ATTRIBUTE,
+                                       HIDDEN_VISIBILITY_ATTRIBUTE) or 0
+        except DriverExceptions as show_error:
+            show_error.msg = "Unable to show elements. | " + show_error.msg
+            raise show_error
+
+    def find_sticky_elements(self, edge_distance=STICKY_EDGE_DISTANCE, max_viewport_share=STICKY_MAX_VIEWPORT_SHARE):
+        """
+        This will find the elements that are stuck to the top or bottom of the viewport right now, with a single script.
+        :param
+            -   edge_distance:      int - How close, in pixels, a fixed element must be to an edge of the viewport.
+            -   max_viewport_share: float - The share of the viewport's height above which an element is not counted.
+        :return
+            -   sticky_elements:    dict - The css selectors of the "headers" and the "footers" that were found.
+        """
+        try:
+            sticky_elements = self.execute_script(STICKY_ELEMENTS_SCRIPT, edge_distance, max_viewport_share) or {}
+            return {"headers": sticky_elements.get("headers", []), "footers": sticky_elements.get("footers", [])}
+        except DriverExceptions as sticky_error:
+            sticky_error.msg = "Unable to find the sticky elements. | " + sticky_error.msg
+            raise sticky_error
+
     def add_cookie(self, name=None, value=None):
         """
             This will show a specified element.